@@ -14,6 +14,18 @@ DEVICE_ID = os.getenv("DEVICE_ID", "device001")
 # Sử dụng tài khoản admin để có đầy đủ quyền
 MQTT_USER = os.getenv("MQTT_USER", "admin")
 MQTT_PASS = os.getenv("MQTT_PASS", "admin")
+# Phiên bản giao thức MQTT: "3.1.1" hoặc "5"
+MQTT_PROTOCOL = os.getenv("MQTT_PROTOCOL", "3.1.1")
+
+# Worker mode: chạy nhiều process server cùng chia thiết bị
+# MQTT_WORKER_COUNT > 1 bật shared subscription ($share/<group>/...) cho các topic không có trạng thái
+MQTT_WORKER_COUNT = int(os.getenv("MQTT_WORKER_COUNT", "1"))
+MQTT_WORKER_INDEX = int(os.getenv("MQTT_WORKER_INDEX", "0"))
+MQTT_SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "pbl6-server")
+# Cách chia topic audio stream giữa các worker:
+# - "shard": mọi worker nhận, chỉ worker có crc32(device_id) % count == index xử lý (chạy được với mosquitto)
+# - "shared": dùng $share, chỉ an toàn khi broker chia theo client id (vd. EMQX hash_clientid)
+MQTT_STREAM_ROUTING = os.getenv("MQTT_STREAM_ROUTING", "shard")
 
 LLM_BASE_URL = os.getenv("LLM_BASE_URL")
 LLM_API_KEY = os.getenv("LLM_API_KEY")
@@ -28,8 +40,107 @@ SERP_API_KEY = os.getenv("SERP_API_KEY")
 
 AUDIO_SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", "16000"))
 AUDIO_CHUNK_MS = int(os.getenv("AUDIO_CHUNK_MS", "500"))
+# Lưu audio nhận được vào audio/recordings (chỉ dùng khi debug)
+AUDIO_SAVE_RECORDINGS = os.getenv("AUDIO_SAVE_RECORDINGS", "False").lower() == "true"
+# Yêu cầu thiết bị gửi lại các chunk bị mất (server/{deviceId}/audio/nack)
+AUDIO_NACK_ENABLED = os.getenv("AUDIO_NACK_ENABLED", "True").lower() == "true"
+AUDIO_NACK_TIMEOUT_MS = float(os.getenv("AUDIO_NACK_TIMEOUT_MS", "300"))
+AUDIO_NACK_MAX_RETRIES = int(os.getenv("AUDIO_NACK_MAX_RETRIES", "3"))
+# Stream không nhận thêm chunk sau AUDIO_STREAM_TTL_S giây thì bị bỏ; giới hạn bộ nhớ buffer (bytes)
+AUDIO_STREAM_TTL_S = float(os.getenv("AUDIO_STREAM_TTL_S", "10"))
+AUDIO_STREAM_MAX_DEVICE_BYTES = int(os.getenv("AUDIO_STREAM_MAX_DEVICE_BYTES", str(4 * 1024 * 1024)))
+AUDIO_STREAM_MAX_TOTAL_BYTES = int(os.getenv("AUDIO_STREAM_MAX_TOTAL_BYTES", str(64 * 1024 * 1024)))
+
+# Backend STT theo tên trong module.stt.registry: "phowhisper" (fp32) hoặc "phowhisper-int8" (lượng tử hóa động, chỉ CPU)
+STT_BACKEND = os.getenv("STT_BACKEND", "phowhisper")
+# Thiết bị chạy model STT, chọn một lần khi khởi động: auto, cpu, cuda, cuda:0...
+STT_DEVICE = os.getenv("STT_DEVICE", "cpu")
+# Chạy thử model khi khởi động để request đầu tiên không bị chậm
+STT_WARMUP = os.getenv("STT_WARMUP", "True").lower() == "true"
+
+# Pool worker STT: số worker, kiểu worker ("thread" hoặc "process"), giới hạn hàng đợi và timeout
+STT_WORKERS = int(os.getenv("STT_WORKERS", "1"))
+STT_WORKER_MODE = os.getenv("STT_WORKER_MODE", "thread")
+STT_MAX_PENDING = int(os.getenv("STT_MAX_PENDING", "16"))
+STT_TIMEOUT_S = float(os.getenv("STT_TIMEOUT_S", "60"))
+# STT_WORKER_MODE=process: nạp model một lần rồi fork worker dùng chung weights (copy-on-write + shared memory)
+STT_SHARE_WEIGHTS = os.getenv("STT_SHARE_WEIGHTS", "True").lower() == "true"
+# Gom các yêu cầu STT đồng thời thành batch: kích thước tối đa (1 = tắt) và thời gian chờ gom (ms)
+STT_BATCH_SIZE = int(os.getenv("STT_BATCH_SIZE", "1"))
+STT_BATCH_WAIT_MS = float(os.getenv("STT_BATCH_WAIT_MS", "10"))
+
+# VAD cắt im lặng đầu/cuối và bỏ các đoạn chỉ toàn im lặng trước khi STT
+STT_VAD_ENABLED = os.getenv("STT_VAD_ENABLED", "True").lower() == "true"
+STT_VAD_THRESHOLD_DB = float(os.getenv("STT_VAD_THRESHOLD_DB", "12"))
+# Tiền xử lý audio trước STT: resample về 16 kHz, bỏ DC, chuẩn hóa mức RMS
+STT_DSP_ENABLED = os.getenv("STT_DSP_ENABLED", "True").lower() == "true"
+STT_DSP_TARGET_RMS_DB = float(os.getenv("STT_DSP_TARGET_RMS_DB", "-20"))
+
+# Nhận dạng tăng dần trong lúc audio còn đang tới (có thể bật riêng từng thiết bị)
+STT_INCREMENTAL = os.getenv("STT_INCREMENTAL", "False").lower() == "true"
+STT_INCREMENTAL_WINDOW_S = float(os.getenv("STT_INCREMENTAL_WINDOW_S", "8"))
+STT_INCREMENTAL_OVERLAP_S = float(os.getenv("STT_INCREMENTAL_OVERLAP_S", "1"))
+
+# Số message tối đa đang chờ xử lý cho mỗi thiết bị, vượt quá sẽ bị bỏ
+DISPATCH_QUEUE_SIZE = int(os.getenv("DISPATCH_QUEUE_SIZE", "256"))
+# Kích thước chunk và khoảng nghỉ tối đa giữa các chunk audio gửi về thiết bị
+EGRESS_CHUNK_SIZE = int(os.getenv("EGRESS_CHUNK_SIZE", str(1024 * 8)))
+EGRESS_CHUNK_INTERVAL_MS = float(os.getenv("EGRESS_CHUNK_INTERVAL_MS", "50"))
+# Codec nén audio gửi về thiết bị theo thứ tự ưu tiên, chọn theo danh sách "codecs" thiết bị gửi trong info.
+# Opus (cần opuslib) mã hóa bằng C; IMA-ADPCM là vòng lặp Python tốn ~16 ms CPU mỗi giây audio 24 kHz
+# và giữ GIL, nên EGRESS_CODEC_WORKERS chỉ đẩy việc ra khỏi event loop chứ không mã hóa song song
+EGRESS_CODECS = [codec.strip().lower() for codec in os.getenv("EGRESS_CODECS", "opus,ima-adpcm,pcm16le").split(",") if codec.strip()]
+EGRESS_CODEC_WORKERS = int(os.getenv("EGRESS_CODEC_WORKERS", "2"))
+EGRESS_OPUS_BITRATE = int(os.getenv("EGRESS_OPUS_BITRATE", "24000"))
+# Admission control: số việc đồng thời của từng tầng pipeline, hàng đợi mỗi tầng và số yêu cầu mỗi thiết bị
+ADMISSION_STT_CONCURRENCY = int(os.getenv("ADMISSION_STT_CONCURRENCY", str(STT_WORKERS * max(1, STT_BATCH_SIZE))))
+ADMISSION_LLM_CONCURRENCY = int(os.getenv("ADMISSION_LLM_CONCURRENCY", "8"))
+ADMISSION_TTS_CONCURRENCY = int(os.getenv("ADMISSION_TTS_CONCURRENCY", "4"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "16"))
+ADMISSION_QUEUE_TIMEOUT_S = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_S", "10"))
+ADMISSION_MAX_INFLIGHT_PER_DEVICE = int(os.getenv("ADMISSION_MAX_INFLIGHT_PER_DEVICE", "2"))
+# Câu trả lời dựng sẵn khi hệ thống quá tải
+BUSY_MESSAGE = os.getenv("BUSY_MESSAGE", "Hệ thống đang bận, bạn vui lòng thử lại sau giây lát.")
+# Chu kỳ ghi log thống kê của server (giây), 0 = tắt
+STATS_INTERVAL_S = float(os.getenv("STATS_INTERVAL_S", "60"))
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 TTS_VOICE = "nu-nhe-nhang"
-TTS_SPEED = 1.0
\ No newline at end of file
+TTS_SPEED = 1.0
+# Server TTS (OpenAI-compatible /v1/audio/speech), client giữ kết nối keep-alive dùng chung
+TTS_BASE_URL = os.getenv("TTS_BASE_URL", "http://localhost:8298")
+TTS_API_KEY = os.getenv("TTS_API_KEY", "viet-tts")
+TTS_TIMEOUT_S = float(os.getenv("TTS_TIMEOUT_S", "300"))
+TTS_MAX_CONNECTIONS = int(os.getenv("TTS_MAX_CONNECTIONS", "8"))
+# Chuyển thẳng audio TTS tới thiết bị trong lúc server TTS còn đang tổng hợp
+TTS_STREAMING = os.getenv("TTS_STREAMING", "True").lower() == "true"
+TTS_STREAM_FORMAT = os.getenv("TTS_STREAM_FORMAT", "wav")
+# Sample rate của PCM thô khi server TTS không báo trong header
+TTS_STREAM_SAMPLE_RATE = int(os.getenv("TTS_STREAM_SAMPLE_RATE", "24000"))
+# Số câu được tổng hợp trước trong lúc câu hiện tại đang phát (0 = tuần tự từng câu)
+TTS_LOOKAHEAD = int(os.getenv("TTS_LOOKAHEAD", "2"))
+# Tách câu cho TTS: câu ngắn hơn MIN được gộp với câu sau, dài hơn MAX thì cắt ở dấu phẩy;
+# LLM ngừng ra chữ quá IDLE_MS thì đọc luôn phần đã có
+TTS_SEGMENT_MIN_CHARS = int(os.getenv("TTS_SEGMENT_MIN_CHARS", "16"))
+TTS_SEGMENT_MAX_CHARS = int(os.getenv("TTS_SEGMENT_MAX_CHARS", "200"))
+TTS_SEGMENT_IDLE_MS = float(os.getenv("TTS_SEGMENT_IDLE_MS", "1000"))
+# Cache audio TTS theo (câu, giọng, tốc độ): LRU trong bộ nhớ và tầng trên đĩa
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "True").lower() == "true"
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(BASE_DIR, "cache", "tts"))
+TTS_CACHE_DISK_MAX_BYTES = int(os.getenv("TTS_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+# Câu không dựng sẵn chỉ được ghi xuống đĩa khi đã dùng ít nhất N lần (0 = chỉ câu dựng sẵn),
+# câu trả lời dùng một lần chỉ nằm trong bộ nhớ
+TTS_CACHE_DISK_MIN_USES = int(os.getenv("TTS_CACHE_DISK_MIN_USES", "3"))
+# Câu ngắn hơn ngưỡng này được lưu vào cache sau khi tổng hợp (0 = chỉ cache các câu dựng sẵn)
+TTS_CACHE_MAX_CHARS = int(os.getenv("TTS_CACHE_MAX_CHARS", "80"))
+# Các câu hay dùng được dựng sẵn khi khởi động, phân cách bằng "|"
+TTS_CACHE_PREWARM = [phrase.strip() for phrase in os.getenv("TTS_CACHE_PREWARM", "|".join([
+    "Xin chào! Tôi là trợ lý ảo của bạn.",
+    "Dừng lại! Phía trước có vật cản!",
+    "Trợ lý của bạn đã nhận được yêu cầu, chúng tôi đang xử lý.",
+    "Xin lỗi, đã xảy ra lỗi khi xử lý yêu cầu của bạn.",
+])).split("|") if phrase.strip()]
+# Ghi audio TTS ra debug/ để kiểm tra
+TTS_DEBUG_DUMP = os.getenv("TTS_DEBUG_DUMP", "False").lower() == "true"
@@ -1,60 +1,238 @@
 import asyncio
+import io
 import os
+import struct
 import httpx
 import sys
 import soundfile as sf
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from config import BASE_DIR, TTS_VOICE, TTS_SPEED
+from config import (
+    BASE_DIR, TTS_VOICE, TTS_SPEED, TTS_BASE_URL, TTS_API_KEY, TTS_TIMEOUT_S,
+    TTS_MAX_CONNECTIONS, TTS_DEBUG_DUMP, TTS_STREAM_FORMAT, TTS_STREAM_SAMPLE_RATE
+)
 from log import setup_logger
 
 logger = setup_logger(__name__)
-    
+
+EXT_MAP = {
+    "audio/mpeg": ".mp3",
+    "audio/mp3": ".mp3",
+    "audio/wav": ".wav",
+    "audio/x-wav": ".wav",
+    "audio/ogg": ".ogg",
+    "audio/flac": ".flac",
+    "audio/x-flac": ".flac",
+}
+
+# Content-Type của PCM 16-bit thô có thể chuyển thẳng tới thiết bị
+RAW_PCM_TYPES = {"audio/pcm", "audio/l16", "audio/raw"}
+
+# Client dùng chung cho mọi lần gọi TTS: giữ kết nối keep-alive thay vì bắt tay TCP mỗi câu
+_client = None
+
+
+def get_tts_client() -> httpx.AsyncClient:
+    """
+    Trả về AsyncClient dùng chung (tạo lần đầu khi cần, trên event loop đang chạy)
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=TTS_BASE_URL,
+            headers={"Authorization": f"Bearer {TTS_API_KEY}"},
+            timeout=httpx.Timeout(TTS_TIMEOUT_S, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=TTS_MAX_CONNECTIONS,
+                max_keepalive_connections=TTS_MAX_CONNECTIONS,
+                keepalive_expiry=60.0
+            ),
+        )
+    return _client
+
+
+async def close_tts_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def read_sample_rate(audio_bytes: bytes, headers) -> int:
+    """
+    Lấy sample rate từ header của response, nếu không có thì đọc header audio trong bộ nhớ
+    """
+    for name in ("X-Sample-Rate", "X-Audio-Sample-Rate"):
+        if headers.get(name):
+            return int(headers[name])
+    # Content-Type kiểu "audio/L16; rate=24000"
+    for param in headers.get("Content-Type", "").split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key == "rate" and value.isdigit():
+            return int(value)
+    return int(sf.info(io.BytesIO(audio_bytes)).samplerate)
+
+
+def _dump_audio(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
 async def generate_tts(text: str, file_name: str=None) -> tuple[bytes, int]:
     logger.info(f"Generating TTS for {text}")
-    async with httpx.AsyncClient() as client:
-        res = await client.post(
-            "http://localhost:8298/v1/audio/speech",
-            headers={"Authorization": "Bearer viet-tts", "Content-Type": "application/json"},
-            json={"model": "tts-1", "input": text, "voice": TTS_VOICE, "speed": TTS_SPEED}, timeout=300 # 5 minutes
-        )
-        res.raise_for_status()
-        audio_bytes = res.content
-        content_type = res.headers.get("Content-Type", "").split(";")[0].strip()
-
-    ext_map = {
-        "audio/mpeg": ".mp3",
-        "audio/mp3": ".mp3",
-        "audio/wav": ".wav",
-        "audio/x-wav": ".wav",
-        "audio/ogg": ".ogg",
-        "audio/flac": ".flac",
-        "audio/x-flac": ".flac",
-    }
-    file_ext = ext_map.get(content_type, ".mp3")
-
-    output_path = os.path.join(BASE_DIR, "debug",f"{file_name if file_name else "tts_test"}{file_ext}")
-
-    def write_file(path: str, data: bytes):
-        with open(path, "wb") as f:
-            f.write(data)
-            
-        _, fs = sf.read(path)
-        return int(fs)
-    fs = write_file(output_path, audio_bytes)
-    # await asyncio.to_thread(write_file, output_path, audio_bytes)
-    logger.info(f"Saved TTS to: {output_path} with sample rate: {fs}")
+    client = get_tts_client()
+    res = await client.post(
+        "/v1/audio/speech",
+        json={"model": "tts-1", "input": text, "voice": TTS_VOICE, "speed": TTS_SPEED}
+    )
+    res.raise_for_status()
+    audio_bytes = res.content
+    content_type = res.headers.get("Content-Type", "").split(";")[0].strip()
+
+    fs = read_sample_rate(audio_bytes, res.headers)
+
+    # Chỉ ghi file debug khi bật, ở worker thread để không chặn event loop
+    if TTS_DEBUG_DUMP or file_name:
+        file_ext = EXT_MAP.get(content_type, ".mp3")
+        output_path = os.path.join(BASE_DIR, "debug", f"{file_name or 'tts_test'}{file_ext}")
+        await asyncio.to_thread(_dump_audio, output_path, audio_bytes)
+        logger.info(f"Saved TTS to: {output_path} with sample rate: {fs}")
     return audio_bytes, fs
-    
+
+
+def parse_wav_header(buffer: bytes):
+    """
+    Đọc header WAV ở đầu stream (RIFF, các chunk tới "data")
+
+    Returns:
+        tuple hoặc None: (sample_rate, channels, bits_per_sample, data_offset), None nếu chưa đủ bytes
+
+    Raises:
+        ValueError: không phải WAV PCM
+    """
+    if len(buffer) < 12:
+        return None
+    if buffer[:4] != b"RIFF" or buffer[8:12] != b"WAVE":
+        raise ValueError("Not a RIFF/WAVE stream")
+    offset = 12
+    fmt = None
+    while len(buffer) >= offset + 8:
+        chunk_id = buffer[offset:offset + 4]
+        chunk_size = struct.unpack_from("<I", buffer, offset + 4)[0]
+        if chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk before fmt chunk")
+            return (*fmt, offset + 8)
+        if len(buffer) < offset + 8 + chunk_size:
+            return None
+        if chunk_id == b"fmt ":
+            audio_format, channels, sample_rate = struct.unpack_from("<HHI", buffer, offset + 8)
+            bits_per_sample = struct.unpack_from("<H", buffer, offset + 22)[0]
+            if audio_format != 1:
+                raise ValueError(f"Unsupported WAV encoding {audio_format}")
+            fmt = (sample_rate, channels, bits_per_sample)
+        # Chunk RIFF có độ dài lẻ được đệm thêm 1 byte
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+async def stream_tts(text: str):
+    """
+    Tổng hợp một câu và trả về audio theo từng phần ngay khi server TTS gửi tới
+
+    Yields:
+        tuple: (data, format_audio, sample_rate). Với WAV/PCM 16-bit mono, data là các
+        phần PCM thô (độ dài chẵn) yield dần; định dạng khác (mp3, ...) không cắt được
+        giữa chừng nên yield một lần toàn bộ body.
+    """
+    logger.info(f"Streaming TTS for {text}")
+    client = get_tts_client()
+    async with client.stream(
+        "POST",
+        "/v1/audio/speech",
+        json={"model": "tts-1", "input": text, "voice": TTS_VOICE, "speed": TTS_SPEED,
+              "response_format": TTS_STREAM_FORMAT}
+    ) as res:
+        res.raise_for_status()
+        content_type = res.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        raw_pcm = content_type in RAW_PCM_TYPES
+        sample_rate = None
+        if raw_pcm:
+            try:
+                sample_rate = read_sample_rate(b"", res.headers)
+            except (RuntimeError, ValueError):
+                sample_rate = TTS_STREAM_SAMPLE_RATE
+
+        pending = b""
+        passthrough = raw_pcm
+        # WAV chỉ chuyển thẳng được khi là PCM 16-bit mono, còn lại thì đọc hết body
+        streamable = raw_pcm or content_type in ("audio/wav", "audio/x-wav", "audio/wave")
+        body = []
+        async for piece in res.aiter_bytes():
+            if not passthrough:
+                body.append(piece)
+                if not streamable:
+                    continue
+                header = b"".join(body)
+                try:
+                    parsed = parse_wav_header(header)
+                except ValueError as e:
+                    logger.warning(f"Cannot stream TTS audio: {e}")
+                    streamable = False
+                    continue
+                if parsed is None:
+                    continue
+                sample_rate, channels, bits_per_sample, data_offset = parsed
+                if channels != 1 or bits_per_sample != 16:
+                    logger.warning(f"Cannot stream {channels}ch/{bits_per_sample}-bit TTS audio, buffering")
+                    streamable = False
+                    continue
+                passthrough = True
+                body = []
+                piece = header[data_offset:]
+
+            # Giữ lại byte lẻ để mỗi phần gửi đi chứa số nguyên sample 16-bit
+            data = pending + piece
+            cut = len(data) & ~1
+            pending = data[cut:]
+            if cut:
+                yield data[:cut], "pcm16le", sample_rate
+
+        if not passthrough and body:
+            audio_bytes = b"".join(body)
+            format_audio = EXT_MAP.get(content_type, ".mp3").lstrip(".")
+            yield audio_bytes, format_audio, read_sample_rate(audio_bytes, res.headers)
+
+
+async def synthesize_full(text: str) -> tuple[bytes, str, int]:
+    """
+    Tổng hợp trọn một câu qua stream_tts
+
+    Returns:
+        tuple: (audio_bytes, format_audio, sample_rate), format_audio là "pcm16le" khi audio được chuyển thẳng
+    """
+    pieces = []
+    format_audio = sample_rate = None
+    async for data, format_audio, sample_rate in stream_tts(text):
+        pieces.append(data)
+    if format_audio is None:
+        raise ValueError(f"TTS returned no audio for '{text}'")
+    return b"".join(pieces), format_audio, sample_rate
+
+
 async def main():
     tasks = [
         generate_tts("Xin chào! Tôi là trợ lý ảo của bạn.", "hello"),
         generate_tts("Dừng lại! Phía trước có vật cản!", "stop"),
         generate_tts("Trợ lý của bạn đã nhận được yêu cầu, chúng tôi đang xử lý.", "processing"),
     ]
-    return await asyncio.gather(*tasks)
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        await close_tts_client()
 
 if __name__ == "__main__":
-    
+
     saved_path = asyncio.run(main())
-    print(saved_path)
\ No newline at end of file
+    print(saved_path)
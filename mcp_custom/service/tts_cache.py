@@ -0,0 +1,287 @@
+"""
+Cache audio TTS của các câu lặp lại: LRU trong bộ nhớ (giới hạn bytes) và tầng lưu trên đĩa
+"""
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import time
+
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+# Số câu tối đa được đếm số lần dùng (câu đếm lâu nhất bị quên trước)
+USE_COUNTS_MEMORY = 4096
+
+
+class TTSCache:
+    def __init__(self, synthesize, voice, speed, audio_format, memory_bytes=32 * 1024 * 1024,
+                 cache_dir=None, disk_max_bytes=0, disk_min_uses=0):
+        """
+        Cache audio TTS theo khóa (câu, giọng, tốc độ, định dạng)
+
+        Các câu dựng sẵn lúc khởi động được ghim: không bị LRU đẩy ra khỏi bộ nhớ hay xóa khỏi đĩa.
+        Chỉ câu ghim và câu đã được dùng ít nhất disk_min_uses lần mới được ghi xuống đĩa: câu
+        trả lời chỉ xuất hiện một lần (nội dung hội thoại) chỉ nằm trong LRU bộ nhớ.
+        Mọi thao tác trên bộ nhớ chạy trên event loop; đọc/ghi đĩa chạy ở worker thread.
+
+        Args:
+            synthesize: coroutine function(text) -> (audio_bytes, format_audio, sample_rate)
+            voice, speed, audio_format: cấu hình giọng đọc, là một phần của khóa cache
+            memory_bytes (int): tổng bytes audio tối đa giữ trong bộ nhớ
+            cache_dir (str): thư mục tầng đĩa (None = chỉ dùng bộ nhớ)
+            disk_max_bytes (int): tổng bytes tối đa trên đĩa (0 = không giới hạn)
+            disk_min_uses (int): số lần dùng để câu không ghim được ghi xuống đĩa (0 = chỉ câu ghim)
+        """
+        self._synthesize = synthesize
+        self.voice = voice
+        self.speed = speed
+        self.audio_format = audio_format
+        self.memory_bytes = memory_bytes
+        self.cache_dir = cache_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_min_uses = disk_min_uses
+
+        # key -> (audio_bytes, format_audio, sample_rate), cũ nhất trước
+        self._memory = collections.OrderedDict()
+        self._memory_used = 0
+        # key -> số bytes của file audio trên đĩa, dùng lâu nhất trước
+        self._disk = collections.OrderedDict()
+        self._disk_used = 0
+        self._pinned = set()
+        self._writes = set()
+        # key -> số lần câu được tra cache hoặc lưu vào cache
+        self._uses = collections.OrderedDict()
+        # Các key đang được ghi xuống đĩa
+        self._persisting = set()
+
+        self.stats = {
+            "hits_memory": 0,
+            "hits_disk": 0,
+            "misses": 0,
+            "stored": 0,
+            "evicted_memory": 0,
+            "evicted_disk": 0,
+            "disk_errors": 0,
+        }
+        if cache_dir:
+            self._scan_disk()
+
+    def key(self, text):
+        normalized = " ".join(text.split())
+        raw = f"{self.voice}|{self.speed}|{self.audio_format}|{normalized}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, text):
+        """
+        Audio đã cache của câu (bộ nhớ trước, rồi tới đĩa)
+
+        Returns:
+            tuple hoặc None: (audio_bytes, format_audio, sample_rate)
+        """
+        key = self.key(text)
+        self._count_use(key)
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            self.stats["hits_memory"] += 1
+            # Câu dùng lại đủ nhiều lần thì mới giữ lại qua lần khởi động sau
+            self._maybe_persist(key, text, entry)
+            return entry
+        entry = await self._load_disk(key)
+        if entry is not None:
+            self.stats["hits_disk"] += 1
+            return entry
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, text, audio, format_audio, sample_rate, pinned=False):
+        """
+        Lưu audio của một câu vào bộ nhớ, câu ghim hoặc dùng đủ nhiều lần thì ghi nền
+        xuống đĩa (gọi trên event loop)
+        """
+        key = self.key(text)
+        entry = (bytes(audio), format_audio, sample_rate)
+        if pinned:
+            self._pinned.add(key)
+        self._remember(key, entry)
+        self.stats["stored"] += 1
+        self._maybe_persist(key, text, entry)
+
+    async def prewarm(self, phrases):
+        """
+        Dựng sẵn và ghim audio của các câu (lấy từ đĩa nếu đã có, không tính vào hit/miss)
+
+        Returns:
+            dict: câu -> (audio_bytes, format_audio, sample_rate) của các câu dựng được
+        """
+        started = time.perf_counter()
+        rendered = {}
+        synthesized = 0
+        for text in phrases:
+            key = self.key(text)
+            self._pinned.add(key)
+            entry = self._memory.get(key) or await self._load_disk(key)
+            if entry is None:
+                try:
+                    entry = await self._synthesize(text)
+                except Exception as e:
+                    logger.error(f"Failed to pre-render TTS for '{text}': {e}")
+                    continue
+                self.put(text, *entry, pinned=True)
+                synthesized += 1
+            rendered[text] = entry
+        logger.info(f"Pre-rendered {len(rendered)}/{len(phrases)} TTS phrases "
+                    f"({synthesized} synthesized) in {time.perf_counter() - started:.1f}s")
+        return rendered
+
+    def get_stats(self):
+        hits = self.stats["hits_memory"] + self.stats["hits_disk"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_used,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_used,
+            "pinned": len(self._pinned),
+        }
+
+    def _count_use(self, key):
+        self._uses[key] = self._uses.pop(key, 0) + 1
+        if len(self._uses) > USE_COUNTS_MEMORY:
+            self._uses.popitem(last=False)
+
+    def _maybe_persist(self, key, text, entry):
+        if not self.cache_dir or key in self._disk or key in self._persisting:
+            return
+        if key not in self._pinned:
+            if not self.disk_min_uses or self._uses.get(key, 0) < self.disk_min_uses:
+                return
+        self._persisting.add(key)
+        task = asyncio.create_task(self._persist(key, text, entry))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+        task.add_done_callback(lambda _: self._persisting.discard(key))
+
+    def _remember(self, key, entry):
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_used -= len(previous[0])
+        self._memory[key] = entry
+        self._memory_used += len(entry[0])
+        # Đẩy các câu dùng lâu nhất (không ghim) ra cho tới khi vừa ngân sách
+        for old_key in list(self._memory):
+            if self._memory_used <= self.memory_bytes:
+                break
+            if old_key in self._pinned:
+                continue
+            self._memory_used -= len(self._memory.pop(old_key)[0])
+            self.stats["evicted_memory"] += 1
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + ".bin", base + ".json"
+
+    def _scan_disk(self):
+        """
+        Nạp chỉ mục các file đã cache từ lần chạy trước, theo thứ tự dùng gần nhất
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            key, ext = os.path.splitext(name)
+            if ext != ".bin" or not os.path.exists(os.path.join(self.cache_dir, key + ".json")):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_used += size
+
+    async def _load_disk(self, key):
+        if key not in self._disk:
+            return None
+        try:
+            entry = await asyncio.to_thread(self._read_files, key)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Dropping unreadable TTS cache entry {key}: {e}")
+            self.stats["disk_errors"] += 1
+            self._forget_disk(key)
+            return None
+        if key in self._disk:
+            self._disk.move_to_end(key)
+        self._remember(key, entry)
+        return entry
+
+    def _read_files(self, key):
+        audio_path, meta_path = self._paths(key)
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(audio_path, "rb") as f:
+            audio = f.read()
+        # Cập nhật mtime để lần khởi động sau giữ đúng thứ tự dùng gần nhất
+        os.utime(audio_path)
+        return audio, meta["format"], int(meta["sample_rate"])
+
+    def _write_files(self, key, text, entry):
+        audio, format_audio, sample_rate = entry
+        audio_path, meta_path = self._paths(key)
+        meta = {
+            "text": text,
+            "voice": self.voice,
+            "speed": self.speed,
+            "format": format_audio,
+            "sample_rate": sample_rate,
+        }
+        # Ghi file tạm rồi đổi tên để không bao giờ đọc phải file ghi dở
+        with open(audio_path + ".tmp", "wb") as f:
+            f.write(audio)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(audio_path + ".tmp", audio_path)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _remove_files(self, keys):
+        for key in keys:
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    async def _persist(self, key, text, entry):
+        try:
+            await asyncio.to_thread(self._write_files, key, text, entry)
+        except OSError as e:
+            logger.warning(f"Failed to write TTS cache entry for '{text}': {e}")
+            self.stats["disk_errors"] += 1
+            return
+        self._forget_disk(key)
+        self._disk[key] = len(entry[0])
+        self._disk_used += len(entry[0])
+
+        if not self.disk_max_bytes or self._disk_used <= self.disk_max_bytes:
+            return
+        removed = []
+        for old_key in list(self._disk):
+            if self._disk_used <= self.disk_max_bytes:
+                break
+            if old_key in self._pinned:
+                continue
+            self._forget_disk(old_key)
+            removed.append(old_key)
+        self.stats["evicted_disk"] += len(removed)
+        try:
+            await asyncio.to_thread(self._remove_files, removed)
+        except OSError as e:
+            logger.warning(f"Failed to remove TTS cache files: {e}")
+            self.stats["disk_errors"] += 1
+
+    def _forget_disk(self, key):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_used -= size
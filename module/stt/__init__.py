@@ -1,4 +1,3 @@
-from transformers import pipeline
 from log import setup_logger
 
 logger = setup_logger(__name__)
@@ -11,6 +10,10 @@ class STT:
     def get_text_from_audio(self, audio_data, **kwargs) -> str:
         raise NotImplementedError("Subclass must implement this method")
     
+    def get_texts_from_audio(self, items) -> list:
+        # Mặc định nhận dạng lần lượt, subclass có thể ghép thành một batch
+        return [self.get_text_from_audio(audio_data, **kwargs) for audio_data, kwargs in items]
+    
     def load_model(self):
         raise NotImplementedError("Subclass must implement this method")
     
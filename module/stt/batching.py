@@ -0,0 +1,97 @@
+"""
+Micro-batching các yêu cầu STT từ nhiều thiết bị thành một lần generate
+"""
+import asyncio
+
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class STTBatcher:
+    def __init__(self, run_batch, max_batch_size=4, max_wait_ms=10.0):
+        """
+        Gom các yêu cầu đang chờ thành batch
+
+        Args:
+            run_batch: coroutine function(list[(audio, kwargs)]) -> list[str]
+            max_batch_size (int): số yêu cầu tối đa trong một batch
+            max_wait_ms (float): thời gian chờ tối đa để gom thêm yêu cầu sau yêu cầu đầu tiên
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+
+        self.queue = None
+        self.collector_task = None
+        self.batch_tasks = set()
+        # Histogram độ đầy của batch: kích thước batch -> số lần
+        self.fill_histogram = {}
+
+    async def submit(self, audio_data, kwargs):
+        """
+        Đưa một yêu cầu vào batch kế tiếp và đợi kết quả của riêng nó
+        """
+        loop = asyncio.get_running_loop()
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        if self.collector_task is None or self.collector_task.done():
+            self.collector_task = loop.create_task(self._collector())
+
+        future = loop.create_future()
+        self.queue.put_nowait((audio_data, kwargs, future))
+        return await future
+
+    async def _collector(self):
+        """
+        Lấy yêu cầu đầu tiên rồi gom thêm tới khi đủ max_batch_size hoặc hết max_wait
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Bỏ các yêu cầu mà caller đã hủy trong lúc chờ
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                continue
+
+            self.fill_histogram[len(batch)] = self.fill_histogram.get(len(batch), 0) + 1
+            # Batch chạy song song với việc gom batch kế tiếp, pool worker giới hạn độ song song
+            task = loop.create_task(self._run(batch))
+            self.batch_tasks.add(task)
+            task.add_done_callback(self.batch_tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self.run_batch([(audio_data, kwargs) for audio_data, kwargs, _ in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def get_stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batch_fill": dict(sorted(self.fill_histogram.items())),
+        }
+
+    async def stop(self):
+        tasks = [t for t in [self.collector_task, *self.batch_tasks] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
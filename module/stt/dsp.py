@@ -0,0 +1,174 @@
+"""
+Tiền xử lý audio trước STT: giải mã trong bộ nhớ, resample về 16 kHz, bỏ DC, chuẩn hóa mức
+"""
+import io
+from dataclasses import dataclass, replace
+from math import gcd
+
+import numpy as np
+from scipy.signal import resample_poly
+
+from module.stt.utils import pcm16le_to_float32
+
+# Whisper được huấn luyện với audio 16 kHz
+MODEL_SAMPLE_RATE = 16000
+
+
+class AudioDecodeError(ValueError):
+    """Không giải mã được audio nén trong bộ nhớ"""
+
+
+@dataclass
+class DSPResult:
+    input_rate: int
+    output_rate: int
+    input_samples: int
+    output_samples: int
+    dc_offset: float
+    peak: float
+    rms_db: float
+    gain_db: float
+    clipped_ratio: float
+
+    @property
+    def resampled(self):
+        return self.input_rate != self.output_rate
+
+    @property
+    def duration(self):
+        return self.output_samples / self.output_rate if self.output_rate else 0.0
+
+
+def decode_audio(audio_data, format_audio, sample_rate):
+    """
+    Giải mã audio về mảng float32 mono trong bộ nhớ, không gọi ffmpeg
+
+    Args:
+        audio_data: bytes/memoryview (hoặc mảng float32 đã giải mã)
+        format_audio (str): pcm16le, wav, ogg, mp3, ...
+        sample_rate (int): tần số lấy mẫu khai báo trong payload (chỉ dùng cho pcm16le)
+
+    Returns:
+        tuple: (samples float32 mono, sample_rate thực tế)
+
+    Raises:
+        AudioDecodeError: khi libsndfile không đọc được định dạng này
+    """
+    if isinstance(audio_data, np.ndarray):
+        return audio_data, sample_rate
+    if format_audio == "pcm16le":
+        return pcm16le_to_float32(audio_data), sample_rate
+
+    import soundfile as sf
+    try:
+        samples, file_rate = sf.read(io.BytesIO(audio_data), dtype="float32", always_2d=True)
+    except (sf.LibsndfileError, RuntimeError, TypeError) as e:
+        raise AudioDecodeError(f"Cannot decode {format_audio} audio: {e}") from e
+    if samples.shape[1] == 1:
+        return samples[:, 0], file_rate
+    return samples.mean(axis=1, dtype=np.float32), file_rate
+
+
+class AudioPreprocessor:
+    def __init__(self, target_rate=MODEL_SAMPLE_RATE, target_rms_db=-20.0, max_gain_db=20.0,
+                 peak_limit=0.95, clip_level=0.999, clip_warn_ratio=0.01):
+        """
+        Chuẩn hóa audio từ các thiết bị có mic/tần số khác nhau về cùng một dạng cho model
+
+        Các bước đều vectorized trên toàn bộ buffer: bỏ DC offset, phát hiện clipping,
+        resample polyphase về target_rate, rồi nhân một hệ số gain để đạt RMS mục tiêu
+        nhưng không để đỉnh vượt peak_limit.
+
+        Args:
+            target_rate (int): tần số lấy mẫu đầu ra
+            target_rms_db (float): mức RMS mục tiêu (dBFS)
+            max_gain_db (float): gain tối đa, tránh khuếch đại nhiễu nền của đoạn quá nhỏ
+            peak_limit (float): biên độ đỉnh tối đa sau chuẩn hóa
+            clip_level (float): |sample| từ mức này trở lên được tính là bị clip
+            clip_warn_ratio (float): tỉ lệ sample bị clip từ mức này trở lên coi là audio bị méo
+        """
+        self.target_rate = target_rate
+        self.target_rms_db = target_rms_db
+        self.max_gain_db = max_gain_db
+        self.peak_limit = peak_limit
+        self.clip_level = clip_level
+        self.clip_warn_ratio = clip_warn_ratio
+
+    def resample(self, samples, sample_rate):
+        """
+        Resample polyphase với tỉ lệ nguyên tối giản (ví dụ 44100 -> 16000 là 160/441)
+        """
+        if sample_rate == self.target_rate or len(samples) == 0:
+            return samples
+        factor = gcd(int(sample_rate), self.target_rate)
+        up = self.target_rate // factor
+        down = int(sample_rate) // factor
+        return resample_poly(samples, up, down).astype(np.float32, copy=False)
+
+    def process(self, samples, sample_rate):
+        """
+        Chạy toàn bộ chuỗi xử lý, không sửa mảng đầu vào (có thể là view trên buffer stream)
+
+        Returns:
+            tuple: (samples float32 ở target_rate, DSPResult)
+        """
+        output, result = self.condition(samples, sample_rate)
+        return self.normalize(output, result)
+
+    def condition(self, samples, sample_rate):
+        """
+        Bỏ DC và resample về target_rate, chưa đổi mức tín hiệu
+
+        VAD phải chạy trên kết quả của bước này: sau normalize, nhiễu nền của đoạn im lặng
+        đã được khuếch đại và vượt ngưỡng năng lượng tuyệt đối của VAD.
+
+        Returns:
+            tuple: (samples float32 ở target_rate, DSPResult chưa có gain)
+        """
+        input_samples = len(samples)
+        if input_samples == 0:
+            return samples, DSPResult(sample_rate, sample_rate, 0, 0, 0.0, 0.0, -np.inf, 0.0, 0.0)
+
+        # Clipping đo trên tín hiệu gốc, trước khi bỏ DC và resample làm mờ các đỉnh bị cắt
+        clipped_ratio = int(np.count_nonzero(np.abs(samples) >= self.clip_level)) / input_samples
+
+        dc_offset = float(samples.mean(dtype=np.float64))
+        # Phép trừ cấp phát mảng mới, các bước sau xử lý tại chỗ trên mảng này
+        output = samples - np.float32(dc_offset)
+        output = self.resample(output, sample_rate)
+
+        return output, DSPResult(
+            input_rate=int(sample_rate),
+            output_rate=self.target_rate,
+            input_samples=input_samples,
+            output_samples=len(output),
+            dc_offset=dc_offset,
+            peak=0.0,
+            rms_db=-np.inf,
+            gain_db=0.0,
+            clipped_ratio=clipped_ratio,
+        )
+
+    def normalize(self, output, result):
+        """
+        Nhân gain tại chỗ để đạt RMS mục tiêu mà đỉnh không vượt peak_limit
+
+        Args:
+            output: samples do condition trả về (hoặc một view đã cắt im lặng của nó)
+            result (DSPResult): kết quả của condition
+
+        Returns:
+            tuple: (samples, DSPResult có peak, rms_db, gain_db)
+        """
+        rms = float(np.sqrt(np.dot(output, output) / len(output))) if len(output) else 0.0
+        peak = float(np.abs(output).max()) if len(output) else 0.0
+        rms_db = 20.0 * np.log10(rms) if rms > 0 else -np.inf
+
+        gain_db = 0.0
+        if rms > 0:
+            gain_db = min(self.target_rms_db - rms_db, self.max_gain_db)
+            if peak > 0:
+                gain_db = min(gain_db, 20.0 * np.log10(self.peak_limit / peak))
+            output *= np.float32(10.0 ** (gain_db / 20.0))
+
+        return output, replace(result, output_samples=len(output), peak=peak, rms_db=rms_db, gain_db=gain_db)
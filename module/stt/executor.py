@@ -0,0 +1,286 @@
+"""
+Worker pool chạy STT ngoài event loop
+"""
+import asyncio
+import gc
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from log import setup_logger
+from module.stt.batching import STTBatcher
+from module.stt.utils import process_memory_mb
+
+logger = setup_logger(__name__)
+
+# Model STT của worker hiện tại (mỗi thread/process một instance)
+_worker_state = threading.local()
+# Model nạp sẵn ở process cha, các worker fork kế thừa (copy-on-write)
+_shared_stt = None
+
+
+class STTOverloadedError(RuntimeError):
+    """Hàng đợi STT đã đầy"""
+
+
+class STTNotReadyError(RuntimeError):
+    """Model STT chưa nạp xong"""
+
+
+def _init_worker(stt_factory, torch_threads):
+    """
+    Khởi tạo worker: nạp model STT một lần cho thread/process này
+    """
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+    _worker_state.stt = stt_factory()
+    logger.info(f"STT worker ready (pid={os.getpid()}, thread={threading.current_thread().name})")
+
+
+def _init_shared_worker(torch_threads):
+    """
+    Khởi tạo worker được fork sau khi process cha đã nạp model: dùng chung weights
+    """
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+    _worker_state.stt = _shared_stt
+    if hasattr(_shared_stt, "warmup"):
+        _shared_stt.warmup()
+    logger.info(f"STT worker ready with shared weights (pid={os.getpid()})")
+
+
+def _share_model_memory(stt):
+    """
+    Chuyển storage của các tensor sang shared memory để worker không tạo bản sao riêng
+    """
+    transcriber = getattr(stt, "transcriber", None)
+    model = getattr(transcriber, "model", None)
+    if model is not None and hasattr(model, "share_memory"):
+        model.share_memory()
+
+
+def _run_transcription(audio_data, kwargs):
+    return _worker_state.stt.get_text_from_audio(audio_data, **kwargs)
+
+
+def _run_batch_transcription(items):
+    return _worker_state.stt.get_texts_from_audio(items)
+
+
+def _ping():
+    return os.getpid()
+
+
+class STTExecutor:
+    def __init__(self, stt_factory, workers=1, mode="thread", max_pending=16, timeout=60.0,
+                 batch_size=1, batch_wait_ms=10.0, share_weights=False):
+        """
+        Khởi tạo pool worker STT
+
+        Args:
+            stt_factory: callable tạo instance STT (phải pickle được khi mode="process"),
+                thường là functools.partial(create_backend, <tên backend>)
+            workers (int): số worker, mỗi worker giữ một model đã nạp
+            mode (str): "thread" hoặc "process"
+            max_pending (int): số yêu cầu tối đa đang chờ/chạy, vượt quá sẽ bị từ chối
+            timeout (float): thời gian chờ tối đa cho một lần nhận dạng (giây)
+            batch_size (int): > 1 thì gom các yêu cầu đồng thời thành batch
+            batch_wait_ms (float): thời gian chờ tối đa để gom batch (ms)
+            share_weights (bool): mode="process" thì nạp model một lần ở process cha rồi
+                fork worker, weights được dùng chung chỉ đọc thay vì mỗi worker một bản
+        """
+        self.stt_factory = stt_factory
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.share_weights = share_weights and mode == "process"
+
+        self.batcher = None
+        if batch_size > 1:
+            self.batcher = STTBatcher(self._run_batch, max_batch_size=batch_size, max_wait_ms=batch_wait_ms)
+
+        self.pool = None
+        self.started = False
+        self.worker_pids = set()
+        self.pending = 0
+        # Được set khi ít nhất một worker đã nạp xong model
+        self.ready = threading.Event()
+        self.ready_workers = 0
+        self.failed_workers = 0
+        self._ready_lock = threading.Lock()
+        self.stats = {
+            "completed": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "max_pending": 0,
+        }
+
+    def start(self):
+        """
+        Tạo pool và bắt đầu nạp model ở các worker (chạy nền, không chặn caller)
+        """
+        if self.started:
+            return
+        self.started = True
+        if self.share_weights:
+            # Nạp model ở thread nền rồi mới fork worker, không chặn caller
+            threading.Thread(target=self._start_shared_pool, name="stt-loader", daemon=True).start()
+            logger.info(f"STT executor starting: {self.workers} process worker(s) sharing weights, loading model in background")
+            return
+        if self.mode == "process":
+            # Chia đều số thread torch cho các process để không tranh chấp CPU
+            torch_threads = max(1, (os.cpu_count() or 1) // self.workers)
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.stt_factory, torch_threads)
+            )
+        else:
+            self.pool = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="stt-worker",
+                initializer=_init_worker,
+                initargs=(self.stt_factory, 0)
+            )
+        # Gửi việc rỗng để các worker được tạo và nạp model ngay
+        for _ in range(self.workers):
+            self.pool.submit(_ping).add_done_callback(self._on_worker_ready)
+        logger.info(f"STT executor started: {self.workers} {self.mode} worker(s), loading model in background")
+
+    def _start_shared_pool(self):
+        """
+        Nạp model một lần, đưa weights vào shared memory rồi fork các worker
+        """
+        global _shared_stt
+        try:
+            # Warmup chạy trong từng worker sau khi fork để process cha không khởi tạo thread pool của torch
+            _shared_stt = self.stt_factory(warmup=False)
+            _share_model_memory(_shared_stt)
+        except Exception as e:
+            logger.error(f"Failed to load shared STT model: {e}", exc_info=True)
+            with self._ready_lock:
+                self.failed_workers = self.workers
+            return
+
+        # Đóng băng các object hiện có để GC không ghi vào trang nhớ dùng chung sau khi fork
+        gc.freeze()
+        torch_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_shared_worker,
+            initargs=(torch_threads,)
+        )
+        for _ in range(self.workers):
+            self.pool.submit(_ping).add_done_callback(self._on_worker_ready)
+
+    def _on_worker_ready(self, future):
+        if future.cancelled() or future.exception() is not None:
+            logger.error(f"STT worker failed to start: {None if future.cancelled() else future.exception()}")
+            with self._ready_lock:
+                self.failed_workers += 1
+            return
+        with self._ready_lock:
+            self.ready_workers += 1
+            ready_workers = self.ready_workers
+            if self.mode == "process":
+                self.worker_pids.add(future.result())
+        if not self.ready.is_set():
+            self.ready.set()
+            logger.info("STT model is ready")
+        logger.debug(f"STT workers ready: {ready_workers}/{self.workers}")
+        if ready_workers == self.workers and self.worker_pids:
+            logger.info(f"STT worker memory: {self.memory_report()}")
+
+    def is_ready(self):
+        return self.ready.is_set()
+
+    async def wait_ready(self, timeout=None):
+        """
+        Đợi model nạp xong mà không chặn event loop
+
+        Returns:
+            bool: True nếu model đã sẵn sàng
+        """
+        if self.ready.is_set():
+            return True
+        return await asyncio.to_thread(self.ready.wait, timeout)
+
+    async def transcribe(self, audio_data, **kwargs):
+        """
+        Nhận dạng audio trên worker pool, không chặn event loop
+
+        Raises:
+            STTOverloadedError: khi số yêu cầu đang chờ vượt max_pending
+            STTNotReadyError: khi model chưa nạp xong sau thời gian timeout
+            asyncio.TimeoutError: khi quá thời gian timeout
+        """
+        if not self.started:
+            self.start()
+        if not self.ready.is_set():
+            if self.failed_workers >= self.workers:
+                raise STTNotReadyError("All STT workers failed to start")
+            if not await self.wait_ready(self.timeout):
+                raise STTNotReadyError("STT model is still loading")
+        if self.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise STTOverloadedError(f"STT queue is full ({self.max_pending} pending)")
+
+        self.pending += 1
+        self.stats["max_pending"] = max(self.stats["max_pending"], self.pending)
+        try:
+            if self.batcher is not None:
+                result = await self.batcher.submit(audio_data, kwargs)
+            else:
+                result = await self._run_in_pool(_run_transcription, audio_data, kwargs)
+            self.stats["completed"] += 1
+            return result
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.pending -= 1
+
+    async def _run_batch(self, items):
+        return await self._run_in_pool(_run_batch_transcription, items)
+
+    async def _run_in_pool(self, func, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.pool, func, *args)
+        # Khi timeout, worker vẫn chạy nốt lần nhận dạng nhưng kết quả bị bỏ
+        return await asyncio.wait_for(future, timeout=self.timeout)
+
+    def memory_report(self):
+        """
+        Bộ nhớ của từng worker process (MB): rss, pss (chia phần dùng chung), shared, private
+        """
+        return {pid: process_memory_mb(pid) for pid in sorted(self.worker_pids)}
+
+    def get_stats(self):
+        stats = {
+            **self.stats,
+            "pending": self.pending,
+            "ready": self.ready.is_set(),
+            "workers": self.workers,
+            "ready_workers": self.ready_workers,
+            "mode": self.mode,
+        }
+        if self.batcher is not None:
+            stats["batching"] = self.batcher.get_stats()
+        if self.worker_pids:
+            stats["memory"] = self.memory_report()
+        return stats
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        self.started = False
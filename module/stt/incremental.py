@@ -0,0 +1,113 @@
+"""
+Incremental transcription: nhận dạng các cửa sổ chồng lấn trong lúc audio còn đang tới
+"""
+import re
+
+import numpy as np
+
+_WORD_NORMALIZE = re.compile(r"[^\w]+", re.UNICODE)
+
+
+class IncrementalTranscriber:
+    def __init__(self, sample_rate=16000, window_s=8.0, overlap_s=1.0, min_tail_s=0.3, max_overlap_words=8):
+        """
+        Quản lý buffer audio của một stream và ghép kết quả STT của từng cửa sổ
+
+        Việc gọi model nằm ngoài class này: pop_window()/pop_tail() trả về đoạn audio
+        cần nhận dạng, commit() ghép văn bản trả về vào bản ghi đã ổn định.
+
+        Args:
+            sample_rate (int): tần số lấy mẫu của audio đưa vào
+            window_s (float): độ dài mỗi cửa sổ nhận dạng (giây)
+            overlap_s (float): phần chồng lấn giữa hai cửa sổ liên tiếp (giây)
+            min_tail_s (float): phần đuôi ngắn hơn ngưỡng này sẽ bỏ qua khi kết thúc
+            max_overlap_words (int): số từ tối đa dùng để khử trùng lặp ở chỗ chồng lấn
+        """
+        self.sample_rate = sample_rate
+        self.window_len = int(window_s * sample_rate)
+        self.overlap_len = min(int(overlap_s * sample_rate), self.window_len // 2)
+        self.min_tail_len = int(min_tail_s * sample_rate)
+        self.max_overlap_words = max_overlap_words
+
+        self._buffer = np.empty(self.window_len, dtype=np.float32)
+        self._length = 0
+        # Vị trí (theo sample) bắt đầu của cửa sổ kế tiếp
+        self._window_start = 0
+        self._words = []
+
+    @property
+    def buffered_samples(self):
+        return self._length
+
+    @property
+    def text(self):
+        """
+        Bản ghi ổn định hiện tại
+        """
+        return " ".join(self._words)
+
+    def append(self, samples):
+        """
+        Thêm audio (float32) vào cuối buffer, buffer tăng kích thước theo cấp số nhân
+        """
+        needed = self._length + len(samples)
+        if needed > len(self._buffer):
+            capacity = max(needed, 2 * len(self._buffer))
+            grown = np.empty(capacity, dtype=np.float32)
+            grown[:self._length] = self._buffer[:self._length]
+            self._buffer = grown
+        self._buffer[self._length:needed] = samples
+        self._length = needed
+
+    def has_window(self):
+        return self._length - self._window_start >= self.window_len
+
+    def pop_window(self):
+        """
+        Lấy cửa sổ đầy đủ kế tiếp (view, không copy) hoặc None nếu chưa đủ audio
+        """
+        if not self.has_window():
+            return None
+        start = self._window_start
+        self._window_start += self.window_len - self.overlap_len
+        return self._buffer[start:start + self.window_len]
+
+    def pop_tail(self):
+        """
+        Lấy phần audio còn lại chưa được nhận dạng khi stream kết thúc
+        """
+        start = self._window_start
+        if self._length - start < self.min_tail_len:
+            return None
+        # Nếu phần mới sau vùng chồng lấn quá ngắn thì không cần nhận dạng lại
+        if start > 0 and self._length - (start + self.overlap_len) < self.min_tail_len:
+            return None
+        self._window_start = self._length
+        return self._buffer[start:self._length]
+
+    def commit(self, text):
+        """
+        Ghép văn bản của cửa sổ vừa nhận dạng, bỏ các từ trùng ở vùng chồng lấn
+
+        Returns:
+            str: giả thuyết (partial) hiện tại
+        """
+        new_words = (text or "").split()
+        if not new_words:
+            return self.text
+        overlap = self._find_overlap(new_words)
+        self._words.extend(new_words[overlap:])
+        return self.text
+
+    def _find_overlap(self, new_words):
+        limit = min(len(self._words), len(new_words), self.max_overlap_words)
+        tail = [self._normalize(w) for w in self._words[-limit:]] if limit else []
+        head = [self._normalize(w) for w in new_words[:limit]]
+        for k in range(limit, 0, -1):
+            if tail[-k:] == head[:k]:
+                return k
+        return 0
+
+    @staticmethod
+    def _normalize(word):
+        return _WORD_NORMALIZE.sub("", word.lower())
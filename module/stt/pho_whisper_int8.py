@@ -0,0 +1,32 @@
+import torch
+from module.stt.vin_ai_pho_whisper import VinAiPhoWhisper
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class QuantizedPhoWhisper(VinAiPhoWhisper):
+    """
+    PhoWhisper với các lớp Linear được lượng tử hóa động int8 (chỉ chạy trên CPU)
+    """
+
+    def __init__(self, device=None, warmup=None):
+        # Dynamic quantization của PyTorch chỉ có kernel cho CPU
+        super().__init__(device="cpu", warmup=warmup)
+
+    def load_model(self):
+        if self.transcriber is not None:
+            return
+        super().load_model()
+        if self.transcriber is None:
+            return
+        try:
+            self.transcriber.model = torch.ao.quantization.quantize_dynamic(
+                self.transcriber.model,
+                {torch.nn.Linear},
+                dtype=torch.qint8
+            )
+            self.transcriber.model.eval()
+            logger.info("Quantized PhoWhisper STT model to int8 (dynamic, Linear layers)")
+        except Exception as e:
+            logger.error(f"Failed to quantize PhoWhisper STT model, using fp32: {e}")
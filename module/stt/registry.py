@@ -0,0 +1,44 @@
+"""
+Registry các backend STT, chọn theo tên trong config
+
+Backend được khai báo bằng đường dẫn "module:Class" và chỉ import khi được dùng,
+nhờ vậy import handler không kéo theo torch/transformers.
+"""
+import importlib
+
+_BACKENDS = {
+    "phowhisper": "module.stt.vin_ai_pho_whisper:VinAiPhoWhisper",
+    "phowhisper-int8": "module.stt.pho_whisper_int8:QuantizedPhoWhisper",
+}
+
+
+def register_backend(name, target):
+    """
+    Đăng ký backend STT mới
+
+    Args:
+        name (str): tên backend dùng trong STT_BACKEND
+        target (str): đường dẫn dạng "package.module:ClassName"
+    """
+    _BACKENDS[name] = target
+
+
+def available_backends():
+    return sorted(_BACKENDS)
+
+
+def get_backend(name):
+    """
+    Import và trả về class của backend
+    """
+    if name not in _BACKENDS:
+        raise ValueError(f"STT backend '{name}' chưa được đăng ký, các backend có sẵn: {available_backends()}")
+    module_name, class_name = _BACKENDS[name].split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def create_backend(name, **kwargs):
+    """
+    Tạo instance backend (module-level để pickle được khi chạy worker process)
+    """
+    return get_backend(name)(**kwargs)
@@ -0,0 +1,49 @@
+"""
+Tiện ích chuyển đổi audio cho các model STT
+"""
+import numpy as np
+
+PCM16_SCALE = 1.0 / 32768.0
+
+
+def pcm16le_to_float32(audio_data):
+    """
+    Chuyển PCM 16-bit little-endian sang mảng float32 trong khoảng [-1, 1)
+
+    np.frombuffer chỉ tạo view trên bytes/memoryview gốc (không copy), bước đổi
+    kiểu dữ liệu cấp phát đúng một mảng float32 và được scale tại chỗ.
+
+    Args:
+        audio_data: bytes, bytearray hoặc memoryview chứa PCM int16 LE
+    """
+    pcm = np.frombuffer(audio_data, dtype="<i2", count=len(audio_data) // 2)
+    samples = pcm.astype(np.float32)
+    samples *= PCM16_SCALE
+    return samples
+
+
+def process_memory_mb(pid):
+    """
+    Đọc bộ nhớ của một process từ /proc/<pid>/smaps_rollup (Linux), đơn vị MB
+
+    Pss chia đều phần trang nhớ dùng chung cho các process, phản ánh đúng
+    mức tiết kiệm khi nhiều worker dùng chung weights.
+    """
+    fields = {
+        "Rss": "rss",
+        "Pss": "pss",
+        "Shared_Clean": "shared",
+        "Shared_Dirty": "shared",
+        "Private_Clean": "private",
+        "Private_Dirty": "private",
+    }
+    report = {"rss": 0.0, "pss": 0.0, "shared": 0.0, "private": 0.0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    report[fields[key]] += int(value.split()[0]) / 1024
+    except (OSError, ValueError):
+        return {}
+    return {key: round(value, 1) for key, value in report.items()}
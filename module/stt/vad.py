@@ -0,0 +1,109 @@
+"""
+Voice activity detection dựa trên năng lượng khung (vectorized NumPy)
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class VADResult:
+    start: int
+    end: int
+    total_samples: int
+    sample_rate: int
+
+    @property
+    def has_speech(self):
+        return self.end > self.start
+
+    @property
+    def removed_samples(self):
+        return self.total_samples - (self.end - self.start)
+
+    @property
+    def removed_seconds(self):
+        return self.removed_samples / self.sample_rate if self.sample_rate else 0.0
+
+
+class EnergyVAD:
+    def __init__(self, frame_ms=20, threshold_db=12.0, min_energy_db=-55.0, dynamic_range_db=30.0,
+                 hangover_ms=300, min_speech_ms=120, noise_percentile=10):
+        """
+        VAD theo năng lượng khung với ngưỡng thích nghi và hangover
+
+        Khung là tiếng nói khi năng lượng vượt nền nhiễu (percentile thấp của năng lượng
+        các khung) ít nhất threshold_db và lớn hơn min_energy_db tuyệt đối. Ngưỡng không
+        vượt quá (đỉnh - dynamic_range_db) để đoạn toàn tiếng nói không bị cắt mất.
+
+        Args:
+            frame_ms (int): độ dài khung (ms)
+            threshold_db (float): mức vượt nền nhiễu để coi là tiếng nói (dB)
+            min_energy_db (float): năng lượng tối thiểu tuyệt đối (dBFS)
+            dynamic_range_db (float): khoảng cách tối đa từ đỉnh năng lượng tới ngưỡng (dB)
+            hangover_ms (int): giữ lại phần audio trước/sau vùng tiếng nói (ms)
+            min_speech_ms (int): tổng tiếng nói nhỏ hơn ngưỡng này coi như im lặng (ms)
+            noise_percentile (float): percentile dùng ước lượng nền nhiễu
+        """
+        self.frame_ms = frame_ms
+        self.threshold_db = threshold_db
+        self.min_energy_db = min_energy_db
+        self.dynamic_range_db = dynamic_range_db
+        self.hangover_ms = hangover_ms
+        self.min_speech_ms = min_speech_ms
+        self.noise_percentile = noise_percentile
+
+    def frame_energy_db(self, samples, sample_rate):
+        """
+        Năng lượng (dBFS) của từng khung, tính một lần cho toàn bộ buffer
+        """
+        frame_len = max(1, int(sample_rate * self.frame_ms / 1000))
+        n_frames = len(samples) // frame_len
+        if n_frames == 0:
+            return np.empty(0, dtype=np.float32), frame_len
+        frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len)
+        power = np.einsum("ij,ij->i", frames, frames) / frame_len
+        return 10.0 * np.log10(power + 1e-10), frame_len
+
+    def detect(self, samples, sample_rate):
+        """
+        Tìm vùng tiếng nói [start, end) theo sample trong buffer float32
+
+        Returns:
+            VADResult
+        """
+        total = len(samples)
+        energy_db, frame_len = self.frame_energy_db(samples, sample_rate)
+        if len(energy_db) == 0:
+            return VADResult(0, 0, total, sample_rate)
+
+        noise_floor = np.percentile(energy_db, self.noise_percentile)
+        threshold = min(noise_floor + self.threshold_db, energy_db.max() - self.dynamic_range_db)
+        threshold = max(threshold, self.min_energy_db)
+        speech = energy_db > threshold
+
+        min_speech_frames = max(1, self.min_speech_ms // self.frame_ms)
+        if np.count_nonzero(speech) < min_speech_frames:
+            return VADResult(0, 0, total, sample_rate)
+
+        voiced = np.flatnonzero(speech)
+        hangover = self.hangover_ms // self.frame_ms
+        first = max(0, voiced[0] - hangover)
+        last = min(len(energy_db), voiced[-1] + 1 + hangover)
+
+        start = first * frame_len
+        # Khung cuối cùng chạm tới cuối buffer thì giữ luôn phần lẻ không đủ khung
+        end = total if last >= len(energy_db) else last * frame_len
+        return VADResult(start, end, total, sample_rate)
+
+    def trim(self, samples, sample_rate):
+        """
+        Cắt im lặng ở đầu và cuối (view, không copy)
+
+        Returns:
+            tuple: (samples đã cắt hoặc None nếu toàn im lặng, VADResult)
+        """
+        result = self.detect(samples, sample_rate)
+        if not result.has_speech:
+            return None, result
+        return samples[result.start:result.end], result
@@ -1,63 +1,123 @@
+import numpy as np
 import torch
 from transformers import pipeline
+from config import STT_DEVICE, STT_WARMUP
 from module.stt import STT
+from module.stt.utils import pcm16le_to_float32
 from log import setup_logger
 
 logger = setup_logger(__name__)
 
+
+def resolve_device(preference):
+    """
+    Chọn thiết bị chạy model một lần khi khởi động: "auto", "cpu", "cuda" hoặc "cuda:N"
+    """
+    preference = (preference or "auto").lower()
+    if preference == "auto":
+        return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if preference.startswith("cuda") and not torch.cuda.is_available():
+        logger.warning(f"STT device '{preference}' requested but CUDA is not available, falling back to CPU")
+        return torch.device("cpu")
+    return torch.device(preference)
+
+
 class VinAiPhoWhisper(STT):
-    def __init__(self):
+    def __init__(self, device=None, warmup=None):
         super().__init__()
         self.transcriber = None
-        # Khởi tạo model STT trên CPU
+        # Vị trí model được chọn một lần, không di chuyển weights giữa các lần gọi
+        self.device = resolve_device(device or STT_DEVICE)
+        self.load_model()
+        if STT_WARMUP if warmup is None else warmup:
+            self.warmup()
+
+    def warmup(self):
+        """
+        Chạy thử một lần với 1 giây im lặng để khởi tạo kernel/bộ nhớ trước request đầu tiên
+        """
+        if self.transcriber is None:
+            return
         try:
-            device = torch.device("cpu")
-            self.transcriber = pipeline(
-                "automatic-speech-recognition", 
-                model="vinai/PhoWhisper-base",  
-                generate_kwargs={"language": "br", "task": "transcribe"},
-                device=device,
-                chunk_length_s=100
-            )
-            logger.info("Loaded PhoWhisper STT model on CPU successfully")
+            silence = np.zeros(16000, dtype=np.float32)
+            with torch.inference_mode():
+                self.transcriber(inputs={"raw": silence, "sampling_rate": 16000})
+            logger.info(f"Warmed up PhoWhisper STT model on {self.device}")
         except Exception as e:
-            logger.error(f"Failed to load PhoWhisper STT model on CPU: {e}")
+            logger.error(f"Failed to warm up PhoWhisper STT model: {e}")
+
+    def _build_inputs(self, audio_data, **kwargs):
+        """
+        Chuẩn bị input cho pipeline, ưu tiên mảng float32 trong bộ nhớ thay vì đọc lại file
+        """
+        sample_rate = kwargs.get("sample_rate", 16000)
+        format_audio = kwargs.get("format_audio", "pcm16le")
+
+        if isinstance(audio_data, np.ndarray):
+            return {"raw": audio_data, "sampling_rate": sample_rate}
+        if audio_data is not None and format_audio == "pcm16le":
+            return {"raw": pcm16le_to_float32(audio_data), "sampling_rate": sample_rate}
+        if audio_data is not None:
+            # Định dạng nén (wav, mp3, ...) để pipeline tự giải mã từ bytes
+            return bytes(audio_data)
+        return kwargs.get("saved_file_path")
 
     def get_text_from_audio(self, audio_data, **kwargs):
         try:
-            self.load_model()
-            output = self.transcriber(inputs=kwargs.get("saved_file_path"))
+            with torch.inference_mode():
+                output = self.transcriber(inputs=self._build_inputs(audio_data, **kwargs))
             transcription = output.get('text', '')
-            self.unload_model()
             return transcription
         
         except Exception as e:
             logger.error(f"Error in audio processing: {e}", exc_info=True)
             return "Lỗi hệ thống chuyển đổi âm thanh thành văn bản."
         
+    def get_texts_from_audio(self, items):
+        """
+        Nhận dạng nhiều đoạn audio trong một lần generate (pipeline tự pad theo batch)
+
+        Args:
+            items: list[(audio_data, kwargs)] cùng định dạng với get_text_from_audio
+        """
+        if len(items) == 1:
+            audio_data, kwargs = items[0]
+            return [self.get_text_from_audio(audio_data, **kwargs)]
+        try:
+            inputs = [self._build_inputs(audio_data, **kwargs) for audio_data, kwargs in items]
+            with torch.inference_mode():
+                outputs = self.transcriber(inputs, batch_size=len(inputs))
+            return [output.get('text', '') for output in outputs]
+        
+        except Exception as e:
+            logger.error(f"Error in batched audio processing: {e}", exc_info=True)
+            return ["Lỗi hệ thống chuyển đổi âm thanh thành văn bản."] * len(items)
+        
     def load_model(self):
-        # Chuyển model lên GPU
+        # Nạp model trực tiếp lên thiết bị đã chọn
+        if self.transcriber is not None:
+            return
         try:
-            if self.transcriber is not None:
-                self.transcriber.model = self.transcriber.model.to("cuda")
-                self.transcriber.device = torch.device("cuda")
-                logger.info("Moved PhoWhisper STT model to GPU successfully")
-            else:
-                logger.warning("No model loaded, cannot move to GPU")
+            self.transcriber = pipeline(
+                "automatic-speech-recognition", 
+                model="vinai/PhoWhisper-base",  
+                generate_kwargs={"language": "br", "task": "transcribe"},
+                device=self.device,
+                chunk_length_s=100
+            )
+            self.transcriber.model.eval()
+            logger.info(f"Loaded PhoWhisper STT model on {self.device} successfully")
         except Exception as e:
-            logger.error(f"Failed to move PhoWhisper STT model to GPU: {e}")
+            logger.error(f"Failed to load PhoWhisper STT model on {self.device}: {e}")
             
     def unload_model(self):
-        # Chuyển model về CPU trước khi unload
-        try:
-            if self.transcriber is not None:
-                self.transcriber.model = self.transcriber.model.to("cpu")
-                self.transcriber.device = torch.device("cpu")
-                logger.info("Moved PhoWhisper STT model back to CPU successfully")
-        except Exception as e:
-            logger.error(f"Failed to move PhoWhisper STT model to CPU: {e}")
+        # Giải phóng model (không chuyển weights qua lại giữa các thiết bị)
+        if self.transcriber is None:
+            return
+        self.transcriber = None
+        if self.device.type == "cuda":
+            torch.cuda.empty_cache()
+        logger.info("Unloaded PhoWhisper STT model")
                 
     def __del__(self):
-        # Đảm bảo model được chuyển về CPU trước khi giải phóng bộ nhớ
         self.transcriber = None
-        logger.info("Cleaned up PhoWhisper STT model successfully")
\ No newline at end of file
@@ -11,14 +11,23 @@ This module implements the server component for the Blind Assist Device:
 - Monitors device status and heartbeats
 
 MQTT Topics:
-- device/{deviceId}/stt/audio: Voice streaming from devices
+- device/{deviceId}/stt/audio: Voice streaming from devices (JSON + base64)
+- device/{deviceId}/stt/audio_bin: Voice streaming from devices (binary frame, see mqtt.utils.audio_frame)
 - device/{deviceId}/obstacle: Obstacle detection alerts
-- device/{deviceId}/info: Device status/heartbeat 
+- device/{deviceId}/info: Device status/heartbeat, optional "codecs" list for server audio
+  (e.g. ["opus", "ima-adpcm", "pcm16le"], see mqtt.utils.audio_codec)
 - device/{deviceId}/status: Online/offline status
 - device/{deviceId}/ping: Ping requests from devices
 - server/{deviceId}/tts: Text-to-speech to devices
-- server/{deviceId}/command: Commands to devices
+- server/{deviceId}/audio: Audio to devices (streamed TTS uses totalChunks=0 until the final isLast chunk),
+  "format" is the negotiated codec or the original format (pcm16le, wav, mp3...)
+- server/{deviceId}/command: Commands to devices ("stop_audio" stops playback on barge-in)
 - server/{deviceId}/pong: Pong responses to devices
+- server/{deviceId}/audio/nack: Indices of lost audio chunks the device should resend
+
+Worker mode (MQTT_WORKER_COUNT > 1): several server processes split the devices.
+Stateless topics use $share/<group>/... subscriptions, audio streams are routed
+to the worker owning crc32(deviceId) % MQTT_WORKER_COUNT.
 """
 
 # Export main server class
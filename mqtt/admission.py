@@ -0,0 +1,148 @@
+"""
+Admission control: giới hạn đồng thời theo từng tầng pipeline (bulkhead) và theo thiết bị
+"""
+import asyncio
+import contextlib
+
+
+class AdmissionRejected(RuntimeError):
+    """Yêu cầu bị từ chối vì hệ thống đang quá tải"""
+
+
+class Bulkhead:
+    def __init__(self, name, limit, max_waiting=0, wait_timeout=None):
+        """
+        Giới hạn số việc chạy đồng thời của một tầng, hàng đợi có giới hạn
+
+        Args:
+            name (str): tên tầng (stt, llm, tts)
+            limit (int): số việc chạy đồng thời tối đa
+            max_waiting (int): số việc được chờ slot, vượt quá thì từ chối ngay
+            wait_timeout (float): thời gian chờ slot tối đa (giây), None = chờ mãi
+        """
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+
+        self._semaphore = asyncio.Semaphore(self.limit)
+        self.active = 0
+        self.waiting = 0
+        self.stats = {
+            "admitted": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "peak_waiting": 0,
+        }
+
+    @property
+    def saturated(self):
+        """
+        Đã hết slot và hàng đợi đã đầy: việc mới sẽ bị từ chối
+        """
+        return self._semaphore.locked() and self.waiting >= self.max_waiting
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """
+        Giữ một slot của tầng trong suốt khối async with
+
+        Raises:
+            AdmissionRejected: khi hàng đợi đầy hoặc chờ quá wait_timeout
+        """
+        if self.saturated:
+            self.stats["rejected"] += 1
+            raise AdmissionRejected(f"{self.name} stage is full ({self.active} active, {self.waiting} waiting)")
+
+        if not self._semaphore.locked():
+            # Còn slot trống: acquire trả về ngay, không đi qua hàng đợi
+            await self._semaphore.acquire()
+        else:
+            self.waiting += 1
+            self.stats["peak_waiting"] = max(self.stats["peak_waiting"], self.waiting)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.wait_timeout)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                raise AdmissionRejected(f"{self.name} stage wait timed out after {self.wait_timeout}s") from None
+            finally:
+                self.waiting -= 1
+
+        self.active += 1
+        self.stats["admitted"] += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+        }
+
+
+class AdmissionController:
+    def __init__(self, stage_limits, max_waiting=16, wait_timeout=10.0, max_inflight_per_device=2):
+        """
+        Quyết định nhận hay từ chối một yêu cầu trước khi nó chiếm tài nguyên
+
+        Args:
+            stage_limits (dict): tên tầng -> số việc đồng thời tối đa, ví dụ {"stt": 2, "llm": 8, "tts": 4}
+            max_waiting (int): độ dài hàng đợi tối đa của mỗi tầng
+            wait_timeout (float): thời gian chờ slot tối đa của mỗi tầng (giây)
+            max_inflight_per_device (int): số yêu cầu đang xử lý tối đa của một thiết bị
+        """
+        self.stages = {
+            name: Bulkhead(name, limit, max_waiting=max_waiting, wait_timeout=wait_timeout)
+            for name, limit in stage_limits.items()
+        }
+        self.max_inflight_per_device = max_inflight_per_device
+        self.device_inflight = {}
+        self.stats = {
+            "admitted": 0,
+            "shed_device_limit": 0,
+            "shed_overloaded": 0,
+        }
+
+    def stage(self, name):
+        return self.stages[name]
+
+    def try_admit(self, device_id):
+        """
+        Nhận một yêu cầu mới của thiết bị nếu còn chỗ (gọi trên event loop)
+
+        Yêu cầu bị từ chối ngay khi thiết bị đã có đủ yêu cầu đang xử lý, hoặc khi
+        một tầng phía sau đã bão hòa: xếp hàng thêm chỉ làm tăng độ trễ của mọi yêu cầu.
+
+        Returns:
+            str hoặc None: lý do từ chối, None nếu được nhận
+        """
+        if self.device_inflight.get(device_id, 0) >= self.max_inflight_per_device:
+            self.stats["shed_device_limit"] += 1
+            return "device_limit"
+        for bulkhead in self.stages.values():
+            if bulkhead.saturated:
+                self.stats["shed_overloaded"] += 1
+                return f"{bulkhead.name}_overloaded"
+
+        self.device_inflight[device_id] = self.device_inflight.get(device_id, 0) + 1
+        self.stats["admitted"] += 1
+        return None
+
+    def release(self, device_id):
+        inflight = self.device_inflight.get(device_id, 0) - 1
+        if inflight > 0:
+            self.device_inflight[device_id] = inflight
+        else:
+            self.device_inflight.pop(device_id, None)
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "inflight": sum(self.device_inflight.values()),
+            "stages": {name: bulkhead.get_stats() for name, bulkhead in self.stages.items()},
+        }
@@ -9,29 +9,60 @@ import paho.mqtt.client as mqtt
 
 import config
 from log import setup_logger
+from mqtt.utils.sharding import shared_topic
 
 logger = setup_logger(__name__)
 
+# (topic, qos, is_stream): topic stream cần mọi chunk của một stream tới cùng một worker
+SUBSCRIPTIONS = [
+    ("device/+/stt/audio", 1, True),        # Audio streams
+    ("device/+/stt/audio_bin", 1, True),    # Audio streams (binary frame)
+    ("device/+/mic", 1, True),              # Mic data
+    ("device/+/obstacle", 1, False),        # Obstacle alerts
+    ("device/+/log", 2, False),             # Log messages
+    ("device/+/info", 2, True),             # Device info (codec thương lượng nằm ở worker sở hữu thiết bị)
+    ("device/+/status", 2, False),          # Online/offline status
+    ("device/+/ping", 2, False),            # Ping requests
+]
+
 class MQTTClient:
-    def __init__(self, message_handlers=None):
+    def __init__(self, dispatcher=None):
         """
-        Khởi tạo MQTT client với các handlers xử lý message
+        Khởi tạo MQTT client với dispatcher định tuyến message
         
         Args:
-            message_handlers (dict): Dictionary các handler theo topic pattern
-        """
-        self.server_id = f"server-{uuid.uuid4().hex[:8]}"
-        self.client = mqtt.Client(
-            client_id=self.server_id,
-            clean_session=False,
-            protocol=mqtt.MQTTv311,
-            transport=config.BROKER_TRANSPORT
-        )
+            dispatcher (MessageDispatcher): Dispatcher chuyển message sang event loop
+        """
+        self.worker_mode = config.MQTT_WORKER_COUNT > 1
+        if self.worker_mode:
+            # Client id cố định theo worker để session bền vững có ý nghĩa khi khởi động lại
+            self.server_id = f"server-{config.MQTT_SHARE_GROUP}-{config.MQTT_WORKER_INDEX}"
+        else:
+            self.server_id = f"server-{uuid.uuid4().hex[:8]}"
+        # Mỗi worker có topic trạng thái riêng: nếu dùng chung một topic retained thì
+        # last will của một worker chết sẽ ghi đè trạng thái online của các worker còn lại
+        self.status_topic = f"server/status/{self.server_id}" if self.worker_mode else "server/status"
+        
+        self.use_mqtt_v5 = config.MQTT_PROTOCOL == "5"
+        if self.use_mqtt_v5:
+            # MQTT v5 không dùng clean_session, thay bằng clean_start khi connect
+            self.client = mqtt.Client(
+                client_id=self.server_id,
+                protocol=mqtt.MQTTv5,
+                transport=config.BROKER_TRANSPORT
+            )
+        else:
+            self.client = mqtt.Client(
+                client_id=self.server_id,
+                clean_session=False,
+                protocol=mqtt.MQTTv311,
+                transport=config.BROKER_TRANSPORT
+            )
 
         self.client.max_inflight_messages_set(0)  # 0 = không giới hạn, hoặc số lớn hơn 20
         
-        # Lưu các message handlers
-        self.message_handlers = message_handlers or {}
+        # Dispatcher định tuyến message tới các handler
+        self.dispatcher = dispatcher
         
         # Cấu hình client
         self.client.username_pw_set(config.MQTT_USER, config.MQTT_PASS)
@@ -40,7 +71,7 @@ class MQTTClient:
         
         # Set last will message
         self.client.will_set(
-            "server/status",
+            self.status_topic,
             json.dumps({
                 "status": "offline",
                 "serverId": self.server_id,
@@ -62,7 +93,10 @@ class MQTTClient:
         """
         try:
             logger.info("[SERVER] Đang kết nối đến MQTT broker...")
-            self.client.connect(config.BROKER_HOST, config.BROKER_PORT, keepalive=60)
+            if self.use_mqtt_v5:
+                self.client.connect(config.BROKER_HOST, config.BROKER_PORT, keepalive=60, clean_start=False)
+            else:
+                self.client.connect(config.BROKER_HOST, config.BROKER_PORT, keepalive=60)
             logger.info("[SERVER] Kết nối thành công!")
             return True
         except Exception as e:
@@ -76,16 +110,11 @@ class MQTTClient:
         logger.info(f"Connected to MQTT broker with result code: {rc}")
         
         # Đăng ký nhận tất cả các thiết bị (wildcard +)
-        client.subscribe("device/+/stt/audio", qos=1)  # Audio streams
-        client.subscribe("device/+/obstacle", qos=1)   # Obstacle alerts
-        client.subscribe("device/+/log", qos=2)        # Log messages
-        client.subscribe("device/+/info", qos=2)       # Device info
-        client.subscribe("device/+/status", qos=2)     # Online/offline status
-        client.subscribe("device/+/ping", qos=2)       # Ping requests
-        client.subscribe("device/+/mic", qos=1)        # Mic data
+        for topic, qos in self.get_subscriptions():
+            client.subscribe(topic, qos=qos)
         
         # Thông báo server đã online
-        client.publish("server/status",
+        client.publish(self.status_topic,
             json.dumps({
                 "status": "online",
                 "serverId": self.server_id,
@@ -95,60 +124,36 @@ class MQTTClient:
             retain=True
         )
     
+    def get_subscriptions(self):
+        """
+        Danh sách (topic, qos) cần subscribe theo chế độ chạy
+
+        - Một process: subscribe trực tiếp device/+/...
+        - Worker mode: topic không có trạng thái dùng $share/<group>/... để broker chia tải.
+          Topic stream mặc định subscribe đầy đủ và dispatcher lọc theo hash device_id,
+          vì mosquitto chia shared subscription theo từng message nên các chunk của một
+          stream có thể rơi vào nhiều worker. Với broker hỗ trợ chia theo client id
+          (MQTT_STREAM_ROUTING=shared) thì topic stream cũng dùng $share.
+        """
+        subscriptions = []
+        for topic, qos, is_stream in SUBSCRIPTIONS:
+            if self.worker_mode and (not is_stream or config.MQTT_STREAM_ROUTING == "shared"):
+                topic = shared_topic(config.MQTT_SHARE_GROUP, topic)
+            subscriptions.append((topic, qos))
+        return subscriptions
+    
     def on_message(self, client, userdata, msg):
         """
-        Callback khi nhận được message MQTT
-        Định tuyến message tới handler phù hợp
+        Callback khi nhận được message MQTT (chạy trên thread mạng của paho)
+        Chỉ chuyển message sang dispatcher, việc parse và xử lý diễn ra trên event loop
         """
+        if self.dispatcher is None:
+            logger.warning(f"No dispatcher for message from {msg.topic}")
+            return
         try:
-            payload = json.loads(msg.payload.decode())
-            topic_parts = msg.topic.split("/")
-            if msg.topic.endswith("audio"):
-                logger.info(f"Received audio from {msg.topic}")
-            else:
-                logger.info(f"Received message from {msg.topic}: {payload}")
-            
-            if len(topic_parts) >= 3:
-                device_id = topic_parts[1]
-                topic_type = topic_parts[2]  # stt, obstacle, info, etc.
-                
-                # Nếu có topic cuối cùng (e.g., audio trong device/id/stt/audio)
-                if len(topic_parts) >= 4:
-                    subtopic = topic_parts[3]
-                    handler_key = f"{topic_type}/{subtopic}"
-                else:
-                    handler_key = topic_type
-                
-                # # Tìm và gọi handler phù hợp
-                # if handler_key in self.message_handlers:
-                #     self.message_handlers[handler_key](self, device_id, payload)
-                # elif topic_type in self.message_handlers:
-                #     self.message_handlers[topic_type](self, device_id, payload)
-                # else:
-                #     logger.warning(f"No handler for topic: {msg.topic}")
-                handler = self.message_handlers.get(handler_key) or self.message_handlers.get(topic_type)
-                if handler:
-                    try:
-                        # Nếu handler sync (3 tham số, unbound) hoặc cần client:
-                        handler(self, device_id, payload)
-                    except TypeError:
-                        # Trường hợp handler là bound method: không truyền self của MQTTClient
-                        import asyncio, inspect
-                        if inspect.iscoroutinefunction(handler):
-                            try:
-                                loop = asyncio.get_running_loop()
-                                loop.create_task(handler(device_id, payload))
-                            except RuntimeError:
-                                asyncio.run(handler(device_id, payload))
-                        else:
-                            handler(device_id, payload)
-                    
-        except json.JSONDecodeError:
-            logger.error(f"Malformed JSON in message: {msg.topic}")
+            self.dispatcher.dispatch(msg.topic, msg.payload)
         except Exception as e:
-            logger.error(f"Error processing message from {msg.topic}: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.error(f"Error dispatching message from {msg.topic}: {e}", exc_info=True)
     
     def publish(self, topic, payload, qos=1, retain=False):
         """
@@ -176,7 +181,7 @@ class MQTTClient:
         Ngắt kết nối từ MQTT broker
         """
         # Thông báo server offline
-        self.client.publish("server/status",
+        self.client.publish(self.status_topic,
             json.dumps({
                 "status": "offline",
                 "serverId": self.server_id,
@@ -0,0 +1,192 @@
+"""
+Dispatch MQTT messages from the paho network thread to the asyncio loop
+"""
+import asyncio
+import inspect
+import json
+
+from log import setup_logger
+from mqtt.utils.audio_frame import AudioFrameError, decode_audio_frame
+from mqtt.utils.sharding import device_shard
+
+logger = setup_logger(__name__)
+
+
+class MessageDispatcher:
+    def __init__(self, message_handlers, loop, max_queue_size=256, idle_timeout=60.0,
+                 shard_index=0, shard_count=1, sharded_keys=()):
+        """
+        Khởi tạo dispatcher với bảng định tuyến đã biên dịch sẵn
+
+        Args:
+            message_handlers (dict): handler_key -> callable(device_id, payload)
+            loop: event loop asyncio của server, nơi các handler được chạy
+            max_queue_size (int): số message tối đa đang chờ cho mỗi thiết bị
+            idle_timeout (float): số giây không có message thì dừng worker của thiết bị
+            shard_index (int): chỉ số của worker hiện tại (worker mode)
+            shard_count (int): tổng số worker
+            sharded_keys: các handler_key chỉ xử lý khi thiết bị thuộc worker này
+        """
+        self.loop = loop
+        self.max_queue_size = max_queue_size
+        self.idle_timeout = idle_timeout
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.sharded_keys = frozenset(sharded_keys) if shard_count > 1 else frozenset()
+
+        self.routes = self._compile_routes(message_handlers or {})
+
+        # Queue và worker riêng cho từng thiết bị
+        self.device_queues = {}
+        self.device_tasks = {}
+
+        self.stats = {
+            "received": 0,
+            "dispatched": 0,
+            "dropped": 0,
+            "unrouted": 0,
+            "not_owned": 0,
+            "malformed": 0,
+            "errors": 0,
+            "max_queue_depth": 0,
+        }
+
+    @staticmethod
+    def _compile_routes(message_handlers):
+        """
+        Chuyển mỗi handler thành một coroutine function gọi trực tiếp,
+        tránh phải dò kiểu handler mỗi lần nhận message
+        """
+        routes = {}
+        for handler_key, handler in message_handlers.items():
+            if inspect.iscoroutinefunction(handler):
+                routes[handler_key] = handler
+            else:
+                routes[handler_key] = MessageDispatcher._wrap_sync(handler)
+        return routes
+
+    @staticmethod
+    def _wrap_sync(handler):
+        async def call(device_id, payload):
+            handler(device_id, payload)
+        return call
+
+    def dispatch(self, topic, raw_payload):
+        """
+        Gọi từ thread mạng của paho: chỉ định tuyến theo topic rồi chuyển
+        message sang event loop, không parse hay chạy handler tại đây
+        """
+        self.stats["received"] += 1
+        topic_parts = topic.split("/")
+        if len(topic_parts) < 3:
+            self.stats["unrouted"] += 1
+            return
+
+        device_id = topic_parts[1]
+        topic_type = topic_parts[2]  # stt, obstacle, info, etc.
+        handler_key = f"{topic_type}/{topic_parts[3]}" if len(topic_parts) >= 4 else topic_type
+
+        route = self.routes.get(handler_key) or self.routes.get(topic_type)
+        if route is None:
+            self.stats["unrouted"] += 1
+            logger.debug(f"No handler for topic: {topic}")
+            return
+
+        # Worker mode: mọi chunk của thiết bị chỉ được xử lý bởi đúng một worker
+        if handler_key in self.sharded_keys and device_shard(device_id, self.shard_count) != self.shard_index:
+            self.stats["not_owned"] += 1
+            return
+
+        self.loop.call_soon_threadsafe(self._enqueue, device_id, topic, route, raw_payload)
+
+    def _enqueue(self, device_id, topic, route, raw_payload):
+        """
+        Đưa message vào queue của thiết bị (chạy trên event loop)
+        """
+        queue = self.device_queues.get(device_id)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self.device_queues[device_id] = queue
+            self.device_tasks[device_id] = self.loop.create_task(self._device_worker(device_id, queue))
+
+        try:
+            queue.put_nowait((topic, route, raw_payload))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logger.warning(f"Queue of {device_id} is full ({self.max_queue_size}), dropped message from {topic}")
+            return
+
+        depth = queue.qsize()
+        if depth > self.stats["max_queue_depth"]:
+            self.stats["max_queue_depth"] = depth
+
+    async def _device_worker(self, device_id, queue):
+        """
+        Worker xử lý lần lượt các message của một thiết bị, thiết bị chậm
+        không làm ảnh hưởng tới thiết bị khác
+        """
+        try:
+            while True:
+                try:
+                    topic, route, raw_payload = await asyncio.wait_for(queue.get(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if queue.empty():
+                        break
+                    continue
+
+                payload = self._decode_payload(topic, raw_payload)
+                if payload is None:
+                    continue
+
+                try:
+                    await route(device_id, payload)
+                    self.stats["dispatched"] += 1
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.error(f"Error processing message from {topic}: {e}", exc_info=True)
+        finally:
+            self.device_queues.pop(device_id, None)
+            self.device_tasks.pop(device_id, None)
+
+    def _decode_payload(self, topic, raw_payload):
+        """
+        Parse payload theo loại topic (frame nhị phân hoặc JSON)
+        """
+        try:
+            if topic.endswith("audio_bin"):
+                # Frame nhị phân: header cố định + PCM thô, không qua JSON/base64
+                payload = decode_audio_frame(raw_payload)
+            else:
+                payload = json.loads(raw_payload)
+
+            if topic.endswith("audio") or topic.endswith("audio_bin"):
+                logger.debug(f"Received audio from {topic}")
+            else:
+                logger.info(f"Received message from {topic}: {payload}")
+            return payload
+        except json.JSONDecodeError:
+            logger.error(f"Malformed JSON in message: {topic}")
+        except AudioFrameError as e:
+            logger.error(f"Malformed audio frame in message: {topic}: {e}")
+        except UnicodeDecodeError:
+            logger.error(f"Malformed payload encoding in message: {topic}")
+        self.stats["malformed"] += 1
+        return None
+
+    def get_stats(self):
+        """
+        Trả về bộ đếm và độ sâu queue hiện tại của từng thiết bị
+        """
+        return {
+            **self.stats,
+            "queue_depths": {device_id: queue.qsize() for device_id, queue in self.device_queues.items()},
+        }
+
+    async def stop(self):
+        """
+        Dừng toàn bộ worker của các thiết bị
+        """
+        tasks = list(self.device_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
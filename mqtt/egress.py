@@ -0,0 +1,378 @@
+"""
+Paced, non-blocking audio egress from server to devices
+"""
+import asyncio
+import base64
+import concurrent.futures
+import itertools
+import time
+
+from log import setup_logger
+from mqtt.utils.audio_codec import PCM_CODEC, create_encoder, decode_to_pcm16
+
+logger = setup_logger(__name__)
+
+# PCM được mã hóa theo từng lát cỡ này (~170 ms audio 24 kHz, vài ms CPU với IMA-ADPCM)
+ENCODE_SLICE_BYTES = 8192
+
+
+class LiveAudioStream:
+    def __init__(self, loop):
+        """
+        Stream audio được ghi dần (producer) và gửi dần bởi sender của thiết bị (consumer)
+        """
+        self.queue = asyncio.Queue()
+        # Hoàn thành với True/False khi đã gửi xong, bị cancel nếu producer hủy giữa chừng
+        self.done = loop.create_future()
+        self.first_chunk_at = None
+
+    def write(self, data):
+        if data:
+            self.queue.put_nowait(data)
+
+    def close(self):
+        self.queue.put_nowait(None)
+
+    def abort(self):
+        """
+        Hủy stream: sender dừng ở phần audio kế tiếp
+        """
+        if not self.done.done():
+            self.done.cancel()
+        self.queue.put_nowait(None)
+
+    async def wait(self):
+        return await self.done
+
+
+class AudioEgressScheduler:
+    def __init__(self, mqtt_client, chunk_size=8192, chunk_interval=0.05, idle_timeout=60.0,
+                 codec_workers=2, opus_bitrate=24000):
+        """
+        Khởi tạo scheduler gửi audio về thiết bị
+
+        Args:
+            mqtt_client: MQTTClient dùng để publish
+            chunk_size (int): kích thước mặc định của mỗi chunk (bytes)
+            chunk_interval (float): khoảng nghỉ tối đa giữa hai chunk (giây)
+            idle_timeout (float): số giây không có audio thì dừng sender của thiết bị
+            codec_workers (int): số thread mã hóa audio sang codec nén của thiết bị
+            opus_bitrate (int): bitrate Opus (bit/s)
+        """
+        self.mqtt_client = mqtt_client
+        self.default_settings = {
+            "chunk_size": chunk_size,
+            "chunk_interval": chunk_interval,
+            # Codec thiết bị nhận được theo thứ tự ưu tiên, rỗng = gửi nguyên định dạng gốc
+            "codecs": [],
+        }
+        self.idle_timeout = idle_timeout
+        self.opus_bitrate = opus_bitrate
+        # Id stream = mốc khởi động + số thứ tự: hai stream kết thúc trong cùng một ms không trùng id,
+        # và id của lần chạy trước (thiết bị còn giữ) không bị dùng lại sau khi server khởi động lại
+        self._stream_prefix = f"server_{int(time.time() * 1000)}"
+        self._stream_counter = itertools.count(1)
+        # Mã hóa chạy ở thread riêng để không chặn event loop. Encoder IMA-ADPCM là vòng lặp
+        # Python giữ GIL nên nhiều thread không mã hóa song song được: pool chỉ để đẩy việc ra
+        # khỏi loop, và mỗi lần chỉ mã hóa một lát ENCODE_SLICE_BYTES để loop (nhịp gửi chunk)
+        # và các stream khác được xen vào giữa các lát
+        self.codec_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, codec_workers), thread_name_prefix="egress-codec"
+        )
+
+        # Cấu hình riêng, queue và sender task theo từng thiết bị
+        self.device_settings = {}
+        self.device_queues = {}
+        self.device_tasks = {}
+
+        self.stats = {
+            "streams_sent": 0,
+            "streams_cancelled": 0,
+            "chunks_sent": 0,
+            "bytes_sent": 0,
+            "errors": 0,
+            "transcoded_streams": 0,
+            "transcode_input_bytes": 0,
+            "transcode_output_bytes": 0,
+            "transcode_errors": 0,
+        }
+
+    def configure_device(self, device_id, chunk_size=None, chunk_interval=None, codecs=None):
+        """
+        Đặt kích thước chunk, nhịp gửi và codec (đã thương lượng) riêng cho một thiết bị
+        """
+        settings = self.device_settings.setdefault(device_id, {})
+        if chunk_size is not None:
+            settings["chunk_size"] = int(chunk_size)
+        if chunk_interval is not None:
+            settings["chunk_interval"] = float(chunk_interval)
+        if codecs is not None:
+            settings["codecs"] = list(codecs)
+
+    def get_device_settings(self, device_id):
+        return {**self.default_settings, **self.device_settings.get(device_id, {})}
+
+    def enqueue(self, device_id, audio_data, format_audio="pcm16le", sample_rate=16000):
+        """
+        Xếp một stream audio vào hàng đợi của thiết bị (gọi trên event loop)
+
+        Returns:
+            asyncio.Future: hoàn thành với True/False khi stream đã gửi xong
+        """
+        done = asyncio.get_running_loop().create_future()
+        self._get_queue(device_id).put_nowait((audio_data, format_audio, sample_rate, done))
+        return done
+
+    def open_stream(self, device_id, format_audio="pcm16le", sample_rate=16000):
+        """
+        Mở một stream audio chưa biết trước độ dài (ví dụ TTS đang tổng hợp), các phần
+        audio ghi vào được gửi ngay khi tới lượt stream này trong hàng đợi của thiết bị
+
+        Returns:
+            LiveAudioStream
+        """
+        stream = LiveAudioStream(asyncio.get_running_loop())
+        self._get_queue(device_id).put_nowait((stream, format_audio, sample_rate, stream.done))
+        return stream
+
+    def _new_stream_id(self):
+        return f"{self._stream_prefix}_{next(self._stream_counter)}"
+
+    def _get_queue(self, device_id):
+        queue = self.device_queues.get(device_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self.device_queues[device_id] = queue
+            self.device_tasks[device_id] = asyncio.get_running_loop().create_task(
+                self._device_sender(device_id, queue)
+            )
+        return queue
+
+    async def send(self, device_id, audio_data, format_audio="pcm16le", sample_rate=16000):
+        """
+        Gửi audio về thiết bị và đợi tới khi gửi xong, không chặn event loop
+        """
+        return await self.enqueue(device_id, audio_data, format_audio, sample_rate)
+
+    async def _device_sender(self, device_id, queue):
+        """
+        Sender của một thiết bị: gửi lần lượt các stream, mỗi chunk cách nhau
+        bằng timer bất đồng bộ nên các thiết bị khác được gửi xen kẽ
+        """
+        try:
+            while True:
+                try:
+                    audio_data, format_audio, sample_rate, done = await asyncio.wait_for(
+                        queue.get(), timeout=self.idle_timeout
+                    )
+                except asyncio.TimeoutError:
+                    if queue.empty():
+                        break
+                    continue
+
+                if done.cancelled():
+                    # Yêu cầu đã bị hủy (người dùng nói chen) trước khi tới lượt gửi
+                    self.stats["streams_cancelled"] += 1
+                    continue
+
+                try:
+                    if isinstance(audio_data, LiveAudioStream):
+                        result = await self._send_live_stream(device_id, audio_data, format_audio, sample_rate)
+                    else:
+                        result = await self._send_stream(device_id, audio_data, format_audio, sample_rate, done)
+                except asyncio.CancelledError:
+                    if not done.done():
+                        done.cancel()
+                    raise
+                if not done.done():
+                    done.set_result(result)
+        finally:
+            self.device_queues.pop(device_id, None)
+            self.device_tasks.pop(device_id, None)
+
+    async def _send_stream(self, device_id, audio_data, format_audio, sample_rate, done=None):
+        """
+        Chia audio thành các chunk và publish theo nhịp đã cấu hình,
+        dừng giữa chừng nếu caller đã hủy (done bị cancel)
+        """
+        try:
+            settings = self.get_device_settings(device_id)
+            chunk_size = settings["chunk_size"]
+            codecs = settings["codecs"]
+            if codecs and not (format_audio == PCM_CODEC and codecs[0] == PCM_CODEC):
+                audio_data, format_audio, sample_rate = await self._transcode(
+                    audio_data, format_audio, sample_rate, codecs
+                )
+            stream_id = self._new_stream_id()
+            total_chunks = (len(audio_data) + chunk_size - 1) // chunk_size
+            if total_chunks == 0:
+                return True
+
+            logger.info(f"Sending audio to device {device_id}, total chunks: {total_chunks}, total size: {len(audio_data)} bytes")
+
+            # Thêm delay nhỏ giữa các gói tin, tính theo mốc thời gian để không bị trôi nhịp
+            delay = min(settings["chunk_interval"], 1.0 / total_chunks)
+            loop = asyncio.get_running_loop()
+            started_at = loop.time()
+            audio_view = memoryview(audio_data)
+
+            for i in range(total_chunks):
+                if done is not None and done.cancelled():
+                    self.stats["streams_cancelled"] += 1
+                    logger.info(f"Stopped sending audio to device {device_id} after {i}/{total_chunks} chunks")
+                    return False
+                start = i * chunk_size
+                chunk_data = audio_view[start:start + chunk_size]
+
+                self._publish_chunk(device_id, stream_id, i, total_chunks, i == total_chunks - 1,
+                                    format_audio, sample_rate, chunk_data)
+
+                if i < total_chunks - 1:
+                    next_send_at = started_at + (i + 1) * delay
+                    await asyncio.sleep(max(0.0, next_send_at - loop.time()))
+
+            self.stats["streams_sent"] += 1
+            logger.info(f"Successfully sent {total_chunks} audio chunks to device {device_id}")
+            return True
+
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Error sending audio to device {device_id}: {e}", exc_info=True)
+            return False
+
+    async def _send_live_stream(self, device_id, stream, format_audio, sample_rate):
+        """
+        Gửi các phần audio của một stream live ngay khi chúng tới, không chờ đủ cả stream
+
+        Chunk trung gian mang totalChunks = 0 (chưa biết), chunk cuối (có thể rỗng) mang
+        isLast = true và tổng số chunk thực tế. Các chunk cách nhau chunk_interval như
+        _send_stream (tính theo mốc thời gian); phần audio tới cả khối (câu đã cache hoặc
+        tổng hợp trước) cũng không bị dồn thành một loạt.
+        """
+        settings = self.get_device_settings(device_id)
+        chunk_size = settings["chunk_size"]
+        interval = settings["chunk_interval"]
+        stream_id = self._new_stream_id()
+        index = 0
+        # PCM của TTS được mã hóa dần theo từng phần, encoder giữ trạng thái giữa các phần
+        encoder = None
+        if settings["codecs"] and format_audio == PCM_CODEC:
+            encoder = create_encoder(settings["codecs"], sample_rate, opus_bitrate=self.opus_bitrate)
+            if encoder.name == PCM_CODEC:
+                encoder = None
+            else:
+                format_audio = encoder.name
+                self.stats["transcoded_streams"] += 1
+        loop = asyncio.get_running_loop()
+        tail = b""
+        next_send_at = loop.time()
+        try:
+            while True:
+                data = await stream.queue.get()
+                if stream.done.cancelled():
+                    self.stats["streams_cancelled"] += 1
+                    logger.info(f"Stopped live audio to device {device_id} after {index} chunks")
+                    return False
+                if data is None:
+                    if encoder is not None:
+                        tail = encoder.flush()
+                        self.stats["transcode_output_bytes"] += len(tail)
+                    break
+                if encoder is not None:
+                    self.stats["transcode_input_bytes"] += len(data)
+                    data = await self._encode(encoder, data)
+                    self.stats["transcode_output_bytes"] += len(data)
+                view = memoryview(data)
+                for start in range(0, len(view), chunk_size):
+                    await asyncio.sleep(max(0.0, next_send_at - loop.time()))
+                    if stream.done.cancelled():
+                        self.stats["streams_cancelled"] += 1
+                        logger.info(f"Stopped live audio to device {device_id} after {index} chunks")
+                        return False
+                    # Producer chậm hơn nhịp gửi thì tính mốc từ lúc gửi, không gửi bù thành loạt
+                    next_send_at = max(next_send_at, loop.time()) + interval
+                    self._publish_chunk(device_id, stream_id, index, 0, False,
+                                        format_audio, sample_rate, view[start:start + chunk_size])
+                    if stream.first_chunk_at is None:
+                        stream.first_chunk_at = time.perf_counter()
+                    index += 1
+
+            if tail:
+                await asyncio.sleep(max(0.0, next_send_at - loop.time()))
+            self._publish_chunk(device_id, stream_id, index, index + 1, True, format_audio, sample_rate, tail)
+            self.stats["streams_sent"] += 1
+            logger.info(f"Successfully sent {index + 1} live audio chunks to device {device_id}")
+            return True
+
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Error sending live audio to device {device_id}: {e}", exc_info=True)
+            return False
+
+    async def _encode(self, encoder, pcm):
+        """
+        Mã hóa PCM ở codec_pool theo từng lát ENCODE_SLICE_BYTES (encoder giữ trạng thái giữa các lát)
+        """
+        loop = asyncio.get_running_loop()
+        view = memoryview(pcm)
+        parts = []
+        for start in range(0, len(view), ENCODE_SLICE_BYTES):
+            parts.append(await loop.run_in_executor(
+                self.codec_pool, encoder.encode, view[start:start + ENCODE_SLICE_BYTES]
+            ))
+        return b"".join(parts)
+
+    async def _transcode(self, audio_data, format_audio, sample_rate, codecs):
+        """
+        Mã hóa cả đoạn audio sang codec của thiết bị ở thread pool, lỗi thì gửi nguyên bản gốc
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            pcm, new_rate = audio_data, sample_rate
+            if format_audio != PCM_CODEC:
+                pcm, new_rate = await loop.run_in_executor(self.codec_pool, decode_to_pcm16, audio_data, format_audio)
+            encoder = create_encoder(codecs, new_rate, opus_bitrate=self.opus_bitrate)
+            data = await self._encode(encoder, pcm) + encoder.flush()
+            new_format = encoder.name
+        except Exception as e:
+            self.stats["transcode_errors"] += 1
+            logger.warning(f"Cannot transcode {format_audio} audio to {codecs}, sending as is: {e}")
+            return audio_data, format_audio, sample_rate
+        if new_format != format_audio:
+            self.stats["transcoded_streams"] += 1
+            self.stats["transcode_input_bytes"] += len(audio_data)
+            self.stats["transcode_output_bytes"] += len(data)
+        return data, new_format, new_rate
+
+    def _publish_chunk(self, device_id, stream_id, index, total_chunks, is_last, format_audio, sample_rate, chunk_data):
+        payload = {
+            "serverStreamId": stream_id,
+            "chunkIndex": index,
+            "totalChunks": total_chunks,
+            "isLast": is_last,
+            "timestamp": int(time.time() * 1000),
+            "format": format_audio,
+            "sampleRate": sample_rate,
+            "data": base64.b64encode(chunk_data).decode()
+        }
+
+        # Gửi đến topic dành cho audio từ server đến thiết bị với QoS=1
+        self.mqtt_client.publish(f"server/{device_id}/audio", payload, qos=1)
+        self.stats["chunks_sent"] += 1
+        self.stats["bytes_sent"] += len(chunk_data)
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "queue_depths": {device_id: queue.qsize() for device_id, queue in self.device_queues.items()},
+        }
+
+    async def stop(self):
+        """
+        Dừng toàn bộ sender của các thiết bị
+        """
+        tasks = list(self.device_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.codec_pool.shutdown(wait=False)
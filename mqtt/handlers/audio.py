@@ -3,138 +3,463 @@ Handler for audio processing with multi-agent system
 """
 import asyncio
 import base64
+import collections
+import functools
+import inspect
 import os
-import threading
 import time
 import numpy as np
 import soundfile as sf
-from transformers import pipeline
 
 from log import setup_logger
-from mcp_custom.service.tts import generate_tts
-from module.stt.vin_ai_pho_whisper import VinAiPhoWhisper
+from mcp_custom.service.tts import stream_tts, synthesize_full
+from mcp_custom.service.tts_cache import TTSCache
+from module.stt.dsp import AudioDecodeError, AudioPreprocessor, decode_audio
+from module.stt.executor import STTExecutor, STTNotReadyError, STTOverloadedError
+from module.stt.incremental import IncrementalTranscriber
+from module.stt.utils import pcm16le_to_float32
+from module.stt.vad import EnergyVAD
+from module.stt.registry import create_backend
 from multi_agent_system import MultiAgentSystem
-from config import LLM_API_KEY, LLM_MODEL, LLM_BASE_URL
+from config import (
+    LLM_API_KEY, LLM_MODEL, LLM_BASE_URL, EGRESS_CHUNK_SIZE, EGRESS_CHUNK_INTERVAL_MS, EGRESS_CODECS,
+    EGRESS_CODEC_WORKERS, EGRESS_OPUS_BITRATE,
+    AUDIO_SAVE_RECORDINGS, AUDIO_NACK_ENABLED, AUDIO_NACK_TIMEOUT_MS, AUDIO_NACK_MAX_RETRIES, STT_INCREMENTAL,
+    AUDIO_STREAM_TTL_S, AUDIO_STREAM_MAX_DEVICE_BYTES, AUDIO_STREAM_MAX_TOTAL_BYTES, STT_INCREMENTAL_WINDOW_S, STT_INCREMENTAL_OVERLAP_S,
+    STT_VAD_ENABLED, STT_VAD_THRESHOLD_DB, STT_WORKERS, STT_WORKER_MODE, STT_MAX_PENDING, STT_TIMEOUT_S,
+    STT_BATCH_SIZE, STT_BATCH_WAIT_MS, STT_BACKEND, STT_SHARE_WEIGHTS, STT_DSP_ENABLED, STT_DSP_TARGET_RMS_DB,
+    ADMISSION_STT_CONCURRENCY, ADMISSION_LLM_CONCURRENCY, ADMISSION_TTS_CONCURRENCY, ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT_S, ADMISSION_MAX_INFLIGHT_PER_DEVICE, BUSY_MESSAGE, TTS_STREAMING, TTS_LOOKAHEAD,
+    TTS_VOICE, TTS_SPEED, TTS_STREAM_FORMAT, TTS_CACHE_ENABLED, TTS_CACHE_MEMORY_BYTES, TTS_CACHE_DIR,
+    TTS_CACHE_DISK_MAX_BYTES, TTS_CACHE_DISK_MIN_USES, TTS_CACHE_MAX_CHARS, TTS_CACHE_PREWARM,
+    TTS_SEGMENT_MIN_CHARS, TTS_SEGMENT_MAX_CHARS, TTS_SEGMENT_IDLE_MS
+)
+from mqtt.admission import AdmissionController, AdmissionRejected
 from mqtt.client import MQTTClient
+from mqtt.egress import AudioEgressScheduler
+from mqtt.utils.audio_codec import negotiate_codecs
+from mqtt.utils.segmenter import SentenceSegmenter, segment_text
+from mqtt.utils.reassembly import ReassemblyError, StreamReassembler
+from mqtt.utils.stream_store import StreamBufferStore
 
 logger = setup_logger(__name__)
 
+# Số chỉ số chunk tối đa trong một message NACK, phần còn lại được yêu cầu ở lần sau
+NACK_MAX_INDICES = 64
+# Số stream đã xong được ghi nhớ để bỏ qua chunk gửi lại muộn
+COMPLETED_STREAMS_MEMORY = 256
+
+
 class AgentAudioHandler:
     def __init__(self, mqtt_client: MQTTClient, multi_agent_system: MultiAgentSystem):
         """
         Khởi tạo AgentAudioHandler với multi-agent system và STT model
         """
-        # Dictionary để lưu trữ các audio chunks đang được nhận
-        self.audio_stream_buffers = {}
+        # Các stream audio đang được nhận, hết hạn và giới hạn bộ nhớ ngay trên event loop
+        self.audio_stream_buffers = StreamBufferStore(
+            ttl=AUDIO_STREAM_TTL_S,
+            max_device_bytes=AUDIO_STREAM_MAX_DEVICE_BYTES,
+            max_total_bytes=AUDIO_STREAM_MAX_TOTAL_BYTES,
+            on_evict=self._on_stream_evicted
+        )
         
         self.mqtt_client = mqtt_client
         
+        # Scheduler gửi audio về thiết bị theo nhịp, không chặn event loop
+        self.egress = AudioEgressScheduler(
+            mqtt_client,
+            chunk_size=EGRESS_CHUNK_SIZE,
+            chunk_interval=EGRESS_CHUNK_INTERVAL_MS / 1000,
+            codec_workers=EGRESS_CODEC_WORKERS,
+            opus_bitrate=EGRESS_OPUS_BITRATE
+        )
+        
         # Khởi tạo multi-agent system
         self.multi_agent_system = multi_agent_system
        
 
-        # Khởi tạo model STT
-        self.transcriber = VinAiPhoWhisper()
+        # Khởi tạo pool worker STT, mỗi worker giữ một model của backend đã chọn.
+        # Model được nạp nền, server vẫn kết nối MQTT trong lúc model khởi động
+        self.stt_executor = STTExecutor(
+            functools.partial(create_backend, STT_BACKEND),
+            workers=STT_WORKERS,
+            mode=STT_WORKER_MODE,
+            max_pending=STT_MAX_PENDING,
+            timeout=STT_TIMEOUT_S,
+            batch_size=STT_BATCH_SIZE,
+            batch_wait_ms=STT_BATCH_WAIT_MS,
+            share_weights=STT_SHARE_WEIGHTS
+        )
+        self.stt_executor.start()
+        
+        # Thống kê ghép stream audio
+        self.stream_stats = {
+            "completed": 0,
+            "duplicate_chunks": 0,
+            "invalid": 0,
+            "nack_sent": 0,
+            "nack_recovered": 0,
+            "nack_failed": 0,
+            "barge_ins": 0,
+            "superseded": 0,
+        }
+        
+        # Yêu cầu đang xử lý của từng thiết bị (STT -> agent -> TTS -> gửi audio), bị hủy khi người dùng nói chen
+        self.device_requests = {}
+        self.superseded_requests = {}
+        # Các stream vừa xử lý xong hoặc đã bị bỏ, để bản gửi lại muộn (QoS 1, NACK)
+        # không mở ra stream mới
+        self.closed_streams = collections.OrderedDict()
+        # Task xử lý STT + agent cho các stream đã nhận đủ
+        self.processing_tasks = set()
+        # Thiết bị bật/tắt nhận dạng tăng dần (mặc định theo STT_INCREMENTAL)
+        self.incremental_stt_devices = {}
         
-        # Khởi tạo luồng cleanup
-        self.cleanup_thread = None
-        self.is_running = False
+        # VAD cắt im lặng trước khi STT
+        self.vad = EnergyVAD(threshold_db=STT_VAD_THRESHOLD_DB) if STT_VAD_ENABLED else None
+        self.vad_stats = {
+            "input_seconds": 0.0,
+            "removed_seconds": 0.0,
+            "silent_dropped": 0,
+        }
+        
+        # Giới hạn đồng thời của STT/LLM/TTS và số yêu cầu mỗi thiết bị, quá tải thì trả lời "bận"
+        self.admission = AdmissionController(
+            {
+                "stt": ADMISSION_STT_CONCURRENCY,
+                "llm": ADMISSION_LLM_CONCURRENCY,
+                "tts": ADMISSION_TTS_CONCURRENCY,
+            },
+            max_waiting=ADMISSION_MAX_QUEUE,
+            wait_timeout=ADMISSION_QUEUE_TIMEOUT_S,
+            max_inflight_per_device=ADMISSION_MAX_INFLIGHT_PER_DEVICE
+        )
+        # Audio của câu "bận" được dựng một lần khi khởi động (audio, format_audio, sample_rate)
+        self.busy_audio = None
+        # Cache audio của các câu lặp lại (chào, cảnh báo, báo lỗi...), dựng sẵn khi khởi động
+        self.tts_cache = TTSCache(
+            synthesize_full,
+            voice=TTS_VOICE,
+            speed=TTS_SPEED,
+            audio_format=TTS_STREAM_FORMAT,
+            memory_bytes=TTS_CACHE_MEMORY_BYTES,
+            cache_dir=TTS_CACHE_DIR,
+            disk_max_bytes=TTS_CACHE_DISK_MAX_BYTES,
+            disk_min_uses=TTS_CACHE_DISK_MIN_USES
+        ) if TTS_CACHE_ENABLED else None
+        
+        # Time-to-first-audio (ms) của các câu TTS gần nhất
+        self.ttfa_samples = collections.deque(maxlen=256)
+        self.tts_stats = {
+            "sentences": 0,
+            "streamed": 0,
+            "cached": 0,
+            "merged_fragments": 0,
+            "forced_splits": 0,
+            "idle_flushes": 0,
+        }
         
-        # Queue cho text stream -> từng câu hoàn chỉnh
-        self.text_stream_queues = {}
-        # Task đang chạy tách câu và TTS theo device
-        self.text_stream_tasks = {}
+        # Chuẩn hóa audio (16 kHz, bỏ DC, mức RMS) trước STT, chạy ở worker thread
+        self.dsp = AudioPreprocessor(target_rms_db=STT_DSP_TARGET_RMS_DB) if STT_DSP_ENABLED else None
+        self.dsp_stats = {
+            "processed": 0,
+            "resampled": 0,
+            "clipped": 0,
+            "decode_failed": 0,
+            "processing_ms": 0.0,
+        }
      
 
-    def start_cleanup_thread(self):
-        """ 
-        Khởi động luồng dọn dẹp các audio buffer định kỳ
-        """
-        if self.cleanup_thread is None or not self.cleanup_thread.is_alive():
-            self.is_running = True
-            self.cleanup_thread = threading.Thread(target=self._cleanup_audio_buffers, daemon=True)
-            self.cleanup_thread.start()
-            logger.info("Audio buffer cleanup thread started")
-    
-    def stop_cleanup_thread(self):
-        """
-        Dừng luồng dọn dẹp audio buffer
-        """
-        self.is_running = False
-        if self.cleanup_thread and self.cleanup_thread.is_alive():
-            self.cleanup_thread.join(timeout=1)
-            logger.info("Audio buffer cleanup thread stopped")
-    
-    def _cleanup_audio_buffers(self):
-        """
-        Dọn dẹp các audio buffer đã quá hạn (không nhận đủ chunks)
-        """
-        while self.is_running:
-            current_time = time.time()
-            for stream_key in list(self.audio_stream_buffers.keys()):
-                # Nếu buffer tồn tại quá 60s mà chưa nhận đủ chunks
-                if current_time - self.audio_stream_buffers[stream_key]["timestamp"] > 60:
-                    device_id, stream_id = stream_key.split("_", 1)
-                    logger.warning(f"Audio stream {stream_id} from {device_id} timed out, cleaning up")
-                    del self.audio_stream_buffers[stream_key]
-            
-            # Kiểm tra mỗi 30 giây
-            time.sleep(30)
+    def _on_stream_evicted(self, stream_key, stream_buffer, reason):
+        """
+        Stream bị bỏ do hết hạn hoặc vượt giới hạn bộ nhớ
+        """
+        self._discard_stream(stream_buffer)
+        self._remember_closed(stream_key)
+        device_id, stream_id = stream_key.split("_", 1)
+        reassembly = stream_buffer["reassembly"]
+        logger.warning(f"Dropped audio stream {stream_id} from {device_id} ({reason}, "
+                       f"{reassembly.received}/{reassembly.total_chunks} chunks)")
+
+    def close(self):
+        """
+        Bỏ mọi stream đang nhận và hủy các yêu cầu đang xử lý (gọi trên event loop khi server dừng)
+        """
+        for task in list(self.device_requests.values()):
+            task.cancel()
+        for stream_key in self.audio_stream_buffers.keys():
+            self._discard_stream(self.audio_stream_buffers.pop(stream_key))
+        self.audio_stream_buffers.clear()
+
+    async def prerender_phrases(self):
+        """
+        Dựng sẵn audio của câu trả lời "bận" và các câu hay dùng để lúc cần không phải gọi TTS
+        """
+        if self.tts_cache is None:
+            try:
+                self.busy_audio = await synthesize_full(BUSY_MESSAGE)
+                logger.info("Pre-rendered busy message audio")
+            except Exception as e:
+                logger.error(f"Failed to pre-render busy message: {e}")
+            return
+        # Câu trả lời được phát theo từng câu, nên cache cũng lưu theo từng câu
+        phrases = [BUSY_MESSAGE]
+        for phrase in TTS_CACHE_PREWARM:
+            phrases.extend(segment_text(phrase, min_chars=TTS_SEGMENT_MIN_CHARS, max_chars=TTS_SEGMENT_MAX_CHARS))
+        rendered = await self.tts_cache.prewarm(list(dict.fromkeys(phrases)))
+        self.busy_audio = rendered.get(BUSY_MESSAGE)
+
+    async def _send_busy(self, device_id):
+        """
+        Báo thiết bị hệ thống đang bận, không chiếm slot TTS
+        """
+        if self.busy_audio is None:
+            self.send_tts_response(device_id, BUSY_MESSAGE)
+            return
+        audio, format_audio, fs = self.busy_audio
+        await self.send_audio_to_device(device_id, audio, format_audio=format_audio, sample_rate=fs)
 
-    def _get_text_queue(self, device_id: str):
-        if device_id not in self.text_stream_queues:
-            self.text_stream_queues[device_id] = asyncio.Queue()
-        return self.text_stream_queues[device_id]
+    def set_device_codecs(self, device_id, device_codecs):
+        """
+        Chọn codec audio gửi về thiết bị theo danh sách codec thiết bị báo trong info
+
+        Returns:
+            list: các codec đã thương lượng, theo thứ tự ưu tiên của server
+        """
+        codecs = negotiate_codecs(device_codecs, EGRESS_CODECS)
+        self.egress.configure_device(device_id, codecs=codecs)
+        logger.info(f"Egress codecs for {device_id}: {codecs or 'original format'}")
+        return codecs
+
+    async def _transcribe(self, audio_data, **kwargs):
+        """
+        Nhận dạng trong slot của tầng STT
+        """
+        async with self.admission.stage("stt").slot():
+            return await self.stt_executor.transcribe(audio_data, **kwargs)
 
-    async def _sentence_stream_worker(self, device_id: str):
+    async def _synthesize(self, text, pieces: asyncio.Queue):
         """
-        Worker: nhận các chunk text, gom thành câu theo dấu câu (., !, ?, xuống dòng),
-        khi đủ một câu thì generate TTS và gửi âm thanh về thiết bị.
+        Tổng hợp một câu trong slot của tầng TTS, đẩy từng phần audio vào pieces
+
+        Mỗi phần là (data, format_audio, sample_rate); None đánh dấu câu đã xong (kể cả khi lỗi).
+        Câu đã có trong cache được lấy ra ngay, không chiếm slot TTS. Khi tầng TTS từ chối,
+        AdmissionRejected được đẩy vào pieces để _play hủy cả câu trả lời thay vì bỏ câu này.
         """
-        queue = self._get_text_queue(device_id)
-        buffer = ""
+        try:
+            cached = await self.tts_cache.get(text) if self.tts_cache is not None else None
+            if cached is not None:
+                self.tts_stats["cached"] += 1
+                pieces.put_nowait(cached)
+                return
+            async with self.admission.stage("tts").slot():
+                if TTS_STREAMING:
+                    # Câu ngắn được gom lại để lưu vào cache sau khi tổng hợp xong
+                    keep = [] if self.tts_cache is not None and len(text) <= TTS_CACHE_MAX_CHARS else None
+                    async for item in stream_tts(text):
+                        pieces.put_nowait(item)
+                        if keep is not None:
+                            keep.append(item)
+                    if keep:
+                        self._cache_sentence(text, keep)
+                else:
+                    pieces.put_nowait(await synthesize_full(text))
+        except AdmissionRejected as e:
+            pieces.put_nowait(e)
+        except Exception as e:
+            logger.error(f"TTS error for '{text}': {e}")
+        finally:
+            pieces.put_nowait(None)
+
+    def _cache_sentence(self, text, items):
+        """
+        Lưu audio của một câu vừa tổng hợp (các phần PCM được nối lại) vào cache
+        """
+        formats = {format_audio for _, format_audio, _ in items}
+        if formats == {"pcm16le"}:
+            self.tts_cache.put(text, b"".join(data for data, _, _ in items), "pcm16le", items[0][2])
+        elif len(items) == 1:
+            self.tts_cache.put(text, *items[0])
+
+    async def _play(self, device_id, pieces: asyncio.Queue):
+        """
+        Gửi audio của một câu về thiết bị theo thứ tự các phần trong pieces (queue do _synthesize đẩy vào)
+        """
+        # Câu được tổng hợp trước chỉ tính độ trễ từ lúc tới lượt phát
+        ready = time.perf_counter()
+        stream = None
         try:
             while True:
-                chunk = await queue.get()
+                item = await pieces.get()
+                if item is None:
+                    break
+                if isinstance(item, AdmissionRejected):
+                    raise item
+                data, format_audio, sample_rate = item
+                if format_audio != "pcm16le" or not TTS_STREAMING:
+                    # Cả câu tổng hợp xong mới gửi (định dạng nén không cắt được giữa chừng)
+                    self._record_ttfa(device_id, time.perf_counter() - ready, streamed=False)
+                    await self.send_audio_to_device(device_id, data, format_audio=format_audio, sample_rate=sample_rate)
+                    continue
+                if stream is None:
+                    stream = self.egress.open_stream(device_id, format_audio, sample_rate)
+                stream.write(data)
+            if stream is None:
+                return
+            stream.close()
+            await stream.wait()
+        except BaseException:
+            if stream is not None:
+                stream.abort()
+            raise
+        if stream.first_chunk_at is not None:
+            self._record_ttfa(device_id, stream.first_chunk_at - ready, streamed=True)
+
+    def _record_ttfa(self, device_id, seconds, streamed):
+        """
+        Ghi nhận time-to-first-audio của một câu: từ lúc câu tới lượt phát tới khi chunk audio đầu tiên được gửi
+        """
+        self.ttfa_samples.append(seconds * 1000)
+        self.tts_stats["sentences"] += 1
+        self.tts_stats["streamed"] += streamed
+        logger.info(f"TTS time-to-first-audio for {device_id}: {seconds * 1000:.0f} ms"
+                    f"{' (streamed)' if streamed else ''}")
+
+    async def _sentence_stream_worker(self, device_id: str, queue: asyncio.Queue):
+        """
+        Worker: nhận các chunk text, tách câu tăng dần (SentenceSegmenter),
+        tổng hợp TTS và gửi âm thanh về thiết bị.
+        Trong lúc một câu đang phát, tối đa TTS_LOOKAHEAD câu sau được tổng hợp trước;
+        audio vẫn được phát đúng thứ tự câu.
+        Mỗi yêu cầu có queue và worker riêng nên câu trả lời của hai yêu cầu không bị trộn lẫn.
+        """
+        # Queue audio của các câu đã bắt đầu tổng hợp, theo thứ tự phát
+        jobs = asyncio.Queue()
+        # Giới hạn số câu đang tổng hợp/chờ phát: câu đang phát + TTS_LOOKAHEAD câu sau
+        slots = asyncio.Semaphore(max(0, TTS_LOOKAHEAD) + 1)
+        synth_tasks = set()
+        player = asyncio.create_task(self._play_sentences(device_id, jobs, slots))
+
+        async def submit(sentence):
+            if player.done():
+                # Việc phát đã dừng vì TTS từ chối một câu: báo lỗi lên yêu cầu
+                await player
+            await slots.acquire()
+            pieces = asyncio.Queue()
+            task = asyncio.create_task(self._synthesize(sentence, pieces))
+            synth_tasks.add(task)
+            task.add_done_callback(synth_tasks.discard)
+            jobs.put_nowait(pieces)
+
+        segmenter = SentenceSegmenter(min_chars=TTS_SEGMENT_MIN_CHARS, max_chars=TTS_SEGMENT_MAX_CHARS)
+        idle_timeout = TTS_SEGMENT_IDLE_MS / 1000
+        try:
+            while True:
+                try:
+                    if segmenter.pending:
+                        chunk = await asyncio.wait_for(queue.get(), timeout=idle_timeout)
+                    else:
+                        chunk = await queue.get()
+                except asyncio.TimeoutError:
+                    # LLM tạm ngừng (ví dụ đang gọi tool): đọc luôn phần đã có thay vì im lặng
+                    self.tts_stats["idle_flushes"] += 1
+                    for sent in segmenter.flush(partial=True):
+                        await submit(sent)
+                    continue
                 if chunk is None:
-                    # tín hiệu kết thúc stream cho device
+                    # tín hiệu kết thúc stream của yêu cầu
                     break
-                buffer += chunk
-                # Tìm câu hoàn chỉnh
-                sentences = []
-                start = 0
-                for i, ch in enumerate(buffer):
-                    if ch in ".!?\n":
-                        sentences.append(buffer[start:i+1].strip())
-                        start = i+1
-                buffer = buffer[start:]
-
-                for sent in sentences:
-                    if not sent:
-                        continue
-                    try:
-                        audio, fs = await generate_tts(sent)
-                        self.send_audio_to_device(device_id, audio, format_audio="pcm16le", sample_rate=fs)
-                    except Exception as e:
-                        logger.error(f"TTS/send error for {device_id}: {e}")
+                for sent in segmenter.feed(chunk):
+                    await submit(sent)
+
+            # flush phần còn lại nếu có (bỏ qua khi yêu cầu bị hủy)
+            for sent in segmenter.flush():
+                await submit(sent)
+            jobs.put_nowait(None)
+            await player
         finally:
-            # flush phần còn lại nếu có
-            residual = buffer.strip()
-            if residual:
-                try:
-                    audio, fs = await generate_tts(residual)
-                    self.send_audio_to_device(device_id, audio, format_audio="pcm16le", sample_rate=fs)
-                except Exception as e:
-                    logger.error(f"Final TTS/send error for {device_id}: {e}")
-            self.text_stream_tasks.pop(device_id, None)
-            self.text_stream_queues.pop(device_id, None)
-    
+            player.cancel()
+            for task in synth_tasks:
+                task.cancel()
+            self.tts_stats["merged_fragments"] += segmenter.stats["merged"]
+            self.tts_stats["forced_splits"] += segmenter.stats["forced"]
+
+    async def _play_sentences(self, device_id, jobs: asyncio.Queue, slots: asyncio.Semaphore):
+        """
+        Phát lần lượt các câu theo thứ tự, nhả slot lookahead khi một câu phát xong
+        """
+        while True:
+            pieces = await jobs.get()
+            if pieces is None:
+                return
+            try:
+                await self._play(device_id, pieces)
+            except AdmissionRejected:
+                # TTS quá tải giữa câu trả lời: dừng phát, yêu cầu sẽ trả lời "bận"
+                raise
+            except Exception as e:
+                logger.error(f"TTS/send error for {device_id}: {e}")
+            finally:
+                slots.release()
+
+    def _barge_in(self, device_id):
+        """
+        Người dùng bắt đầu nói yêu cầu mới: hủy yêu cầu cũ của thiết bị và dừng phát audio
+
+        Returns:
+            asyncio.Task hoặc None: yêu cầu cũ đang được hủy
+        """
+        previous = self.device_requests.pop(device_id, None)
+        if previous is None or previous.done():
+            return None
+        previous.cancel()
+        # Yêu cầu mới của thiết bị đợi yêu cầu cũ hủy xong rồi mới bắt đầu
+        self.superseded_requests[device_id] = previous
+        self.stream_stats["barge_ins"] += 1
+        self.mqtt_client.publish(f"server/{device_id}/command", {
+            "command": "stop_audio",
+            "ts": int(time.time() * 1000)
+        }, qos=1)
+        logger.info(f"Barge-in from {device_id}: cancelled previous request and stopped playback")
+        return previous
+
+    def _start_request(self, device_id, coro, on_abort=None):
+        """
+        Chạy một yêu cầu trong task riêng có thể hủy, thay thế yêu cầu cũ của thiết bị
+
+        Args:
+            on_abort: callable dọn dẹp khi yêu cầu bị hủy trước khi coro kịp chạy
+        """
+        previous = self._barge_in(device_id) or self.superseded_requests.pop(device_id, None)
+        self.superseded_requests.pop(device_id, None)
+        task = self._spawn(self._run_request(previous, coro))
+        self.device_requests[device_id] = task
+
+        def _forget(done_task):
+            if self.device_requests.get(device_id) is done_task:
+                del self.device_requests[device_id]
+            # Bị hủy trước khi coro kịp chạy (kể cả trước bước đầu tiên của task, khi chunk cuối
+            # của stream cũ và chunk đầu của stream mới tới cùng lượt): khối finally của coro
+            # không chạy nên phải đóng và dọn dẹp ở đây
+            if inspect.getcoroutinestate(coro) == inspect.CORO_CREATED:
+                coro.close()
+                if on_abort is not None:
+                    on_abort()
+        task.add_done_callback(_forget)
+        return task
+
+    async def _run_request(self, previous, coro):
+        # Đợi yêu cầu cũ dọn dẹp xong (nhả slot LLM/TTS, slot của thiết bị) rồi mới bắt đầu
+        if previous is not None:
+            await asyncio.wait([previous])
+        await coro
+
     def save_audio_file(self, audio_data, device_id, stream_id, format_audio, sample_rate):
         """
-        Lưu dữ liệu âm thanh vào một file duy nhất, ghi đè nếu file đã tồn tại
+        Lưu dữ liệu âm thanh vào file riêng cho từng stream (chạy trong worker thread)
         
         Args:
-            audio_data: Dữ liệu âm thanh dạng bytes
+            audio_data: Dữ liệu âm thanh dạng bytes hoặc memoryview
             device_id: ID của thiết bị gửi âm thanh
             stream_id: ID của luồng âm thanh
             format_audio: Định dạng âm thanh (pcm16le, wav, etc.)
@@ -148,8 +473,8 @@ class AgentAudioHandler:
             audio_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "audio", "recordings")
             os.makedirs(audio_dir, exist_ok=True)
             
-            # Sử dụng tên file cố định là "audio_recording" thay vì tạo tên file dựa trên timestamp
-            file_name = "audio_recording"
+            # Tên file riêng theo thiết bị/stream để hai thiết bị kết thúc cùng lúc không ghi đè nhau
+            file_name = f"{device_id}_{stream_id}_{int(time.time() * 1000)}"
             
             # Xác định định dạng file và lưu
             if format_audio == "pcm16le":
@@ -183,81 +508,491 @@ class AgentAudioHandler:
             format_audio = payload.get("format", "pcm16le")
             sample_rate = payload.get("sampleRate", 16000)
             
-            # Giải mã âm thanh từ base64
-            audio_chunk = base64.b64decode(payload.get("data", ""))
+            # Frame nhị phân đã có sẵn PCM thô (memoryview), JSON cũ thì giải mã base64
+            data = payload.get("data", "")
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                audio_chunk = data
+            else:
+                audio_chunk = base64.b64decode(data)
             
             # Tạo key duy nhất cho stream này
             stream_key = f"{device_id}_{stream_id}"
             
+            if stream_key in self.closed_streams:
+                self.stream_stats["duplicate_chunks"] += 1
+                logger.debug(f"Ignored late chunk {chunk_index} of closed stream {stream_id} from {device_id}")
+                return
+            
             # Khởi tạo buffer cho stream nếu chưa tồn tại
             if stream_key not in self.audio_stream_buffers:
-                self.audio_stream_buffers[stream_key] = {
-                    "chunks": {},
+                # Stream mới trong lúc câu trả lời trước còn đang xử lý/phát: người dùng nói chen
+                self._barge_in(device_id)
+                # Stream cũ chưa nhận đủ của thiết bị cũng bị thay thế, cùng nhận dạng tăng dần của nó
+                for old_key in self.audio_stream_buffers.keys(device_id):
+                    self._discard_stream(self.audio_stream_buffers.pop(old_key))
+                    self._remember_closed(old_key)
+                    self.stream_stats["superseded"] += 1
+                    logger.info(f"Dropped unfinished audio stream {old_key} superseded by {stream_id}")
+                self.audio_stream_buffers.add(stream_key, device_id, {
+                    "device_id": device_id,
+                    "reassembly": StreamReassembler(total_chunks, max_bytes=AUDIO_STREAM_MAX_DEVICE_BYTES),
                     "total_chunks": total_chunks,
-                    "received_chunks": 0,
                     "format": format_audio,
                     "sample_rate": sample_rate,
-                    "timestamp": time.time()
-                }
+                    "timestamp": time.time(),
+                    "incremental": self._create_incremental(device_id, format_audio, sample_rate),
+                    "incremental_task": None,
+                    # Đã giữ một lượt admission của thiết bị cho nhận dạng tăng dần
+                    "admitted": False,
+                    "next_byte": 0,
+                    "last_seen": False,
+                    "last_chunk_at": 0.0,
+                    "nack_timer": None,
+                    "nack_attempts": 0
+                })
+            stream_buffer = self.audio_stream_buffers.get(stream_key)
+            reassembly = stream_buffer["reassembly"]
             
-            # Lưu chunk vào buffer
-            self.audio_stream_buffers[stream_key]["chunks"][chunk_index] = audio_chunk
-            self.audio_stream_buffers[stream_key]["received_chunks"] += 1
+            # Ghi chunk vào đúng vị trí trong buffer, bản gửi lại (QoS 1) bị bỏ qua
+            if not reassembly.add(chunk_index, audio_chunk):
+                self.stream_stats["duplicate_chunks"] += 1
+                logger.debug(f"Ignored duplicate chunk {chunk_index} in stream {stream_id} from {device_id}")
+                return
+            self.audio_stream_buffers.touch(stream_key)
+            stream_buffer["last_chunk_at"] = asyncio.get_running_loop().time()
+            # Vượt giới hạn bộ nhớ thì các stream cũ nhất bị bỏ trước (có thể là chính stream này)
+            if not self.audio_stream_buffers.set_size(stream_key, reassembly.allocated_bytes):
+                return
             
             logger.debug(f"Received audio chunk {chunk_index+1}/{total_chunks} from {device_id} (stream: {stream_id})")
             
-            # Kiểm tra xem đã nhận đủ chunks chưa
-            if is_last or self.audio_stream_buffers[stream_key]["received_chunks"] >= total_chunks:
-                logger.info(f"Completed audio stream {stream_id} from {device_id}, processing...")
-                
-                # Kết hợp các chunks theo thứ tự
-                all_chunks = []
-                for i in range(total_chunks):
-                    if i in self.audio_stream_buffers[stream_key]["chunks"]:
-                        all_chunks.append(self.audio_stream_buffers[stream_key]["chunks"][i])
-                    else:
-                        logger.warning(f"Missing chunk {i} in stream {stream_id} from {device_id}")
-                
-                # Kết hợp tất cả chunks
-                combined_audio = b''.join(all_chunks)
+            # Nhận dạng dần các cửa sổ audio trong lúc các chunk còn đang tới
+            if stream_buffer["incremental"] is not None:
+                self._feed_incremental(device_id, stream_id, stream_buffer)
+            
+            # Chỉ xử lý khi đã nhận đủ mọi chunk, audio thiếu đoạn không được đưa vào STT
+            if not reassembly.complete:
+                # Luôn hẹn giờ kiểm tra: nếu mất cả chunk cuối thì không chunk nào tới để báo gap
+                stream_buffer["last_seen"] |= is_last
+                self._schedule_nack(device_id, stream_id, stream_buffer)
+                return
+            
+            logger.info(f"Completed audio stream {stream_id} from {device_id}, processing...")
+            self.audio_stream_buffers.pop(stream_key)
+            self._cancel_nack(stream_buffer)
+            # Lượt admission của nhận dạng tăng dần chỉ dùng lúc nhận chunk, yêu cầu tự xin lượt mới
+            self._release_incremental_admission(stream_buffer)
+            self.stream_stats["completed"] += 1
+            if stream_buffer["nack_attempts"]:
+                self.stream_stats["nack_recovered"] += 1
+            self._remember_closed(stream_key)
+            
+            # Xử lý STT + agent + TTS trong task riêng của yêu cầu: không chặn queue message
+            # của thiết bị và bị hủy trọn vẹn nếu người dùng nói chen
+            self._start_request(device_id, self._process_audio_stream(
+                device_id,
+                stream_id,
+                reassembly.view(),
+                stream_buffer["format"],
+                stream_buffer["sample_rate"],
+                stream_buffer=stream_buffer
+            ), on_abort=lambda: self._stop_incremental(stream_buffer))
+        
+        except ReassemblyError as e:
+            stream_key = f"{device_id}_{payload.get('streamId')}"
+            dropped = self.audio_stream_buffers.pop(stream_key, None)
+            if dropped is not None:
+                self._discard_stream(dropped)
+            # Các chunk còn lại của stream hỏng không được mở lại stream (và gây nói chen)
+            self._remember_closed(stream_key)
+            self.stream_stats["invalid"] += 1
+            logger.warning(f"Dropped audio stream {payload.get('streamId')} from {device_id}: {e}")
                 
-                # Lưu file âm thanh
-                saved_file_path = self.save_audio_file(
+        except Exception as e:
+            logger.error(f"Error processing audio from {device_id}: {e}", exc_info=True)
+
+    def _discard_stream(self, stream_buffer):
+        """
+        Dọn một stream bị bỏ giữa chừng: timer NACK, nhận dạng tăng dần và lượt admission của nó
+        """
+        self._cancel_nack(stream_buffer)
+        self._stop_incremental(stream_buffer)
+        self._release_incremental_admission(stream_buffer)
+
+    def _stop_incremental(self, stream_buffer):
+        """
+        Hủy task nhận dạng tăng dần còn chạy, hoặc lấy lỗi của task đã xong mà không ai await
+        """
+        task = stream_buffer.get("incremental_task")
+        if task is None:
+            return
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Discarded failed incremental STT of {stream_buffer['device_id']}: {task.exception()}")
+
+    def _release_incremental_admission(self, stream_buffer):
+        if stream_buffer.get("admitted"):
+            stream_buffer["admitted"] = False
+            self.admission.release(stream_buffer["device_id"])
+
+    def _remember_closed(self, stream_key):
+        self.closed_streams[stream_key] = None
+        self.closed_streams.move_to_end(stream_key)
+        if len(self.closed_streams) > COMPLETED_STREAMS_MEMORY:
+            self.closed_streams.popitem(last=False)
+
+    def _missing_chunks(self, stream_buffer, limit=None):
+        """
+        Các chunk coi như đã bị mất: nằm trước chunk lớn nhất đã nhận, hoặc mọi chunk còn
+        thiếu tới totalChunks khi thiết bị đã gửi chunk cuối hay đã ngừng gửi quá khoảng chờ gap
+        (chunk cuối cũng bị mất)
+        """
+        reassembly = stream_buffer["reassembly"]
+        idle = asyncio.get_running_loop().time() - stream_buffer["last_chunk_at"]
+        if stream_buffer["last_seen"] or idle >= AUDIO_NACK_TIMEOUT_MS / 1000:
+            return reassembly.missing(limit=limit)
+        return reassembly.missing(limit=limit, end=reassembly.max_index)
+
+    def _schedule_nack(self, device_id, stream_id, stream_buffer):
+        """
+        Hẹn giờ gửi NACK sau khoảng chờ gap (chunk có thể chỉ tới trễ, không phải bị mất)
+        """
+        if not AUDIO_NACK_ENABLED or stream_buffer["nack_timer"] is not None:
+            return
+        # Mỗi lần gửi lại không thành công thì chờ lâu gấp đôi
+        delay = AUDIO_NACK_TIMEOUT_MS / 1000 * (2 ** stream_buffer["nack_attempts"])
+        stream_buffer["nack_timer"] = asyncio.get_running_loop().call_later(
+            delay, self._send_nack, device_id, stream_id, stream_buffer
+        )
+
+    def _cancel_nack(self, stream_buffer):
+        timer = stream_buffer.get("nack_timer")
+        if timer is not None:
+            timer.cancel()
+            stream_buffer["nack_timer"] = None
+
+    def _send_nack(self, device_id, stream_id, stream_buffer):
+        """
+        Yêu cầu thiết bị chỉ gửi lại các chunk còn thiếu (chạy trên event loop)
+        """
+        stream_buffer["nack_timer"] = None
+        stream_key = f"{device_id}_{stream_id}"
+        if self.audio_stream_buffers.get(stream_key) is not stream_buffer:
+            return
+        missing = self._missing_chunks(stream_buffer, limit=NACK_MAX_INDICES)
+        if not missing:
+            # Chưa có gap, các chunk vẫn đang tới: kiểm tra lại sau
+            self._schedule_nack(device_id, stream_id, stream_buffer)
+            return
+
+        if stream_buffer["nack_attempts"] >= AUDIO_NACK_MAX_RETRIES:
+            # Hết lượt gửi lại: bỏ stream thay vì nhận dạng audio bị thiếu đoạn
+            self.audio_stream_buffers.pop(stream_key)
+            self._discard_stream(stream_buffer)
+            self._remember_closed(stream_key)
+            self.stream_stats["nack_failed"] += 1
+            logger.warning(f"Dropped audio stream {stream_id} from {device_id}: "
+                           f"{len(missing)} chunk(s) still missing after {AUDIO_NACK_MAX_RETRIES} NACK(s)")
+            return
+
+        stream_buffer["nack_attempts"] += 1
+        self.mqtt_client.publish(f"server/{device_id}/audio/nack", {
+            "streamId": stream_id,
+            "missing": missing,
+            "totalChunks": stream_buffer["total_chunks"],
+            "attempt": stream_buffer["nack_attempts"],
+            "ts": int(time.time() * 1000)
+        }, qos=1)
+        self.stream_stats["nack_sent"] += 1
+        logger.info(f"Requested {len(missing)} missing chunk(s) of stream {stream_id} from {device_id} "
+                    f"(attempt {stream_buffer['nack_attempts']})")
+        # Hẹn lần kiểm tra kế tiếp, nếu chunk gửi lại tới đủ thì stream đã hoàn tất và bị gỡ khỏi buffer
+        self._schedule_nack(device_id, stream_id, stream_buffer)
+
+    def _spawn(self, coro):
+        """
+        Tạo task nền và giữ tham chiếu tới khi task kết thúc
+        """
+        task = asyncio.create_task(coro)
+        self.processing_tasks.add(task)
+        task.add_done_callback(self.processing_tasks.discard)
+        return task
+
+    def _record_vad(self, device_id, result, log_result=True):
+        """
+        Ghi nhận kết quả VAD (gọi trên event loop)
+        """
+        self.vad_stats["input_seconds"] += result.total_samples / result.sample_rate
+        self.vad_stats["removed_seconds"] += result.removed_seconds
+        if not result.has_speech:
+            self.vad_stats["silent_dropped"] += 1
+        elif log_result and result.removed_samples:
+            logger.debug(f"VAD removed {result.removed_seconds:.2f}s of silence from {device_id}")
+
+    def _preprocess_audio(self, audio_data, format_audio, sample_rate, trim_silence):
+        """
+        Giải mã, resample, VAD rồi mới chuẩn hóa mức (chạy ở worker thread)
+
+        VAD chạy trước khi nhân gain: gain tới +20 dB đẩy nhiễu nền của đoạn im lặng
+        lên trên ngưỡng năng lượng tuyệt đối của VAD.
+
+        Returns:
+            tuple: (samples float32 hoặc None nếu toàn im lặng, sample_rate,
+                    DSPResult hoặc None, VADResult hoặc None, thời gian xử lý)
+        """
+        started = time.perf_counter()
+        samples, sample_rate = decode_audio(audio_data, format_audio, sample_rate)
+        result = None
+        if self.dsp is not None:
+            samples, result = self.dsp.condition(samples, sample_rate)
+            sample_rate = result.output_rate
+
+        vad_result = None
+        if self.vad is not None:
+            trimmed, vad_result = self.vad.trim(samples, sample_rate)
+            # Cửa sổ nhận dạng tăng dần chỉ cần biết có tiếng nói hay không, giữ nguyên độ dài
+            samples = trimmed if trim_silence or trimmed is None else samples
+
+        if self.dsp is not None and samples is not None:
+            samples, result = self.dsp.normalize(samples, result)
+        return samples, sample_rate, result, vad_result, time.perf_counter() - started
+
+    async def _prepare_audio(self, device_id, audio_data, format_audio, sample_rate, trim_silence=True):
+        """
+        Đưa audio về dạng đầu vào thống nhất cho model mà không chặn event loop
+
+        Args:
+            trim_silence (bool): cắt im lặng đầu/cuối (False: VAD chỉ dùng để bỏ đoạn toàn im lặng)
+
+        Returns:
+            tuple: (samples float32 hoặc None nếu đoạn audio chỉ toàn im lặng, sample_rate)
+
+        Raises:
+            AudioDecodeError: khi không giải mã được định dạng nén trong bộ nhớ
+        """
+        try:
+            samples, sample_rate, result, vad_result, elapsed = await asyncio.to_thread(
+                self._preprocess_audio, audio_data, format_audio, sample_rate, trim_silence
+            )
+        except AudioDecodeError:
+            self.dsp_stats["decode_failed"] += 1
+            raise
+
+        if vad_result is not None:
+            self._record_vad(device_id, vad_result, log_result=trim_silence)
+        self.dsp_stats["processing_ms"] += elapsed * 1000
+        if result is not None:
+            self.dsp_stats["processed"] += 1
+            self.dsp_stats["resampled"] += result.resampled
+            if result.clipped_ratio >= self.dsp.clip_warn_ratio:
+                self.dsp_stats["clipped"] += 1
+                logger.warning(f"Audio from {device_id} is clipped ({result.clipped_ratio:.1%} of samples)")
+        return samples, sample_rate
+
+    def get_stats(self):
+        return {
+            "stt": self.stt_executor.get_stats(),
+            "vad": dict(self.vad_stats),
+            "dsp": dict(self.dsp_stats),
+            "streams": {**self.stream_stats, **self.audio_stream_buffers.get_stats()},
+            "admission": self.admission.get_stats(),
+            "tts": {**self.tts_stats, **self._ttfa_percentiles()},
+            "tts_cache": self.tts_cache.get_stats() if self.tts_cache is not None else {},
+        }
+
+    def _ttfa_percentiles(self):
+        if not self.ttfa_samples:
+            return {}
+        samples = sorted(self.ttfa_samples)
+        return {
+            "ttfa_p50_ms": round(samples[len(samples) // 2], 1),
+            "ttfa_p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+        }
+
+    def set_incremental_stt(self, device_id, enabled=True):
+        """
+        Bật/tắt chế độ nhận dạng tăng dần cho một thiết bị
+        """
+        self.incremental_stt_devices[device_id] = enabled
+
+    def _create_incremental(self, device_id, format_audio, sample_rate):
+        if format_audio != "pcm16le":
+            return None
+        if not self.incremental_stt_devices.get(device_id, STT_INCREMENTAL):
+            return None
+        return IncrementalTranscriber(
+            sample_rate=sample_rate,
+            window_s=STT_INCREMENTAL_WINDOW_S,
+            overlap_s=STT_INCREMENTAL_OVERLAP_S
+        )
+
+    def _feed_incremental(self, device_id, stream_id, stream_buffer):
+        """
+        Đưa phần chunk liên tục đã nhận vào bộ nhận dạng tăng dần và
+        khởi động nhận dạng nền nếu đã đủ một cửa sổ
+        """
+        incremental = stream_buffer["incremental"]
+        reassembly = stream_buffer["reassembly"]
+        # Chunk có thể dài lẻ byte: chỉ lấy tới sample PCM16 trọn vẹn cuối cùng
+        end = reassembly.nbytes // 2 * 2
+        if end > stream_buffer["next_byte"]:
+            incremental.append(pcm16le_to_float32(reassembly.view(stream_buffer["next_byte"], end)))
+            stream_buffer["next_byte"] = end
+
+        running = stream_buffer["incremental_task"]
+        if not incremental.has_window() or (running is not None and not running.done()):
+            return
+        if running is not None and not running.cancelled() and running.exception() is not None:
+            # Lỗi được báo lại khi _finalize_incremental await task này, không nhận dạng tiếp
+            return
+        if not stream_buffer["admitted"]:
+            # Nhận dạng nền cũng tính là một yêu cầu của thiết bị: quá tải thì để dành tới khi nhận đủ
+            shed_reason = self.admission.try_admit(device_id)
+            if shed_reason is not None:
+                logger.debug(f"Deferred incremental STT of stream {stream_id} from {device_id}: {shed_reason}")
+                stream_buffer["incremental"] = None
+                return
+            stream_buffer["admitted"] = True
+        stream_buffer["incremental_task"] = self._spawn(
+            self._advance_incremental(device_id, stream_id, incremental)
+        )
+
+    async def _advance_incremental(self, device_id, stream_id, incremental):
+        """
+        Nhận dạng lần lượt các cửa sổ đầy đủ và ghi nhận giả thuyết tạm thời
+        """
+        while (window := incremental.pop_window()) is not None:
+            window, sample_rate = await self._prepare_audio(
+                device_id, window, "pcm16le", incremental.sample_rate, trim_silence=False
+            )
+            if window is None:
+                continue
+            text = await self._transcribe(
+                window,
+                sample_rate=sample_rate
+            )
+            partial = incremental.commit(text)
+            logger.debug(f"Partial transcription from {device_id} (stream: {stream_id}): '{partial}'")
+
+    async def _finalize_incremental(self, device_id, stream_id, stream_buffer):
+        """
+        Kết thúc nhận dạng tăng dần: chỉ cần nhận dạng phần đuôi còn lại
+        """
+        incremental = stream_buffer["incremental"]
+        reassembly = stream_buffer["reassembly"]
+        if stream_buffer["next_byte"] < reassembly.nbytes:
+            incremental.append(pcm16le_to_float32(reassembly.view(stream_buffer["next_byte"])))
+            stream_buffer["next_byte"] = reassembly.nbytes
+
+        running = stream_buffer["incremental_task"]
+        if running is not None:
+            await running
+        await self._advance_incremental(device_id, stream_id, incremental)
+
+        tail = incremental.pop_tail()
+        if tail is not None:
+            tail, sample_rate = await self._prepare_audio(
+                device_id, tail, "pcm16le", incremental.sample_rate, trim_silence=False
+            )
+            if tail is not None:
+                text = await self._transcribe(
+                    tail,
+                    sample_rate=sample_rate
+                )
+                incremental.commit(text)
+        return incremental.text
+
+    async def _process_audio_stream(self, device_id, stream_id, combined_audio, format_audio, sample_rate,
+                                    stream_buffer=None):
+        """
+        Chuyển audio đã ghép thành văn bản và xử lý yêu cầu bằng multi-agent system
+        """
+        # Từ chối ngay khi thiết bị đã có đủ yêu cầu hoặc pipeline đã bão hòa, thay vì xếp hàng
+        shed_reason = self.admission.try_admit(device_id)
+        if shed_reason is not None:
+            logger.warning(f"Shed audio stream {stream_id} from {device_id}: {shed_reason}")
+            if stream_buffer is not None:
+                self._stop_incremental(stream_buffer)
+            await self._send_busy(device_id)
+            return
+        
+        try:
+            # Lưu file âm thanh (tùy chọn) ở worker thread, không chờ kết quả
+            if AUDIO_SAVE_RECORDINGS:
+                self._spawn(asyncio.to_thread(
+                    self.save_audio_file,
                     combined_audio, 
                     device_id, 
                     stream_id, 
-                    self.audio_stream_buffers[stream_key]["format"],
-                    self.audio_stream_buffers[stream_key]["sample_rate"]
-                )
+                    format_audio,
+                    sample_rate
+                ))
+            
+            if stream_buffer is not None and stream_buffer.get("incremental") is not None:
+                # Phần lớn audio đã được nhận dạng trong lúc nhận chunk
+                transcription = await self._finalize_incremental(device_id, stream_id, stream_buffer)
+            else:
+                # Giải mã trong bộ nhớ và chuẩn hóa về 16 kHz, không ghi/đọc file hay gọi ffmpeg
+                try:
+                    audio_input, sample_rate = await self._prepare_audio(
+                        device_id, combined_audio, format_audio, sample_rate
+                    )
+                except AudioDecodeError as e:
+                    # Định dạng libsndfile không đọc được: để pipeline tự giải mã từ bytes
+                    logger.warning(f"{e}, passing raw {format_audio} audio from {device_id} to STT")
+                    audio_input = bytes(combined_audio)
+                else:
+                    if audio_input is None:
+                        logger.info(f"Audio stream {stream_id} from {device_id} contains only silence, skipping")
+                        return
                 
-                # Xử lý âm thanh thành text
-                transcription = self.transcriber.get_text_from_audio(combined_audio, saved_file_path=saved_file_path)
+                # Xử lý âm thanh thành text trên worker pool
+                transcription = await self._transcribe(
+                    audio_input,
+                    format_audio=format_audio,
+                    sample_rate=sample_rate
+                )
+            
+            if transcription:
+                logger.info(f"Transcription from {device_id}: '{transcription}'")
                 
-                if transcription:
-                    logger.info(f"Transcription from {device_id}: '{transcription}'")
-                    
-                    # Nếu muốn stream theo câu: dùng stream_final_answer
-                    if self.multi_agent_system:
-                        # Khởi động worker nếu chưa có
-                        if device_id not in self.text_stream_tasks:
-                            task = asyncio.create_task(self._sentence_stream_worker(device_id))
-                            self.text_stream_tasks[device_id] = task
-
-                        queue = self._get_text_queue(device_id)
-                        async for chunk in self.multi_agent_system.process_audio_request(transcription, device_id):
-                            await queue.put(chunk)
-
-                        # Kết thúc stream cho device
+                # Nếu muốn stream theo câu: dùng stream_final_answer
+                if self.multi_agent_system:
+                    # Queue và worker TTS riêng của yêu cầu này, hủy cùng với yêu cầu
+                    queue = asyncio.Queue()
+                    speaker = asyncio.create_task(self._sentence_stream_worker(device_id, queue))
+                    try:
+                        async with self.admission.stage("llm").slot():
+                            async for chunk in self.multi_agent_system.process_audio_request(transcription, device_id):
+                                if speaker.done():
+                                    # Worker TTS đã dừng vì lỗi (ví dụ TTS quá tải), không sinh tiếp
+                                    break
+                                await queue.put(chunk)
+
+                        # Kết thúc stream của yêu cầu, đợi phát xong các câu còn lại
                         await queue.put(None)
-                    else:
-                        # Fallback nếu không khởi tạo được agent
-                        self.send_tts_response(device_id, f"Tôi đã nhận được: {transcription}, nhưng hệ thống xử lý chưa sẵn sàng.")
-                
-                # Xóa buffer sau khi xử lý xong
-                del self.audio_stream_buffers[stream_key]
+                        await speaker
+                    finally:
+                        if not speaker.done():
+                            speaker.cancel()
+                else:
+                    # Fallback nếu không khởi tạo được agent
+                    self.send_tts_response(device_id, f"Tôi đã nhận được: {transcription}, nhưng hệ thống xử lý chưa sẵn sàng.")
                 
+        except (AdmissionRejected, STTOverloadedError) as e:
+            logger.warning(f"Shed audio stream {stream_id} from {device_id}: {e}")
+            await self._send_busy(device_id)
+        except STTNotReadyError as e:
+            logger.warning(f"Dropped audio stream {stream_id} from {device_id}: {e}")
+        except asyncio.TimeoutError:
+            logger.error(f"STT timed out for audio stream {stream_id} from {device_id}")
         except Exception as e:
-            logger.error(f"Error processing audio from {device_id}: {e}", exc_info=True)
+            logger.error(f"Error processing audio stream {stream_id} from {device_id}: {e}", exc_info=True)
+        finally:
+            if stream_buffer is not None:
+                self._stop_incremental(stream_buffer)
+            self.admission.release(device_id)
 
     def send_tts_response(self, device_id, text):
         """
@@ -271,9 +1006,9 @@ class AgentAudioHandler:
         self.mqtt_client.publish(f"server/{device_id}/audio", payload, qos=1)
         logger.info(f"Sent TTS to {device_id}: '{text}'")
 
-    def send_audio_to_device(self, device_id, audio_data, format_audio="pcm16le", sample_rate=16000):
+    async def send_audio_to_device(self, device_id, audio_data, format_audio="pcm16le", sample_rate=16000):
         """
-        Gửi dữ liệu âm thanh từ server đến thiết bị
+        Gửi dữ liệu âm thanh từ server đến thiết bị thông qua egress scheduler
         
         Args:
             device_id: ID của thiết bị nhận âm thanh
@@ -281,44 +1016,4 @@ class AgentAudioHandler:
             format_audio: Định dạng âm thanh (mặc định: pcm16le)
             sample_rate: Tần số lấy mẫu (mặc định: 16000)
         """  
-        try:
-            stream_id = f"server_{int(time.time() * 1000)}"
-            chunk_size = 1024 * 8  # 8KB chunks
-            total_chunks = (len(audio_data) + chunk_size - 1) // chunk_size
-            
-            logger.info(f"Sending audio to device {device_id}, total chunks: {total_chunks}, total size: {len(audio_data)} bytes")
-            
-            # Chia và gửi từng chunk
-            for i in range(total_chunks):
-                start = i * chunk_size
-                end = min(start + chunk_size, len(audio_data))
-                chunk_data = audio_data[start:end]
-                
-                # Tạo payload
-                payload = {
-                    "serverStreamId": stream_id,
-                    "chunkIndex": i,
-                    "totalChunks": total_chunks,
-                    "isLast": (i == total_chunks - 1),
-                    "timestamp": int(time.time() * 1000),
-                    "format": format_audio,
-                    "sampleRate": sample_rate,
-                    "data": base64.b64encode(chunk_data).decode()
-                }
-                
-                # Gửi đến topic dành cho audio từ server đến thiết bị với QoS=1
-                self.mqtt_client.publish(f"server/{device_id}/audio", payload, qos=1)
-                
-                # Thêm delay nhỏ giữa các gói tin
-                delay = min(0.05, 1.0 / total_chunks)
-                time.sleep(delay)
-            
-            logger.info(f"Successfully sent {total_chunks} audio chunks to device {device_id}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error sending audio to device {device_id}: {e}", exc_info=True)
-            return False
-
-
-
+        return await self.egress.send(device_id, audio_data, format_audio=format_audio, sample_rate=sample_rate)
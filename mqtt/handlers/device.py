@@ -31,7 +31,8 @@ class AgentDeviceHandler:
         battery = payload.get("battery")
         gps = payload.get("gps")
 
-        logger.info(f"Device {device_id} info: Battery={battery*100:.1f}%")
+        if battery is not None:
+            logger.info(f"Device {device_id} info: Battery={battery*100:.1f}%")
 
         # Lưu trữ thông tin thiết bị
         if device_id not in self.connected_devices:
@@ -6,9 +6,14 @@ import sys
 import threading
 import time
 
-from config import LLM_API_KEY, LLM_BASE_URL, LLM_MODEL, DEVICE_ID
+from config import (
+    LLM_API_KEY, LLM_BASE_URL, LLM_MODEL, DEVICE_ID, DISPATCH_QUEUE_SIZE, STATS_INTERVAL_S,
+    MQTT_WORKER_COUNT, MQTT_WORKER_INDEX, MQTT_STREAM_ROUTING
+)
 from log import setup_logger
+from mcp_custom.service.tts import close_tts_client
 from mqtt.client import MQTTClient
+from mqtt.dispatcher import MessageDispatcher
 from mqtt.handlers.audio import AgentAudioHandler
 from mqtt.handlers.device import AgentDeviceHandler
 from mqtt.handlers.obstacle import ObstacleHandler
@@ -32,19 +37,37 @@ class MQTTAgentServer:
         self.agent_audio_handler = None
         self.agent_device_handler = None
         
+        # Event loop cho asyncio
+        self.loop = asyncio.new_event_loop()
+        
         # Thiết lập các handler cho các topic sau khi đã khởi tạo handlers
         self.message_handlers = {
-            "mic": self.handle_stt_audio_async,
-            "stt/audio": self.handle_stt_audio_async,
+            "mic": self.handle_stt_audio,
+            "stt/audio": self.handle_stt_audio,
+            "stt/audio_bin": self.handle_stt_audio,
+            "info": self.handle_device_info,
             # "command": self.handle_command_async,
-            # "info": self.device_handler.handle_device_info,
             # "status": self.device_handler.handle_device_status,
             # "ping": self.device_handler.handle_ping,
             # "obstacle": self.obstacle_handler.handle_obstacle,
         }
         
-        # Khởi tạo MQTT client với message_handlers
-        self.client = MQTTClient(message_handlers=self.message_handlers)
+        # Các topic stream phải được xử lý trọn vẹn bởi một worker (worker mode); info cũng vậy
+        # vì codec đã thương lượng nằm ở egress của worker sở hữu thiết bị
+        stream_handler_keys = ("mic", "stt/audio", "stt/audio_bin", "info") if MQTT_STREAM_ROUTING == "shard" else ()
+        
+        # Biên dịch bảng định tuyến một lần, message được xử lý trên event loop
+        self.dispatcher = MessageDispatcher(
+            self.message_handlers,
+            self.loop,
+            max_queue_size=DISPATCH_QUEUE_SIZE,
+            shard_index=MQTT_WORKER_INDEX,
+            shard_count=MQTT_WORKER_COUNT,
+            sharded_keys=stream_handler_keys
+        )
+        
+        # Khởi tạo MQTT client với dispatcher
+        self.client = MQTTClient(dispatcher=self.dispatcher)
         
         # Khởi tạo agent_audio_handler sau khi có client
         self.agent_audio_handler = AgentAudioHandler(self.client, self.multi_agent_system)
@@ -56,21 +79,44 @@ class MQTTAgentServer:
         container.register("device_handler", self.agent_device_handler)
         container.register("device_id", DEVICE_ID)
         
-        # Event loop cho asyncio
-        self.loop = asyncio.new_event_loop()
+        self.stats_task = None
+        self.prerender_task = None
         
-    def handle_stt_audio_async(self, device_id, payload):
+    async def handle_stt_audio(self, device_id, payload):
         """
-        Wrapper để gọi hàm async handle_stt_audio từ non-async context
+        Chuyển audio chunk tới agent_audio_handler (chạy trên event loop)
         """
         if self.agent_audio_handler is not None:
-            asyncio.run_coroutine_threadsafe(
-                self.agent_audio_handler.handle_stt_audio(device_id, payload),
-                self.loop
-            )
+            await self.agent_audio_handler.handle_stt_audio(device_id, payload)
         else:
             logger.warning("Agent audio handler chưa được khởi tạo")
     
+    async def handle_device_info(self, device_id, payload):
+        """
+        Cập nhật thông tin thiết bị và thương lượng codec audio gửi về thiết bị
+        """
+        self.agent_device_handler.handle_device_info(self.client, device_id, payload)
+        if "codecs" in payload and self.agent_audio_handler is not None:
+            self.agent_audio_handler.set_device_codecs(device_id, payload["codecs"])
+    
+    def get_stats(self):
+        """
+        Tổng hợp các bộ đếm của server
+        """
+        return {
+            "dispatcher": self.dispatcher.get_stats(),
+            "egress": self.agent_audio_handler.egress.get_stats() if self.agent_audio_handler else {},
+            "audio": self.agent_audio_handler.get_stats() if self.agent_audio_handler else {},
+        }
+    
+    async def _stats_reporter(self):
+        """
+        Ghi log thống kê định kỳ
+        """
+        while True:
+            await asyncio.sleep(STATS_INTERVAL_S)
+            logger.info(f"[SERVER] Stats: {self.get_stats()}")
+    
     async def initialize_async(self):
         """
         Khởi tạo các thành phần async
@@ -78,19 +124,33 @@ class MQTTAgentServer:
         # Khởi tạo hệ thống multi-agent
         await self.multi_agent_system.initialize_all()
 
-        # Khởi động thread dọn dẹp audio buffer
-        if self.agent_audio_handler is not None:
-            self.agent_audio_handler.start_cleanup_thread()
-        else:
+        if self.agent_audio_handler is None:
             logger.warning("Agent audio handler chưa được khởi tạo")
+        else:
+            # Dựng sẵn câu trả lời "bận" và các câu hay dùng ở nền, không chặn khởi động
+            self.prerender_task = asyncio.create_task(self.agent_audio_handler.prerender_phrases())
+        
+        if STATS_INTERVAL_S > 0:
+            self.stats_task = asyncio.create_task(self._stats_reporter())
     
     async def cleanup_async(self):
         """
         Dọn dẹp các tài nguyên async
         """
-        # Dừng thread dọn dẹp audio buffer
+        if self.stats_task is not None:
+            self.stats_task.cancel()
+        
+        # Dừng các worker của dispatcher
+        await self.dispatcher.stop()
+        
+        # Bỏ các stream audio đang nhận dở
         if self.agent_audio_handler is not None:
-            self.agent_audio_handler.stop_cleanup_thread()
+            self.agent_audio_handler.close()
+            await self.agent_audio_handler.egress.stop()
+            self.agent_audio_handler.stt_executor.shutdown()
+        
+        # Đóng các kết nối keep-alive tới server TTS
+        await close_tts_client()
         
         # Dọn dẹp hệ thống multi-agent
         await self.multi_agent_system.cleanup_all()
@@ -124,6 +184,8 @@ class MQTTAgentServer:
         # self.device_handler.start_status_check_thread()
         
         logger.info(f"[SERVER] Server đã khởi động với ID: {self.client.server_id}")
+        if MQTT_WORKER_COUNT > 1:
+            logger.info(f"[SERVER] Worker mode: worker {MQTT_WORKER_INDEX}/{MQTT_WORKER_COUNT}, stream routing: {MQTT_STREAM_ROUTING}")
         logger.info("[SERVER] Đang lắng nghe các thiết bị...")
         logger.info("[SERVER] Nhấn Ctrl+C để thoát")
         
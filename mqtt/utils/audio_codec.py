@@ -0,0 +1,261 @@
+"""
+Codec nén audio gửi về thiết bị (egress)
+
+Mỗi stream audio được mã hóa thành một luồng byte liên tục, chunk của egress chỉ cắt
+luồng này theo kích thước nên thiết bị phải giải mã các chunk theo đúng thứ tự:
+
+- "pcm16le":   PCM 16-bit little-endian mono, không nén
+- "ima-adpcm": IMA-ADPCM 4 bit/sample (nén 4:1), mỗi byte chứa 2 sample, nibble thấp trước.
+               Bộ dự đoán bắt đầu từ predictor = 0, step index = 0 ở đầu mỗi stream.
+- "opus":      các packet Opus 20 ms, mỗi packet có tiền tố độ dài uint16 little-endian.
+               Cần thư viện tùy chọn opuslib và sample rate 8/12/16/24/48 kHz.
+"""
+import importlib.util
+import io
+import struct
+
+import numpy as np
+import soundfile as sf
+
+PCM_CODEC = "pcm16le"
+
+IMA_STEP_TABLE = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+    12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767,
+)
+IMA_INDEX_TABLE = (-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8)
+
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+class PcmEncoder:
+    name = PCM_CODEC
+
+    def encode(self, pcm):
+        return bytes(pcm)
+
+    def flush(self):
+        return b""
+
+
+class ImaAdpcmEncoder:
+    name = "ima-adpcm"
+
+    def __init__(self):
+        """
+        Bộ mã hóa IMA-ADPCM giữ trạng thái giữa các lần encode (dùng cho stream live)
+        """
+        self.predictor = 0
+        self.index = 0
+        # Byte/sample lẻ chưa đủ một cặp sample, ghép vào lần encode sau
+        self._pending = b""
+
+    def encode(self, pcm):
+        data = self._pending + bytes(pcm)
+        usable = len(data) // 4 * 4
+        self._pending = data[usable:]
+        if not usable:
+            return b""
+        samples = np.frombuffer(data, dtype="<i2", count=usable // 2).tolist()
+        return self._encode_samples(samples)
+
+    def flush(self):
+        """
+        Mã hóa sample lẻ còn lại (đệm bằng chính nó để đủ một byte)
+        """
+        pending, self._pending = self._pending, b""
+        if len(pending) < 2:
+            return b""
+        sample = struct.unpack_from("<h", pending)[0]
+        return self._encode_samples([sample, sample])
+
+    def _encode_samples(self, samples):
+        step_table = IMA_STEP_TABLE
+        index_table = IMA_INDEX_TABLE
+        predictor = self.predictor
+        index = self.index
+        out = bytearray(len(samples) // 2)
+        for i, sample in enumerate(samples):
+            step = step_table[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code = 8
+                diff = -diff
+            delta = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                code |= 2
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                code |= 1
+                delta += step
+
+            if code & 8:
+                predictor -= delta
+                if predictor < -32768:
+                    predictor = -32768
+            else:
+                predictor += delta
+                if predictor > 32767:
+                    predictor = 32767
+            index += index_table[code]
+            if index < 0:
+                index = 0
+            elif index > 88:
+                index = 88
+
+            if i & 1:
+                out[i >> 1] |= code << 4
+            else:
+                out[i >> 1] = code
+        self.predictor = predictor
+        self.index = index
+        return bytes(out)
+
+
+def ima_adpcm_decode(data, predictor=0, index=0):
+    """
+    Giải mã luồng IMA-ADPCM về PCM16 LE (để kiểm tra/benchmark, thiết bị giải mã phía client)
+    """
+    step_table = IMA_STEP_TABLE
+    index_table = IMA_INDEX_TABLE
+    out = []
+    for byte in bytes(data):
+        for code in (byte & 0x0F, byte >> 4):
+            step = step_table[index]
+            delta = step >> 3
+            if code & 4:
+                delta += step
+            if code & 2:
+                delta += step >> 1
+            if code & 1:
+                delta += step >> 2
+            predictor = max(-32768, predictor - delta) if code & 8 else min(32767, predictor + delta)
+            index = min(88, max(0, index + index_table[code]))
+            out.append(predictor)
+    return np.asarray(out, dtype="<i2").tobytes()
+
+
+class OpusEncoder:
+    name = "opus"
+
+    def __init__(self, sample_rate, bitrate=24000, frame_ms=20):
+        """
+        Bộ mã hóa Opus (thư viện tùy chọn opuslib), mỗi frame_ms audio thành một packet
+
+        Raises:
+            ValueError: sample rate không được Opus hỗ trợ
+            ImportError: chưa cài opuslib
+        """
+        if sample_rate not in OPUS_SAMPLE_RATES:
+            raise ValueError(f"Opus does not support {sample_rate} Hz")
+        import opuslib
+
+        self._encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_VOIP)
+        self._encoder.bitrate = bitrate
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.frame_bytes = self.frame_samples * 2
+        self._pending = b""
+
+    def encode(self, pcm):
+        data = self._pending + bytes(pcm)
+        usable = len(data) // self.frame_bytes * self.frame_bytes
+        self._pending = data[usable:]
+        return self._encode_frames(data[:usable])
+
+    def flush(self):
+        """
+        Mã hóa phần cuối chưa đủ một frame (đệm im lặng)
+        """
+        pending, self._pending = self._pending, b""
+        if not pending:
+            return b""
+        return self._encode_frames(pending + bytes(self.frame_bytes - len(pending)))
+
+    def _encode_frames(self, data):
+        out = bytearray()
+        for start in range(0, len(data), self.frame_bytes):
+            packet = self._encoder.encode(data[start:start + self.frame_bytes], self.frame_samples)
+            out += struct.pack("<H", len(packet))
+            out += packet
+        return bytes(out)
+
+
+def opus_available():
+    return importlib.util.find_spec("opuslib") is not None
+
+
+def available_codecs():
+    codecs = ["ima-adpcm", PCM_CODEC]
+    if opus_available():
+        codecs.insert(0, "opus")
+    return codecs
+
+
+def negotiate_codecs(device_codecs, preferred):
+    """
+    Các codec cả server và thiết bị cùng hỗ trợ, theo thứ tự ưu tiên của server
+
+    Args:
+        device_codecs (list): codec thiết bị giải mã được
+        preferred (list): thứ tự ưu tiên của server (EGRESS_CODECS)
+    """
+    supported = set(available_codecs())
+    device_codecs = {str(codec).lower() for codec in device_codecs or ()}
+    return [codec for codec in preferred if codec in device_codecs and codec in supported]
+
+
+def create_encoder(codecs, sample_rate, opus_bitrate=24000):
+    """
+    Tạo encoder cho codec đầu tiên dùng được với sample rate của stream
+    """
+    for codec in codecs:
+        if codec == "opus":
+            try:
+                return OpusEncoder(sample_rate, bitrate=opus_bitrate)
+            except (ImportError, ValueError):
+                continue
+        if codec == "ima-adpcm":
+            return ImaAdpcmEncoder()
+        if codec == PCM_CODEC:
+            return PcmEncoder()
+    return PcmEncoder()
+
+
+def decode_to_pcm16(audio_data, format_audio):
+    """
+    Giải mã audio nén (wav, mp3, ogg, flac) về PCM16 LE mono
+
+    Returns:
+        tuple: (pcm_bytes, sample_rate)
+    """
+    samples, sample_rate = sf.read(io.BytesIO(bytes(audio_data)), dtype="int16", always_2d=True)
+    if samples.shape[1] > 1:
+        samples = samples.mean(axis=1).astype(np.int16)
+    else:
+        samples = samples[:, 0]
+    return samples.astype("<i2").tobytes(), int(sample_rate)
+
+
+def transcode(audio_data, format_audio, sample_rate, codecs, opus_bitrate=24000):
+    """
+    Chuyển cả một đoạn audio sang codec thiết bị đã chọn (chạy ở worker thread)
+
+    Returns:
+        tuple: (data, format_audio, sample_rate)
+    """
+    if format_audio != PCM_CODEC:
+        audio_data, sample_rate = decode_to_pcm16(audio_data, format_audio)
+    encoder = create_encoder(codecs, sample_rate, opus_bitrate=opus_bitrate)
+    return encoder.encode(audio_data) + encoder.flush(), encoder.name, sample_rate
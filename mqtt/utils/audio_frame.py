@@ -0,0 +1,88 @@
+"""
+Binary audio frame protocol cho topic device/{deviceId}/stt/audio_bin
+
+Mỗi message gồm một header cố định (little-endian) và ngay sau đó là dữ liệu
+PCM thô, không bọc JSON/base64:
+
+    offset  size  field
+    0       2     magic b"PA"
+    2       1     version (hiện tại = 1)
+    3       1     flags (bit 0 = isLast)
+    4       1     format (xem AUDIO_FORMAT_CODES)
+    5       4     streamId (uint32)
+    9       2     chunkIndex (uint16)
+    11      2     totalChunks (uint16)
+    13      4     sampleRate (uint32)
+    17      ...   audio data
+"""
+import struct
+
+FRAME_MAGIC = b"PA"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<2sBBBIHHI")
+
+FLAG_IS_LAST = 0x01
+
+AUDIO_FORMAT_CODES = {
+    0: "pcm16le",
+    1: "wav",
+    2: "mp3",
+    3: "ogg",
+}
+AUDIO_FORMAT_IDS = {name: code for code, name in AUDIO_FORMAT_CODES.items()}
+
+
+class AudioFrameError(ValueError):
+    """Frame nhị phân không hợp lệ"""
+
+
+def decode_audio_frame(payload):
+    """
+    Giải mã một frame nhị phân thành dict cùng schema với payload JSON cũ.
+
+    Trường "data" là memoryview trỏ thẳng vào payload gốc (không copy).
+
+    Args:
+        payload: bytes/bytearray/memoryview nhận từ MQTT
+
+    Returns:
+        dict: streamId, chunkIndex, totalChunks, isLast, format, sampleRate, data
+    """
+    view = memoryview(payload)
+    if len(view) < FRAME_HEADER.size:
+        raise AudioFrameError(f"Frame quá ngắn: {len(view)} bytes")
+
+    magic, version, flags, format_code, stream_id, chunk_index, total_chunks, sample_rate = \
+        FRAME_HEADER.unpack_from(view)
+    if magic != FRAME_MAGIC:
+        raise AudioFrameError(f"Sai magic: {magic!r}")
+    if version != FRAME_VERSION:
+        raise AudioFrameError(f"Không hỗ trợ version {version}")
+
+    return {
+        "streamId": str(stream_id),
+        "chunkIndex": chunk_index,
+        "totalChunks": total_chunks,
+        "isLast": bool(flags & FLAG_IS_LAST),
+        "format": AUDIO_FORMAT_CODES.get(format_code, "pcm16le"),
+        "sampleRate": sample_rate,
+        "data": view[FRAME_HEADER.size:],
+    }
+
+
+def encode_audio_frame(stream_id, chunk_index, total_chunks, is_last, data,
+                       format_audio="pcm16le", sample_rate=16000):
+    """
+    Đóng gói một chunk âm thanh thành frame nhị phân (dùng cho firmware/test)
+    """
+    header = FRAME_HEADER.pack(
+        FRAME_MAGIC,
+        FRAME_VERSION,
+        FLAG_IS_LAST if is_last else 0,
+        AUDIO_FORMAT_IDS.get(format_audio, 0),
+        int(stream_id) & 0xFFFFFFFF,
+        chunk_index,
+        total_chunks,
+        sample_rate,
+    )
+    return header + bytes(data)
@@ -0,0 +1,137 @@
+"""
+Ghép các chunk audio của một stream theo thứ tự vào một buffer duy nhất
+"""
+
+
+class ReassemblyError(ValueError):
+    """Chunk không khớp với bố cục của stream (sai chỉ số hoặc vượt giới hạn kích thước)"""
+
+
+class StreamReassembler:
+    def __init__(self, total_chunks, max_bytes=0):
+        """
+        Buffer ghép stream: mỗi chunk được chép vào buffer đúng một lần
+
+        Các chunk có thể có kích thước khác nhau, nên vị trí của chunk i chỉ biết được khi
+        đã có mọi chunk trước nó. Phần đầu liên tục (chunk 0..k) được nối thẳng vào một
+        bytearray tăng dần, _offsets[i] là vị trí byte của chunk i trong đó. Chunk tới sớm
+        được giữ riêng cho tới khi phần liên tục chạm tới nó. Bitmap đánh dấu chunk đã nhận
+        để bỏ qua bản gửi lại của QoS 1.
+
+        Args:
+            total_chunks (int): tổng số chunk của stream
+            max_bytes (int): tổng kích thước stream tối đa (0 = không giới hạn)
+        """
+        if total_chunks < 1:
+            raise ReassemblyError(f"Invalid totalChunks: {total_chunks}")
+        self.total_chunks = total_chunks
+        self.max_bytes = max_bytes
+        self.received = 0
+        self.duplicates = 0
+        # Chỉ số lớn nhất đã nhận, các chunk nhỏ hơn mà chưa có là bị mất hoặc tới trễ
+        self.max_index = -1
+
+        self._bitmap = bytearray((total_chunks + 7) // 8)
+        self._buffer = bytearray()
+        # _offsets[i] = vị trí byte của chunk i, có cho mọi i <= số chunk liên tục
+        self._offsets = [0]
+        # Chunk tới trước khi phần liên tục chạm tới: chỉ số -> bytes
+        self._pending = {}
+        self._pending_bytes = 0
+
+    @property
+    def complete(self):
+        return self.received == self.total_chunks
+
+    @property
+    def contiguous_chunks(self):
+        """
+        Số chunk liên tục đã ghép tính từ chunk 0
+        """
+        return len(self._offsets) - 1
+
+    @property
+    def nbytes(self):
+        """
+        Số byte audio đã ghép liên tục (bằng kích thước stream khi đã đủ chunk)
+        """
+        return len(self._buffer)
+
+    @property
+    def allocated_bytes(self):
+        return len(self._buffer) + self._pending_bytes
+
+    def offset(self, index):
+        """
+        Vị trí byte của chunk index (chỉ biết khi index <= contiguous_chunks)
+        """
+        return self._offsets[index]
+
+    def has_chunk(self, index):
+        return bool(self._bitmap[index >> 3] & (1 << (index & 7)))
+
+    def missing(self, limit=None, end=None):
+        """
+        Danh sách chỉ số chunk chưa nhận trong [0, end) (tối đa limit phần tử)
+        """
+        result = []
+        end = self.total_chunks if end is None else min(end, self.total_chunks)
+        for index in range(self.contiguous_chunks, end):
+            if not self.has_chunk(index):
+                result.append(index)
+                if limit is not None and len(result) >= limit:
+                    break
+        return result
+
+    def add(self, index, data):
+        """
+        Ghi một chunk vào buffer
+
+        Returns:
+            bool: False nếu chunk đã nhận trước đó (bản gửi lại bị bỏ qua)
+
+        Raises:
+            ReassemblyError: chỉ số nằm ngoài stream hoặc stream vượt max_bytes
+        """
+        if not 0 <= index < self.total_chunks:
+            raise ReassemblyError(f"Chunk index {index} out of range (totalChunks={self.total_chunks})")
+        if self.has_chunk(index):
+            self.duplicates += 1
+            return False
+
+        size = len(data)
+        if self.max_bytes and self.allocated_bytes + size > self.max_bytes:
+            raise ReassemblyError(f"Stream exceeds {self.max_bytes} bytes at chunk {index}")
+
+        self._mark(index)
+        if index != self.contiguous_chunks:
+            self._pending[index] = bytes(data)
+            self._pending_bytes += size
+            return True
+
+        self._append(data)
+        # Nối tiếp các chunk tới sớm vừa trở thành liên tục
+        while self._pending and self.contiguous_chunks in self._pending:
+            pending = self._pending.pop(self.contiguous_chunks)
+            self._pending_bytes -= len(pending)
+            self._append(pending)
+        return True
+
+    def view(self, start=0, end=None):
+        """
+        memoryview (không copy) trên các byte [start, end) của phần đã ghép liên tục
+
+        Không giữ view qua lần add kế tiếp: bytearray không thể nới ra khi còn view trỏ vào.
+        """
+        if end is None:
+            end = len(self._buffer)
+        return memoryview(self._buffer)[start:end]
+
+    def _append(self, data):
+        self._buffer += data
+        self._offsets.append(len(self._buffer))
+
+    def _mark(self, index):
+        self._bitmap[index >> 3] |= 1 << (index & 7)
+        self.received += 1
+        self.max_index = max(self.max_index, index)
@@ -0,0 +1,202 @@
+"""
+Tách câu tăng dần cho text LLM stream tới TTS (quy tắc tiếng Việt)
+"""
+
+# Dấu kết thúc câu và các ký tự đóng (nháy, ngoặc) đi ngay sau nó
+TERMINATORS = ".!?…\n"
+CLOSERS = "\"'”’)]}»"
+# Vị trí cắt mềm khi câu quá dài mà chưa gặp dấu kết thúc
+SOFT_BREAKS = ",;:–—"
+
+# Viết tắt thường gặp (chữ thường, bỏ dấu chấm cuối): dấu chấm sau chúng không kết thúc câu
+VI_ABBREVIATIONS = frozenset({
+    "tp", "tt", "q", "p", "h", "x", "đ", "tx", "ubnd", "hđnd",
+    "gs", "pgs", "ts", "ths", "bs", "ks", "cn", "ls", "nxb",
+    "tr", "vd", "vs", "stt", "sđt", "đt",
+    "mr", "mrs", "ms", "dr", "st", "no", "etc",
+})
+
+
+class SentenceSegmenter:
+    def __init__(self, min_chars=16, max_chars=200, abbreviations=VI_ABBREVIATIONS):
+        """
+        Gom text stream thành câu cho TTS, chỉ quét phần text mới nhận
+
+        Vị trí quét được giữ giữa các lần feed nên tổng chi phí tuyến tính theo độ dài text.
+        Dấu chấm trong số ("10.5", "1.000.000"), trong từ ("TP.HCM", "v.v"), sau viết tắt,
+        chữ viết tắt tên ("Nguyễn V. An"), số thứ tự đầu dòng ("1. ") hoặc trước chữ thường
+        không kết thúc câu. Câu ngắn hơn min_chars được gộp với câu sau để bớt số lần gọi TTS;
+        câu dài hơn max_chars bị cắt ở dấu phẩy/khoảng trắng gần nhất.
+
+        Args:
+            min_chars (int): độ dài tối thiểu của một câu gửi TTS
+            max_chars (int): độ dài tối đa, vượt quá thì cắt cưỡng bức
+            abbreviations: tập viết tắt (chữ thường, không có dấu chấm cuối)
+        """
+        self.min_chars = min_chars
+        self.max_chars = max(max_chars, min_chars + 1)
+        self.abbreviations = abbreviations
+        # Buffer luôn bắt đầu ở đầu câu đang gom, _pos là ký tự kế tiếp cần quét
+        self._buffer = ""
+        self._pos = 0
+        self.stats = {
+            "sentences": 0,
+            "merged": 0,
+            "forced": 0,
+        }
+
+    @property
+    def pending(self):
+        """
+        Còn text chưa thành câu
+        """
+        return bool(self._buffer.strip())
+
+    def feed(self, text):
+        """
+        Nhận thêm text
+
+        Returns:
+            list: các câu đã hoàn chỉnh
+        """
+        self._buffer += text
+        return self._scan(final=False)
+
+    def flush(self, partial=False):
+        """
+        Lấy phần text còn lại
+
+        Args:
+            partial (bool): True khi LLM tạm ngừng (stream chưa kết thúc): chỉ cắt tới khoảng
+                trắng cuối cùng để không cắt giữa một từ
+
+        Returns:
+            list: các câu còn lại
+        """
+        sentences = self._scan(final=True)
+        cut = len(self._buffer)
+        if partial:
+            cut = max(self._buffer.rfind(" "), self._buffer.rfind("\n")) + 1
+        sentence = self._buffer[:cut].strip()
+        self._buffer = self._buffer[cut:]
+        self._pos = 0
+        if sentence:
+            sentences.append(self._emit(sentence))
+        return sentences
+
+    def _scan(self, final):
+        sentences = []
+        buffer = self._buffer
+        pos = self._pos
+        while pos < len(buffer):
+            if pos >= self.max_chars:
+                cut = self._soft_break(buffer)
+                sentences.append(self._emit(buffer[:cut].strip()))
+                self.stats["forced"] += 1
+                buffer = buffer[cut:]
+                pos = 0
+                continue
+            if buffer[pos] not in TERMINATORS:
+                pos += 1
+                continue
+
+            end = self._boundary(buffer, pos, final)
+            if end is None:
+                # Chưa đủ text phía sau để quyết định, quét lại từ đây ở lần feed sau
+                break
+            if end == 0:
+                pos += 1
+                continue
+            sentence = buffer[:end].strip()
+            if len(sentence) < self.min_chars:
+                # Câu quá ngắn: gộp với câu sau
+                if sentence:
+                    self.stats["merged"] += 1
+                pos = end
+                continue
+            if sentence:
+                sentences.append(self._emit(sentence))
+            buffer = buffer[end:]
+            pos = 0
+
+        self._buffer = buffer
+        self._pos = pos
+        return sentences
+
+    def _boundary(self, buffer, pos, final):
+        """
+        Xét dấu kết thúc ở vị trí pos
+
+        Returns:
+            int hoặc None: vị trí kết thúc câu (sau dấu câu và dấu đóng), 0 nếu không phải
+            kết thúc câu, None nếu cần thêm text để quyết định
+        """
+        length = len(buffer)
+        char = buffer[pos]
+        if char == "\n":
+            return pos + 1
+
+        if char == ".":
+            if pos + 1 >= length:
+                return length if final else None
+            following = buffer[pos + 1]
+            if following.isalnum():
+                # "10.5", "1.000.000", "TP.HCM", "v.v"
+                return 0
+
+        end = pos + 1
+        while end < length and (buffer[end] in CLOSERS or buffer[end] in ".!?…"):
+            end += 1
+        if end >= length and not final:
+            return None
+        if char != ".":
+            return end
+
+        # Chữ đầu câu sau là chữ thường: dấu chấm thuộc viết tắt
+        start = end
+        while start < length and buffer[start] in " \t":
+            start += 1
+        if start >= length and not final:
+            return None
+        if start < length and buffer[start].islower():
+            return 0
+
+        token_start = pos
+        while token_start > 0 and not buffer[token_start - 1].isspace():
+            token_start -= 1
+        token = buffer[token_start:pos].lstrip("\"'“‘([")
+        if token.lower() in self.abbreviations:
+            return 0
+        if len(token) == 1 and token.isupper():
+            # Chữ viết tắt tên: "Nguyễn V. An"
+            return 0
+        if token.isdigit():
+            line_start = buffer.rfind("\n", 0, token_start) + 1
+            if not buffer[line_start:token_start].strip():
+                # Số thứ tự đầu dòng: "1. Phở bò"
+                return 0
+        return end
+
+    def _soft_break(self, buffer):
+        """
+        Vị trí cắt câu quá dài: sau dấu phẩy/chấm phẩy gần max_chars nhất, rồi tới khoảng trắng
+        """
+        window = buffer[:self.max_chars]
+        half = self.max_chars // 2
+        cut = max(window.rfind(char) for char in SOFT_BREAKS) + 1
+        if cut > half:
+            return cut
+        cut = window.rfind(" ") + 1
+        return cut if cut > half else self.max_chars
+
+    def _emit(self, sentence):
+        self.stats["sentences"] += 1
+        return sentence
+
+
+def segment_text(text, **kwargs):
+    """
+    Tách một đoạn text hoàn chỉnh thành các câu như khi text được stream tới
+    """
+    segmenter = SentenceSegmenter(**kwargs)
+    return segmenter.feed(text) + segmenter.flush()
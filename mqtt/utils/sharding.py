@@ -0,0 +1,22 @@
+"""
+Phân chia thiết bị giữa nhiều process server (worker mode)
+"""
+import zlib
+
+
+def device_shard(device_id, worker_count):
+    """
+    Trả về chỉ số worker sở hữu thiết bị, ổn định giữa các process và lần khởi động
+
+    Dùng crc32 thay cho hash() vì hash() của str bị random hóa theo từng process.
+    """
+    if worker_count <= 1:
+        return 0
+    return zlib.crc32(device_id.encode("utf-8")) % worker_count
+
+
+def shared_topic(group, topic):
+    """
+    Tạo topic shared subscription dạng $share/<group>/<topic> (MQTT v5, mosquitto 2.x)
+    """
+    return f"$share/{group}/{topic}"
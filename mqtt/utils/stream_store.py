@@ -0,0 +1,198 @@
+"""
+Lưu các stream audio đang nhận với hạn sống (heap deadline) và giới hạn bộ nhớ
+"""
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class StreamBufferStore:
+    def __init__(self, ttl=10.0, max_device_bytes=0, max_total_bytes=0, on_evict=None):
+        """
+        Các stream đang ghép, hết hạn trên chính event loop thay vì thread quét định kỳ
+
+        Mỗi stream có deadline = lần nhận chunk cuối + ttl, được đưa vào min-heap.
+        Một timer duy nhất của event loop được hẹn tới deadline sớm nhất; khi stream
+        nhận thêm chunk, deadline được gia hạn và mục cũ trong heap bị bỏ qua lúc pop.
+        Mọi thao tác đều chạy trên event loop nên không cần lock.
+
+        Args:
+            ttl (float): số giây không nhận thêm chunk thì stream hết hạn
+            max_device_bytes (int): tổng bộ nhớ tối đa cho các stream của một thiết bị (0 = không giới hạn)
+            max_total_bytes (int): tổng bộ nhớ tối đa cho mọi stream (0 = không giới hạn)
+            on_evict: callable(key, value, reason) khi stream bị bỏ do hết hạn hoặc vượt giới hạn
+        """
+        self.ttl = ttl
+        self.max_device_bytes = max_device_bytes
+        self.max_total_bytes = max_total_bytes
+        self.on_evict = on_evict
+
+        # key -> [device_id, value, deadline, bytes]; dict giữ thứ tự thêm vào (cũ nhất trước)
+        self._entries = {}
+        # device_id -> {key: None}, các stream của thiết bị theo thứ tự thêm vào
+        self._device_keys = {}
+        self._device_bytes = {}
+        self._total_bytes = 0
+
+        self._heap = []
+        self._sequence = itertools.count()
+        self._timer = None
+        self._timer_deadline = None
+
+        self.stats = {
+            "expired": 0,
+            "evicted_device_cap": 0,
+            "evicted_global_cap": 0,
+            "peak_bytes": 0,
+        }
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self, device_id=None):
+        """
+        Key của mọi stream, hoặc chỉ các stream của device_id (cũ nhất trước)
+        """
+        if device_id is not None:
+            return list(self._device_keys.get(device_id, ()))
+        return list(self._entries)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        return entry[1] if entry is not None else default
+
+    def add(self, key, device_id, value):
+        """
+        Thêm stream mới (gọi trên event loop)
+        """
+        deadline = time.monotonic() + self.ttl
+        self._entries[key] = [device_id, value, deadline, 0]
+        self._device_keys.setdefault(device_id, {})[key] = None
+        self._push(key, deadline)
+        return value
+
+    def touch(self, key):
+        """
+        Gia hạn stream khi nhận thêm chunk
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[2] = time.monotonic() + self.ttl
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        device_id, value, _, size = entry
+        keys = self._device_keys.get(device_id)
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self._device_keys[device_id]
+        self._account(device_id, -size)
+        return value
+
+    def set_size(self, key, size):
+        """
+        Cập nhật bộ nhớ của stream rồi bỏ các stream cũ nhất nếu vượt giới hạn
+
+        Returns:
+            bool: False nếu chính stream này bị bỏ
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        device_id = entry[0]
+        self._account(device_id, size - entry[3])
+        entry[3] = size
+
+        if self.max_device_bytes:
+            while self._device_bytes.get(device_id, 0) > self.max_device_bytes:
+                oldest = next(iter(self._device_keys[device_id]))
+                self._evict(oldest, "device_cap")
+        if self.max_total_bytes:
+            while self._total_bytes > self.max_total_bytes:
+                self._evict(next(iter(self._entries)), "global_cap")
+        return key in self._entries
+
+    def device_bytes(self, device_id):
+        return self._device_bytes.get(device_id, 0)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "streams": len(self._entries),
+            "devices": len(self._device_keys),
+            "bytes": self._total_bytes,
+        }
+
+    def clear(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._entries.clear()
+        self._device_keys.clear()
+        self._device_bytes.clear()
+        self._total_bytes = 0
+        self._heap.clear()
+
+    def _account(self, device_id, delta):
+        if not delta:
+            return
+        device_bytes = self._device_bytes.get(device_id, 0) + delta
+        if device_bytes > 0:
+            self._device_bytes[device_id] = device_bytes
+        else:
+            self._device_bytes.pop(device_id, None)
+        self._total_bytes += delta
+        self.stats["peak_bytes"] = max(self.stats["peak_bytes"], self._total_bytes)
+
+    def _evict(self, key, reason):
+        value = self.pop(key)
+        self.stats[f"evicted_{reason}" if reason != "expired" else "expired"] += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value, reason)
+
+    def _push(self, key, deadline):
+        heapq.heappush(self._heap, (deadline, next(self._sequence), key))
+        if self._timer_deadline is None or deadline < self._timer_deadline:
+            self._schedule(deadline)
+
+    def _schedule(self, deadline):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_deadline = deadline
+        self._timer = asyncio.get_running_loop().call_later(
+            max(0.0, deadline - time.monotonic()), self._expire
+        )
+
+    def _expire(self):
+        """
+        Bỏ các stream đã quá hạn rồi hẹn timer tới deadline sớm nhất còn lại
+        """
+        self._timer = None
+        self._timer_deadline = None
+        now = time.monotonic()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            if entry[2] > now:
+                # Stream đã được gia hạn: đưa lại vào heap với deadline mới
+                heapq.heappush(self._heap, (entry[2], next(self._sequence), key))
+                continue
+            self._evict(key, "expired")
+        # Bỏ các mục của stream đã xong nằm ở đỉnh heap để heap không phình ra
+        while self._heap and self._heap[0][2] not in self._entries:
+            heapq.heappop(self._heap)
+        if self._heap:
+            self._schedule(self._heap[0][0])
@@ -0,0 +1,78 @@
+"""
+Micro-benchmark codec nén audio gửi về thiết bị (tốc độ mã hóa, tỉ lệ nén, SNR)
+
+    python scripts/bench_codec.py --seconds 5 --repeat 10
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mqtt.utils.audio_codec import available_codecs, create_encoder, ima_adpcm_decode  # noqa: E402
+
+SAMPLE_RATES = [16000, 22050, 24000]
+
+
+def make_pcm(seconds, sample_rate, seed=0):
+    """
+    Tín hiệu giống giọng nói: vài họa âm có đường bao biên độ và nhiễu nền, mã hóa PCM16 LE
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate), dtype=np.float32) / sample_rate
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+    signal = envelope * (0.3 * np.sin(2 * np.pi * 180 * t) + 0.1 * np.sin(2 * np.pi * 900 * t))
+    signal += 0.01 * rng.standard_normal(len(t)).astype(np.float32)
+    return (np.clip(signal, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def encode(codec, pcm, sample_rate):
+    encoder = create_encoder([codec], sample_rate)
+    return encoder.name, encoder.encode(pcm) + encoder.flush()
+
+
+def snr_db(pcm, decoded):
+    reference = np.frombuffer(pcm, dtype="<i2").astype(np.float64)
+    decoded = np.frombuffer(decoded, dtype="<i2").astype(np.float64)[:len(reference)]
+    noise = np.mean((reference - decoded) ** 2)
+    return 10 * np.log10(np.mean(reference ** 2) / noise) if noise else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark egress audio codecs")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Độ dài audio mỗi lần chạy")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'codec':>10}{'rate':>7}{'encode(ms)':>12}{'x realtime':>12}{'kbit/s':>9}{'b64 kbit/s':>12}{'SNR(dB)':>9}")
+    for sample_rate in SAMPLE_RATES:
+        pcm = make_pcm(args.seconds, sample_rate)
+        for codec in available_codecs():
+            name, data = encode(codec, pcm, sample_rate)
+            if name != codec:
+                print(f"{codec:>10}{sample_rate:>7}  (not supported at this rate)")
+                continue
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                encode(codec, pcm, sample_rate)
+                timings.append(time.perf_counter() - started)
+            encode_s = sorted(timings)[len(timings) // 2]
+
+            kbps = len(data) * 8 / args.seconds / 1000
+            b64_kbps = len(base64.b64encode(data)) * 8 / args.seconds / 1000
+            # Opus cần bộ giải mã của opuslib nên chỉ đo SNR cho PCM và IMA-ADPCM
+            if codec == "ima-adpcm":
+                snr = snr_db(pcm, ima_adpcm_decode(data))
+            else:
+                snr = float("inf") if codec == "pcm16le" else float("nan")
+            print(f"{codec:>10}{sample_rate:>7}{encode_s * 1000:>12.1f}{args.seconds / encode_s:>12.0f}"
+                  f"{kbps:>9.0f}{b64_kbps:>12.0f}{snr:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark tầng tiền xử lý audio trước STT (giải mã PCM, resample, chuẩn hóa)
+
+    python scripts/bench_dsp.py --seconds 5 --repeat 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from module.stt.dsp import AudioPreprocessor, decode_audio  # noqa: E402
+
+SAMPLE_RATES = [8000, 16000, 22050, 44100, 48000]
+
+
+def make_pcm(seconds, sample_rate, seed=0):
+    """
+    Tín hiệu giống giọng nói: vài họa âm có DC offset và nhiễu nền, mã hóa PCM16 LE
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate), dtype=np.float32) / sample_rate
+    signal = 0.2 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.sin(2 * np.pi * 660 * t)
+    signal += 0.02 * rng.standard_normal(len(t)).astype(np.float32) + 0.05
+    return (np.clip(signal, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def bench(func, repeat):
+    func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark audio DSP stage")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Độ dài audio mỗi lần chạy")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    dsp = AudioPreprocessor()
+    print(f"{'rate':>7}{'decode(ms)':>12}{'process(ms)':>13}{'p95(ms)':>10}{'x realtime':>12}{'gain(dB)':>10}")
+    for sample_rate in SAMPLE_RATES:
+        pcm = make_pcm(args.seconds, sample_rate)
+        samples, _ = decode_audio(pcm, "pcm16le", sample_rate)
+
+        decode_p50, _ = bench(lambda: decode_audio(pcm, "pcm16le", sample_rate), args.repeat)
+        process_p50, process_p95 = bench(lambda: dsp.process(samples, sample_rate), args.repeat)
+        _, result = dsp.process(samples, sample_rate)
+
+        speed = args.seconds / (decode_p50 + process_p50)
+        print(f"{sample_rate:>7}{decode_p50 * 1000:>12.2f}{process_p50 * 1000:>13.2f}"
+              f"{process_p95 * 1000:>10.2f}{speed:>12.0f}{result.gain_db:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Micro-benchmark tách câu cho TTS: cách cũ (quét lại cả buffer mỗi chunk, cắt ở mọi dấu chấm)
+so với SentenceSegmenter (quét tăng dần, quy tắc tiếng Việt, gộp câu ngắn)
+
+    python scripts/bench_segmenter.py --paragraphs 20 --chunk-chars 4
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mqtt.utils.segmenter import SentenceSegmenter  # noqa: E402
+
+# Đoạn trả lời mẫu có số thập phân, giờ, viết tắt, danh sách và câu ngắn
+PARAGRAPH = (
+    "Dạ. Nhiệt độ hiện tại ở TP. Hồ Chí Minh là 32.5 độ C, độ ẩm khoảng 70%. "
+    "Chiều nay lúc 15.30 có thể có mưa rào. Vâng! "
+    "Giá xăng RON 95 hôm nay là 23.450 đồng/lít, theo thông báo của Bộ Công Thương. "
+    "Bạn nên mang theo:\n1. Áo mưa\n2. Nước uống\n3. Kem chống nắng\n"
+    "Theo ThS. Nguyễn V. An, thời tiết sẽ mát hơn vào cuối tuần... Bạn cần gì thêm không? "
+)
+
+
+def split_rescan(chunks):
+    """
+    Cách cũ của _sentence_stream_worker: quét lại toàn bộ buffer mỗi khi nhận chunk
+    """
+    sentences = []
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        for i, ch in enumerate(buffer):
+            if ch in ".!?\n":
+                sentences.append(buffer[start:i + 1].strip())
+                start = i + 1
+        buffer = buffer[start:]
+    if buffer.strip():
+        sentences.append(buffer.strip())
+    return [sentence for sentence in sentences if sentence]
+
+
+def split_segmenter(chunks):
+    segmenter = SentenceSegmenter()
+    sentences = []
+    for chunk in chunks:
+        sentences.extend(segmenter.feed(chunk))
+    return sentences + segmenter.flush()
+
+
+def bad_splits(sentences):
+    """
+    Số chỗ cắt sai: giữa hai chữ số ("32." | "5 độ") hoặc ngay sau viết tắt/chữ cái đầu tên
+    """
+    count = 0
+    for current, following in zip(sentences, sentences[1:]):
+        if re.search(r"\d\.$", current) and following[:1].isdigit():
+            count += 1
+        elif re.search(r"(^|\s)(TP|ThS|[A-ZĐ])\.$", current):
+            count += 1
+    return count
+
+
+def bench(func, chunks, repeat):
+    func(chunks)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(chunks)
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sentence segmentation for TTS")
+    parser.add_argument("--paragraphs", type=int, default=20, help="Số đoạn mẫu ghép thành một câu trả lời")
+    parser.add_argument("--chunk-chars", type=int, default=4, help="Số ký tự mỗi chunk LLM stream")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'paragraphs':>10}{'method':>11}{'time(ms)':>10}{'us/chunk':>10}{'requests':>10}"
+          f"{'avg chars':>11}{'<16 chars':>11}{'bad splits':>12}")
+    for paragraphs in sorted({1, max(1, args.paragraphs // 4), args.paragraphs}):
+        text = PARAGRAPH * paragraphs
+        chunks = [text[i:i + args.chunk_chars] for i in range(0, len(text), args.chunk_chars)]
+        for name, func in (("rescan", split_rescan), ("segmenter", split_segmenter)):
+            elapsed = bench(func, chunks, args.repeat)
+            sentences = func(chunks)
+            short = sum(len(sentence) < 16 for sentence in sentences)
+            average = sum(map(len, sentences)) / len(sentences)
+            print(f"{paragraphs:>10}{name:>11}{elapsed * 1000:>10.2f}{elapsed * 1e6 / len(chunks):>10.1f}"
+                  f"{len(sentences):>10}{average:>11.1f}{short:>11}{bad_splits(sentences):>12}")
+
+
+if __name__ == "__main__":
+    main()
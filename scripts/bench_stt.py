@@ -0,0 +1,124 @@
+"""
+Benchmark các backend STT trên một tập WAV cố định: real-time factor, peak RSS và WER
+
+Mỗi file <name>.wav cần có file <name>.txt cùng thư mục chứa transcript chuẩn.
+
+    python scripts/bench_stt.py --data-dir audio/bench --backends phowhisper,phowhisper-int8
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_PUNCTUATION = re.compile(r"[^\w\s]", re.UNICODE)
+
+
+def normalize_words(text):
+    return _PUNCTUATION.sub(" ", text.lower()).split()
+
+
+def word_errors(reference, hypothesis):
+    """
+    Khoảng cách Levenshtein theo từ giữa transcript chuẩn và kết quả nhận dạng
+    """
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            )
+        previous = current
+    return previous[-1]
+
+
+def load_dataset(data_dir):
+    import soundfile as sf
+
+    samples = []
+    for wav_path in sorted(glob.glob(os.path.join(data_dir, "*.wav"))):
+        txt_path = os.path.splitext(wav_path)[0] + ".txt"
+        if not os.path.exists(txt_path):
+            print(f"Skip {wav_path}: missing {txt_path}")
+            continue
+        audio, sample_rate = sf.read(wav_path, dtype="float32", always_2d=True)
+        with open(txt_path, encoding="utf-8") as f:
+            reference = f.read().strip()
+        samples.append((os.path.basename(wav_path), audio.mean(axis=1), sample_rate, reference))
+    return samples
+
+
+def peak_rss_mb():
+    # ru_maxrss tính theo KB trên Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(backend, data_dir, results):
+    """
+    Chạy trong process con để peak RSS của mỗi backend được đo riêng
+    """
+    from module.stt.registry import create_backend
+
+    dataset = load_dataset(data_dir)
+
+    load_started = time.perf_counter()
+    stt = create_backend(backend, device="cpu", warmup=True)
+    load_seconds = time.perf_counter() - load_started
+
+    audio_seconds = 0.0
+    process_seconds = 0.0
+    errors = 0
+    reference_words = 0
+    for name, audio, sample_rate, reference in dataset:
+        started = time.perf_counter()
+        hypothesis = stt.get_text_from_audio(audio, sample_rate=sample_rate)
+        elapsed = time.perf_counter() - started
+
+        audio_seconds += len(audio) / sample_rate
+        process_seconds += elapsed
+        ref_words = normalize_words(reference)
+        errors += word_errors(ref_words, normalize_words(hypothesis))
+        reference_words += len(ref_words)
+        print(f"[{backend}] {name}: {elapsed:.2f}s | {hypothesis}")
+
+    results[backend] = {
+        "files": len(dataset),
+        "load_s": load_seconds,
+        "audio_s": audio_seconds,
+        "rtf": process_seconds / audio_seconds if audio_seconds else 0.0,
+        "wer": errors / reference_words if reference_words else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark STT backends")
+    parser.add_argument("--data-dir", required=True, help="Thư mục chứa các cặp <name>.wav/<name>.txt")
+    parser.add_argument("--backends", default="phowhisper,phowhisper-int8")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    manager = ctx.Manager()
+    results = manager.dict()
+    for backend in args.backends.split(","):
+        process = ctx.Process(target=run_backend, args=(backend.strip(), args.data_dir, results))
+        process.start()
+        process.join()
+
+    print()
+    print(f"{'backend':<18}{'files':>6}{'load(s)':>10}{'audio(s)':>10}{'RTF':>8}{'WER':>8}{'peakRSS(MB)':>13}")
+    for backend, r in results.items():
+        print(f"{backend:<18}{r['files']:>6}{r['load_s']:>10.1f}{r['audio_s']:>10.1f}"
+              f"{r['rtf']:>8.3f}{r['wer']:>8.3f}{r['peak_rss_mb']:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()